@@ -599,6 +599,12 @@ const demoTrial = {
     }
 };
 
+// Trials with a SoundFile column share one content-addressed sound in sequences/trial_sound_cache/
+function trialSoundUrl(block_folder, row, i) {
+    if (row && row.SoundFile) return `${base_url}sequences/${row.SoundFile}`;
+    return `${block_folder}s_${i}.wav`;
+}
+
 function buildAndRunExperiment(all_blocks_data, start_block) {
     for (let item of all_blocks_data) { global_all_blocks_data[item.block] = item.data; }
     let timeline = [];
@@ -617,7 +623,7 @@ function buildAndRunExperiment(all_blocks_data, start_block) {
         // 1. Preload Audio Files
         let audio_files = [];
         for (let i = 0; i < trial_data.length; i++) {
-            audio_files.push(`${b_audio_folder}s_${i}.wav`);
+            audio_files.push(trialSoundUrl(b_audio_folder, trial_data[i], i));
         }
         
         if (current_block_num === 0) {
@@ -959,7 +965,7 @@ function buildAndRunExperiment(all_blocks_data, start_block) {
                     type: jsPsychAudioButtonResponse,
                     stimulus: function() {
                         let i = jsPsych.timelineVariable('original_index', true);
-                        return `${b_audio_folder}s_${i}.wav`;
+                        return trialSoundUrl(b_audio_folder, trial_data[i], i);
                     },
                     choices: ['1', '2', '3', '4', '5', '6', '7', '8', '9'],
                     button_html: '<button class="jspsych-btn virtual-response-box">%choice%</button>',
@@ -5,10 +5,8 @@ import argparse
 
 # Ensure utils and SPACECUE are found
 sys.path.append('..')
-import utils.utils
-utils.utils.get_input_from_dict = lambda d, **kwargs: {"subject_id": 99, "block": 0}
 
-from SPACECUE.generate_subject_sequence import precompute_sequence
+from SPACECUE.generate_subject_sequence import precompute_cohort
 from SPACECUE import upload_to_cloudflare
 
 def main():
@@ -17,6 +15,16 @@ def main():
                         help="List of subject IDs (e.g., 08 09 10)")
     parser.add_argument("--skip-sounds", action="store_true",
                         help="Skip sound generation (CSV only)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes for (subject, block) jobs (default: 1, i.e. serial)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Base seed of the run. Output is identical for any number of workers.")
+    parser.add_argument("--block-container", action="store_true",
+                        help="Also pack each block's trial sounds into one memory-mappable file")
+    parser.add_argument("--no-snr", action="store_true",
+                        help="Do not write the per-block SNR files")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate all blocks, even those the subject manifest marks as up to date")
     
     args = parser.parse_args()
     
@@ -30,9 +38,12 @@ def main():
         settings["session"]["max_consecutive_trial_type_cues"] = 5
         
     print(f"Starting sequence generation for {len(args.subjects)} subjects...")
-    for sub in args.subjects:
-        print(f"Generating sequences for subject {sub}...")
-        precompute_sequence(subject_id=sub, block=0, settings=settings, skip_sound_generation=args.skip_sounds)
+    seeds = precompute_cohort(args.subjects, settings, block=0, skip_sound_generation=args.skip_sounds,
+                              compute_snr=not args.no_snr,
+                              seed=args.seed, workers=args.workers, block_container=args.block_container, force=args.force)
+    # subjects with a manifest keep their recorded seed unless --seed is given, so the seeds can differ
+    for subject_id, seed in seeds.items():
+        print(f"Base seed of subject {subject_id}: {seed}")
         
     print("\n--- Generation Complete ---\n")
     print("Starting Cloudflare Upload...")
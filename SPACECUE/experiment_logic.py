@@ -8,11 +8,106 @@ os.environ["SD_ENABLE_ASIO"] = "1"
 import SPACECUE.prompts as prompts
 import pandas as pd
 from utils.sound import SoundDeviceSound as Sound
+from utils.sound_bank import load_sound_bank
+from utils.block_prefetcher import BlockPrefetcher
+from utils.audio_engine import AudioEngine
+from utils.trigger_scheduler import TriggerScheduler, MockParallelPort
+from utils.frame_profiler import FrameProfiler
+from utils.trial_store import TrialStore
+from utils.response_box_index import ResponseBoxIndex
+from utils.static_layer import StaticLayer
 from psychopy import parallel, core, event
 import random
 import numpy as np
 from SPACECUE.encoding import *
 import csv
+import collections
+
+
+CuePlan = collections.namedtuple("CuePlan", ["cued_index", "colors"])
+
+
+def compile_cue_plan(trial_info):
+    """
+    Works out once per trial how the three cue arrows are coloured.
+
+    Args:
+        trial_info: row of the trial sequence, anything with .get() (pandas.Series, dict).
+
+    Returns:
+        CuePlan: index of the cued arrow (0=left, 1=up, 2=right, None if no arrow is cued) and the colour
+            of every arrow.
+    """
+    # --- 1. Get trial information ---
+    # Using .get() is good practice for robustness if a column might be missing
+    cue_color_str = trial_info.get("Color", "target-white-distractor-white")  # Provide a default
+    cue_instruction = trial_info.get("CueInstruction", "cue_neutral")  # Provide a default
+    singleton_loc_raw = trial_info.get("SingletonLoc")
+
+    # --- 2. Parse the color string and define neutral color ---
+    target_color = 'white'  # Default
+    distractor_color = 'white'  # Default
+    neutral_color = 'white'  # Color for non-highlighted arrows
+
+    try:
+        color_parts = cue_color_str.split('-')
+        if 'target' in color_parts:
+            try:
+                target_index = color_parts.index('target')
+                if target_index + 1 < len(color_parts):  # Check if color name exists
+                    target_color = color_parts[target_index + 1]
+                else:
+                    print(f"    Warning: Target color name missing after 'target' in '{cue_color_str}'.")
+            except (ValueError, IndexError):  # Catch if 'target' not found or index out of bounds
+                print(f"    Warning: Could not parse target color from '{cue_color_str}'.")
+
+        if 'distractor' in color_parts:
+            try:
+                distractor_index = color_parts.index('distractor')
+                if distractor_index + 1 < len(color_parts):  # Check if color name exists
+                    distractor_color = color_parts[distractor_index + 1]
+                else:
+                    print(f"    Warning: Distractor color name missing after 'distractor' in '{cue_color_str}'.")
+            except (ValueError, IndexError):  # Catch if 'distractor' not found or index out of bounds
+                print(f"    Warning: Could not parse distractor color from '{cue_color_str}'.")
+    except Exception as e:
+        print(f"    Error parsing color string '{cue_color_str}': {e}. Using default colors.")
+        target_color = 'white'
+        distractor_color = 'white'
+
+    # --- 3. Determine the cued location index and cue type ---
+    cued_index = None  # Index of the arrow to be cued (0=left, 1=up, 2=right)
+    cue_type = 'neutral'  # Overall type of cueing for this trial
+
+    if "cue_nonsingleton_location" in cue_instruction:
+        cue_type = 'nonsingleton'
+        nonsingleton_loc_raw = trial_info.get("Non-Singleton2Loc")
+        if nonsingleton_loc_raw is not None:
+            try:
+                cued_index = int(nonsingleton_loc_raw) - 1  # Explicitly convert to int
+            except (ValueError, TypeError):
+                print(
+                    f"    WARNING: Could not convert Non-Singleton2Loc '{nonsingleton_loc_raw}' to int. Cueing might be incorrect.")
+                cued_index = None  # Invalidate if conversion fails
+        else:
+            print(f"    WARNING: Non-Singleton2Loc is None for a 'cue_nonsingleton_location' instruction.")
+    elif "cue_distractor_location" in cue_instruction:
+        cue_type = 'distractor'
+        if singleton_loc_raw is not None:
+            try:
+                cued_index = int(singleton_loc_raw) - 1  # Explicitly convert to int
+            except (ValueError, TypeError):
+                print(
+                    f"    WARNING: Could not convert SingletonLoc '{singleton_loc_raw}' to int. Cueing might be incorrect.")
+                cued_index = None  # Invalidate if conversion fails
+        else:
+            print(f"    WARNING: SingletonLoc is None for a 'cue_distractor_location' instruction.")
+
+    # --- 4. Colour the cued arrow, all others stay neutral ---
+    colors = [neutral_color] * 3
+    if cue_type in ['nonsingleton', 'distractor'] and cued_index is not None and 0 <= cued_index < 3:
+        colors[cued_index] = target_color if cue_type == 'nonsingleton' else distractor_color
+    return CuePlan(cued_index, tuple(colors))
 
 
 class SpaceCueTrial(Trial):
@@ -22,31 +117,44 @@ class SpaceCueTrial(Trial):
         # HACKY AND NOT RECOMMENDED --> special case to implement ITI jitter
         # add ITI jitter to the trial
         # self.phase_names.append("iti")
-        self.phase_durations[-1] = self.session.sequence["ITI-Jitter"].iloc[trial_nr]
-        self.phase_durations[1] = self.session.sequence["cue_stim_delay_jitter"].iloc[trial_nr]
+        self.phase_durations[-1] = self.parameters["ITI-Jitter"]
+        self.phase_durations[1] = self.parameters["cue_stim_delay_jitter"]
         self.trigger_name = None  # this holds the trial-specific trigger name encoding
+        self.cue_plan = None  # CuePlan, compiled in create_trials
 
         # Initialize response-related flags
         self._response_recorded = False
         self._clicked_on_target_for_response = False # True if the recorded response was on a valid target area
 
     def send_trig_and_sound(self):
-        self.stim.play(latency="low", blocksize=0)  # not sure whether this does anything ...
-        self.wait(delay_ms=80)  # wait for 80 ms because of constant internal delay
-        self.session.send_trigger(trigger_name=self.trigger_name)
+        engine = self.session.audio_engine
+        if engine is not None:
+            # the scheduler thread fires the trigger when the sound's first sample reaches the DAC
+            voice = self.stim.play(when=engine.time() + engine.lead_time)
+            self.session.trigger_scheduler.schedule(EEG_TRIGGER_MAP[self.trigger_name], voice=voice,
+                                                    name=self.trigger_name, block=self.session.this_block,
+                                                    trial_nr=self.trial_nr)
+        else:
+            self.stim.play(latency="low", blocksize=0)  # not sure whether this does anything ...
+            # fires once the calibrated output latency of the device (default 80 ms) has passed, without waiting here
+            self.session.send_trigger(trigger_name=self.trigger_name, delay=self.stim.latency)
 
     def draw(self):
+        profiler = self.session.frame_profiler
+        profiler.begin_frame(self.session.this_block, self.trial_nr, self.phase)
         # Track the mouse position (e.g., for checking if it's over the box) IN EVERY PHASE
         self.track_mouse_pos()  # Assuming this method updates mouse-related state
+        profiler.mark("mouse")
 
         # --- Phase 0: Display the cue ---
         if self.phase == 0:
-            self.session.default_fix.draw()
             self.display_cue_interval()
+            profiler.mark("visuals")
 
         # --- Phase 1: Wait period / Display default fixation ---
         elif self.phase == 1:  # Changed to elif for clarity if phases are mutually exclusive per frame
-            self.session.default_fix.draw()
+            self.session.fixation_layer.draw()
+            profiler.mark("visuals")
 
         # --- Phases 2 and onwards: Stimulus presentation, response, feedback, etc. ---
         elif self.phase >= 2:  # Changed to elif
@@ -63,7 +171,8 @@ class SpaceCueTrial(Trial):
 
             # If using a keypad and fixation is needed during response phases, draw it.
             elif self.session.response_device == "keypad":  # Changed to elif
-                self.session.default_fix.draw()  # Draw fixation
+                self.session.fixation_layer.draw()  # Draw fixation
+            profiler.mark("visuals")
 
             # --- Logic specific to the *start* of Phase 2 ---
             if self.phase == 2 and (not hasattr(self, '_phase2_setup_done') or not self._phase2_setup_done):
@@ -79,6 +188,7 @@ class SpaceCueTrial(Trial):
                 if not hasattr(self, '_stim_triggered') or not self._stim_triggered:
                     self.send_trig_and_sound()
                     self._stim_triggered = True
+                profiler.mark("sound")
 
             # --- Response handling in Phase 3 (main response window) ---
             # Check for mouse press response if using mouse and no response yet recorded
@@ -88,12 +198,7 @@ class SpaceCueTrial(Trial):
                     # We check if any button in the first list element (buttons) is pressed.
                     buttons_pressed, _ = self.session.mouse.getPressed(getTime=True)
                     if any(buttons_pressed):
-                        clicked_on_target_area = False
-                        if hasattr(self.session, 'virtual_response_box') and self.session.virtual_response_box:
-                            for stim_in_box in self.session.virtual_response_box:
-                                if stim_in_box.contains(self.session.mouse):
-                                    clicked_on_target_area = True
-                                    break
+                        clicked_on_target_area = self.hit_test_click()
 
                         if clicked_on_target_area:
                             self._response_recorded = True
@@ -104,6 +209,7 @@ class SpaceCueTrial(Trial):
                             # In phase 3, an off-target click is NOT recorded as a response.
                             # _response_recorded remains False. Cursor remains visible (due to general logic).
                             pass
+                profiler.mark("response")
 
                             # --- Phase 4: Post-response or Timeout handling ---
         if self.phase == 4:  # This should be independent of the previous elif self.phase >= 2
@@ -123,12 +229,7 @@ class SpaceCueTrial(Trial):
                     if not self._response_recorded:
                         self._response_recorded = True  # A response (late) is now being recorded
 
-                        clicked_on_target_area_late = False
-                        if hasattr(self.session, 'virtual_response_box') and self.session.virtual_response_box:
-                            for stim_in_box in self.session.virtual_response_box:
-                                if stim_in_box.contains(self.session.mouse):
-                                    clicked_on_target_area_late = True
-                                    break
+                        clicked_on_target_area_late = self.hit_test_click()
 
                         if clicked_on_target_area_late:
                             self._clicked_on_target_for_response = True
@@ -142,99 +243,35 @@ class SpaceCueTrial(Trial):
                 if hasattr(self.session, 'virtual_response_box') and self.session.virtual_response_box:
                     if self.session.virtual_response_box:  # Ensure list is not empty
                         self.session.virtual_response_box[0].lineColor = "darkorange"
+            profiler.mark("response")
+        profiler.end_frame()
+
+    def hit_test_click(self):
+        """
+        Resolves the mouse position of a click to a digit of the response box and logs both.
+
+        Returns:
+            bool: `True` if the click hit a digit or the guide of the response box.
+        """
+        pos = self.session.mouse.getPos()
+        self.parameters.update(Click_pos_x=pos[0], Click_pos_y=pos[1])
+        hit = self.session.response_index.lookup(pos) if self.session.response_index else None
+        if hit is not None:
+            digit, x, y = hit
+            self.parameters.update(ClickedDigit=digit, ClickedDigit_pos_x=x, ClickedDigit_pos_y=y)
+            return True
+        # the guide is not a digit, but clicks on it still count as on the box, as before
+        return bool(self.session.virtual_response_box) and self.session.virtual_response_box[0].contains(pos)
 
     def display_cue_interval(self):
-        # --- 1. Get trial information ---
-        # Access data from the current trial's data handler
-        # Using .get() is good practice for robustness if a column might be missing
-        cue_color_str = self.session.sequence.iloc[self.trial_nr].get("Color",
-                                                                      "target-white-distractor-white")  # Provide a default
-        cue_instruction = self.session.sequence.iloc[self.trial_nr].get("CueInstruction",
-                                                                        "cue_neutral")  # Provide a default
-        target_loc_raw = self.session.sequence.iloc[self.trial_nr].get("TargetLoc")
-        singleton_loc_raw = self.session.sequence.iloc[self.trial_nr].get("SingletonLoc")
-
-        # --- 2. Parse the color string and define neutral color ---
-        target_color = 'white'  # Default
-        distractor_color = 'white'  # Default
-        neutral_color = 'white'  # Color for non-highlighted arrows
-
-        try:
-            color_parts = cue_color_str.split('-')
-            if 'target' in color_parts:
-                try:
-                    target_index = color_parts.index('target')
-                    if target_index + 1 < len(color_parts):  # Check if color name exists
-                        target_color = color_parts[target_index + 1]
-                    else:
-                        print(f"    Warning: Target color name missing after 'target' in '{cue_color_str}'.")
-                except (ValueError, IndexError):  # Catch if 'target' not found or index out of bounds
-                    print(f"    Warning: Could not parse target color from '{cue_color_str}'.")
-
-            if 'distractor' in color_parts:
-                try:
-                    distractor_index = color_parts.index('distractor')
-                    if distractor_index + 1 < len(color_parts):  # Check if color name exists
-                        distractor_color = color_parts[distractor_index + 1]
-                    else:
-                        print(f"    Warning: Distractor color name missing after 'distractor' in '{cue_color_str}'.")
-                except (ValueError, IndexError):  # Catch if 'distractor' not found or index out of bounds
-                    print(f"    Warning: Could not parse distractor color from '{cue_color_str}'.")
-        except Exception as e:
-            print(f"    Error parsing color string '{cue_color_str}': {e}. Using default colors.")
-            target_color = 'white'
-            distractor_color = 'white'
-
-        # --- 3. Determine the cued location index and cue type ---
-        cued_index = None  # Index of the arrow to be cued (0=left, 1=up, 2=right)
-        cue_type = 'neutral'  # Overall type of cueing for this trial
-
-        if "cue_nonsingleton_location" in cue_instruction:
-            cue_type = 'nonsingleton'
-            nonsingleton_loc_raw = self.session.sequence.iloc[self.trial_nr].get("Non-Singleton2Loc")
-            if nonsingleton_loc_raw is not None:
-                try:
-                    cued_index = int(nonsingleton_loc_raw) - 1  # Explicitly convert to int
-                except (ValueError, TypeError):
-                    print(
-                        f"    WARNING: Could not convert Non-Singleton2Loc '{nonsingleton_loc_raw}' to int. Cueing might be incorrect.")
-                    cued_index = None  # Invalidate if conversion fails
-            else:
-                print(f"    WARNING: Non-Singleton2Loc is None for a 'cue_nonsingleton_location' instruction.")
-        elif "cue_distractor_location" in cue_instruction:
-            cue_type = 'distractor'
-            if singleton_loc_raw is not None:
-                try:
-                    cued_index = int(singleton_loc_raw) - 1  # Explicitly convert to int
-                except (ValueError, TypeError):
-                    print(
-                        f"    WARNING: Could not convert SingletonLoc '{singleton_loc_raw}' to int. Cueing might be incorrect.")
-                    cued_index = None  # Invalidate if conversion fails
-            else:
-                print(f"    WARNING: SingletonLoc is None for a 'cue_distractor_location' instruction.")
-
-        # --- 4. Set colors, draw all arrows, and display ---
-        if not hasattr(self.session, 'arrows') or not isinstance(self.session.arrows, (list, tuple)) or len(
-                self.session.arrows) < 3:
-            print("  ERROR: self.session.arrows is not a list/tuple containing at least 3 arrow stimulus objects.")
-            return
-
-        for i, arrow in enumerate(self.session.arrows):
-            current_arrow_color = neutral_color  # Default to neutral
-
-            if cue_type == 'neutral':
-                current_arrow_color = neutral_color
-            elif cue_type in ['nonsingleton', 'distractor']:
-                # Only color if cued_index is valid and matches the current arrow's index
-                if cued_index is not None and i == cued_index:
-                    if cue_type == 'nonsingleton':
-                        current_arrow_color = target_color
-                    else:  # cue_type is 'distractor'
-                        current_arrow_color = distractor_color
-
-            arrow.setFillColor(current_arrow_color)
-            arrow.setLineColor(current_arrow_color)
-            arrow.draw()
+        # the cue colours were compiled in create_trials, so a frame only recolours arrows whose colour
+        # differs from what the previous trial left on them, and then draws them with the fixation
+        for i, (arrow, color) in enumerate(zip(self.session.arrows, self.cue_plan.colors)):
+            if self.session.arrow_colors[i] != color:
+                arrow.setFillColor(color)
+                arrow.setLineColor(color)
+                self.session.arrow_colors[i] = color
+        self.session.cue_layer.draw()
 
 class SpaceCueSession(Session):
     def __init__(self, output_str, output_dir=None, settings_file=None, starting_block=0, test=False, demographics=None):
@@ -252,38 +289,76 @@ class SpaceCueSession(Session):
         self.this_block = None
         self.subject_id = int(self.output_str.split("-")[1])
         self.subj_id_is_even = True if self.subject_id % 2 == 0 else False
-        self.targets = [Sound(filename=os.path.join("../SPACECUE/stimuli/targets_low_30_Hz", x),
-                              device=self.settings["soundconfig"]["device"],
-                              mul=self.settings["soundconfig"]["mul"]) for x in
-                        os.listdir(f"../SPACECUE/stimuli/targets_low_30_Hz")]
-        self.controls = [Sound(filename=os.path.join("../SPACECUE/stimuli/digits_all_250ms", x),
-                               device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"]) for x in
-                         os.listdir(f"../SPACECUE/stimuli/digits_all_250ms")]
+        # one output stream for the whole session instead of one per sound
+        self.audio_engine = None
+        if self.settings["soundconfig"].get("engine"):
+            n_channels = self.settings["session"]["n_locations"] if self.settings["mode"]["freefield"] else 2
+            self.audio_engine = AudioEngine(samplerate=self.settings["session"]["samplerate"],
+                                            channels=self.settings["soundconfig"].get("channels", n_channels),
+                                            device=self.settings["soundconfig"]["device"],
+                                            backend=self.settings["soundconfig"]["engine"],
+                                            filename=os.path.join(self.output_dir, f"{self.output_str}_audio.wav"))
+        self.prefetcher = BlockPrefetcher(mul=0 if self.audio_engine else self.settings["soundconfig"]["mul"])
+        self.targets = load_sound_bank("../SPACECUE/stimuli/targets_low_30_Hz", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+            device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
+        self.controls = load_sound_bank("../SPACECUE/stimuli/digits_all_250ms", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+            device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
         if self.settings["mode"]["record_eeg"]:
             self.port = parallel.ParallelPort(0xCFF8)  # set address of port
+        # sound triggers are timed on the stream clock of the engine, so block and trial triggers share it
+        clock = core.getTime if self.audio_engine is None else self.audio_engine.time
+        port = self.port if self.settings["mode"]["record_eeg"] else MockParallelPort(clock=clock)
+        self.trigger_scheduler = TriggerScheduler(port, clock=clock)
+        self.frame_profiler = FrameProfiler(steps=("visuals", "mouse", "sound", "response"),
+                                            frame_duration=self.win.monitorFramePeriod,
+                                            enabled=self.settings["mode"].get("profile_frames", False))
         self.arrows = create_shape_stims(self.win, arrow_size=self.settings["session"]["arrow_size"],
                                          arrow_offset=self.settings["session"]["arrow_offset"])
+        self.arrow_colors = [None] * len(self.arrows)  # colour currently set on every arrow
+        static_layers = self.settings["mode"].get("static_layers", False)
+        self.fixation_layer = StaticLayer(self.win, [self.default_fix], enabled=static_layers)
+        self.cue_layer = StaticLayer(self.win, [self.default_fix] + list(self.arrows), enabled=static_layers)
+        self.response_box_layer = StaticLayer(self.win, getattr(self, "virtual_response_box", None) or [],
+                                              enabled=static_layers)
+        # the digits of the response box never move here, so one hit-test index serves the whole session
+        self.response_index = None
+        if getattr(self, "virtual_response_box", None):
+            self.response_index = ResponseBoxIndex(self.virtual_response_box[1:],
+                                                   hit_radius=self.settings["numpad"].get("hit_radius"))
 
     def display_response_box(self):
-        for stimulus in self.virtual_response_box:
-            stimulus.draw()
+        self.response_box_layer.draw()
+
+    def n_loudspeakers(self):
+        """Loudspeakers the demo and the accuracy test pick from: 3, or fewer if the engine has fewer channels."""
+        return 3 if self.audio_engine is None else min(3, self.audio_engine.channels)
+
+    def get_blockdir(self, block):
+        return os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+
+    def prefetch_block(self, block, n_trials=None):
+        """Starts loading the trial sounds of `block` in the background, if the block exists."""
+        if block in self.blocks:
+            self.prefetcher.prefetch(self.get_blockdir(block), n_trials or self.n_trials)
 
     def set_block(self, block):
-        self.blockdir = os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+        self.blockdir = self.get_blockdir(block)
         self.display_text(text=f"Initialisiere Block {block+1} von insgesamt {max(self.blocks)+1}... ",
                           duration=3.0)
         self.this_block = block
 
     def load_sequence(self):
         self.sequence = pd.read_csv(self.blockdir + ".csv")
+        # typed arrays the trials read their parameters from, instead of one pandas row each
+        self.trial_store = TrialStore(self.sequence)
 
     def create_trials(self, n_trials, durations, timing="seconds"):
         self.trials = []
+        # pre-gained trial sounds, ready at once if the block was prefetched
+        block_audio = self.prefetcher.get(self.blockdir, n_trials)
         for trial_nr in range(n_trials):
-            trial_params = dict(self.sequence.iloc[trial_nr],
-                                block=self.this_block,
-                                subject_id=self.subject_id)
+            trial_params = self.trial_store[trial_nr]
+            trial_params.update(block=self.this_block, subject_id=self.subject_id)
             if self.demographics:
                 trial_params.update(self.demographics)
                 
@@ -295,10 +370,11 @@ class SpaceCueSession(Session):
                                     verbose=True,
                                     timing=timing,
                                     draw_each_frame=True)
-            sound_path = os.path.join(trial.session.blockdir, f"s_{trial.trial_nr}.wav")  # s_0, s_1, ... .wav
-            trial.stim = Sound(filename=sound_path, device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"])
+            data, samplerate = block_audio[trial_nr]
+            trial.stim = Sound(data=data, sr=samplerate, device=self.settings["soundconfig"]["device"],
+                               mul=self.settings["soundconfig"]["mul"] - self.prefetcher.mul, engine=self.audio_engine)
             trial.trigger_name = f'Target-{int(trial.parameters["TargetLoc"])}-Singleton-{int(trial.parameters["SingletonLoc"])}-{PRIMING[trial.parameters["Priming"]]}'
+            trial.cue_plan = compile_cue_plan(trial_params)
             self.trials.append(trial)
 
     def display_pages(self, pages, height=0.5):
@@ -330,6 +406,8 @@ class SpaceCueSession(Session):
 
     def run(self, starting_block):
         # self.send_trigger("experiment_onset")  # We do not need this since this was not recorded in SPACEPRIME, anyway.
+        # the first block loads while consent, screening and instructions are shown
+        self.prefetch_block(1 if self.test else starting_block, n_trials=15 if self.test else None)
         # --- STUDY INFO & CONSENT ---
         if starting_block == 0:
             from psychopy import event, core
@@ -362,7 +440,7 @@ class SpaceCueSession(Session):
             # --- Headphone & Volume Check ---
             test_sound_path = os.path.join(self.blockdir, "s_0.wav")
             test_sound = Sound(filename=test_sound_path, device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"])
+                               mul=self.settings["soundconfig"]["mul"], engine=self.audio_engine)
             headphone_text = """
 Kopfhörer-Test & Lautstärke
 
@@ -403,7 +481,7 @@ Drücken Sie LEERTASTE, um zu beginnen.
 
             loc_trials = [("4_loc1.wav", "left"), ("7_loc3.wav", "right"), ("2_loc2.wav", "down")]
             for file, correct_key in loc_trials:
-                snd = Sound(filename=os.path.join("screening_stimuli", file), device=self.settings["soundconfig"]["device"], mul=self.settings["soundconfig"]["mul"])
+                snd = Sound(filename=os.path.join("screening_stimuli", file), device=self.settings["soundconfig"]["device"], mul=self.settings["soundconfig"]["mul"], engine=self.audio_engine)
                 snd.play()
                 prompt_stim = TextStim(self.win, text="Woher kam der Ton?\n(Linke Pfeiltaste = Links, Pfeil runter = Mitte, Rechte Pfeiltaste = Rechts)\n\nDrücken Sie 'p' um den Ton erneut abzuspielen.", height=0.5, wrapWidth=30)
                 prompt_stim.draw()
@@ -429,7 +507,7 @@ Drücken Sie LEERTASTE, um zu beginnen.
             
             id_trials = [("8_loc2.wav", "8"), ("3_loc1.wav", "3"), ("5_loc3.wav", "5")]
             for file, correct_id in id_trials:
-                snd = Sound(filename=os.path.join("screening_stimuli", file), device=self.settings["soundconfig"]["device"], mul=self.settings["soundconfig"]["mul"])
+                snd = Sound(filename=os.path.join("screening_stimuli", file), device=self.settings["soundconfig"]["device"], mul=self.settings["soundconfig"]["mul"], engine=self.audio_engine)
                 snd.play()
                 prompt_stim = TextStim(self.win, text="Welche Zahl haben Sie gehört? (Zifferntasten 1-9)\n\nDrücken Sie 'p' um den Ton erneut abzuspielen.", height=0.5, wrapWidth=30)
                 prompt_stim.draw()
@@ -519,6 +597,7 @@ Drücken Sie eine beliebige Taste zum Beenden.
                                               self.settings["session"]["response_duration"],
                                               None),
                                    timing=self.settings["session"]["timing"])
+                self.prefetch_block(block + 1)
                 if block == starting_block:
                     self.start_experiment()
                 else:
@@ -529,6 +608,7 @@ Drücken Sie eine beliebige Taste zum Beenden.
                     trial.run()
                 self.send_trigger("block_offset")
                 self.save_data()
+                self.frame_profiler.flush(self.frame_file(block))
                 if not block == max(self.blocks):
                     from psychopy.visual import TextStim
                     from psychopy import core
@@ -539,20 +619,27 @@ Drücken Sie eine beliebige Taste zum Beenden.
         self.display_text(text=prompts.end, keys="q", height=0.75)
         self.send_trigger("experiment_offset")
 
+    def frame_file(self, block):
+        return os.path.join(self.output_dir, f"{self.output_str}_block_{block}_frames.npz")
+
+    def close(self):
+        self.prefetcher.close()
+        self.trigger_scheduler.close()
+        # intended and actual trigger times, in audio stream seconds with the engine
+        pd.DataFrame(self.trigger_scheduler.records).to_csv(
+            os.path.join(self.output_dir, f"{self.output_str}_triggers.csv"), index=False)
+        if self.audio_engine is not None:
+            self.audio_engine.close()
+        # frames of a block that did not run to its end, e.g. the test block
+        self.frame_profiler.flush(self.frame_file(self.this_block))
+        self.frame_profiler.write_summary(os.path.join(self.output_dir, f"{self.output_str}_frame_summary.csv"))
+        super().close()
+
     # Function to send trigger value by specifying event name
-    def send_trigger(self, trigger_name):
-        print(trigger_name)
-        print(EEG_TRIGGER_MAP[trigger_name])
-        if self.settings["mode"]["record_eeg"]:
-            # get corresponding trigger value:
-            trigger_value = EEG_TRIGGER_MAP[trigger_name]
-            # send trigger to EEG:
-            self.port.setData(trigger_value)
-            core.wait(0.002)
-            # turn off EEG trigger
-            self.port.setData(0)
-        else:
-            pass
+    def send_trigger(self, trigger_name, delay=0.0):
+        # only queued here, the dispatcher thread writes the port `delay` seconds from now and resets it after the pulse
+        self.trigger_scheduler.schedule(EEG_TRIGGER_MAP[trigger_name], when=self.trigger_scheduler.clock() + delay,
+                                        name=trigger_name, block=self.this_block)
 
     def run_accuracy_test(self):
         self.display_pages([prompts.accuracy_instruction], height=0.75)
@@ -576,7 +663,7 @@ Drücken Sie eine beliebige Taste zum Beenden.
             random.shuffle(stimuli_sequence)
             correct_count = 0
             for stimulus in stimuli_sequence:
-                stimulus.play(latency="low", blocksize=0, mapping=[np.random.randint(1, 4)])
+                stimulus.play(latency="low", blocksize=0, mapping=[np.random.randint(1, self.n_loudspeakers() + 1)])
                 #self.display_text(text="L oder M?")
                 psychopy.visual.TextStim(win=self.win, text="L", bold=True, color=[-1, 1, -1], pos=[2, 0]).draw()
                 psychopy.visual.TextStim(win=self.win, text="M", bold=True, color=[1, -1, -1], pos=[-2, 0]).draw()
@@ -604,6 +691,14 @@ Drücken Sie eine beliebige Taste zum Beenden.
 
     def run_demo(self):
         self.display_pages([prompts.demo], height=0.75)
+        if self.audio_engine is not None:
+            # all digits are queued at once, each routed to a random loudspeaker when it is submitted
+            loudspeakers = np.random.randint(0, self.n_loudspeakers(), size=len(self.targets))
+            voices = self.audio_engine.play_sequence([digit.data for digit in self.targets], channels=loudspeakers,
+                                                     soa=1.5, gain=self.targets[0].gain)
+            voices[-1].wait()
+            core.wait(1.5 - self.targets[-1].duration)
+            return
         for digit in self.targets:
             digit.play(latency="low", blocksize=0, mapping=[np.random.randint(1, 4)])
             core.wait(1.5)
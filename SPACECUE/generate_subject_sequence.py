@@ -3,7 +3,15 @@ import numpy as np
 import yaml
 import slab
 from SPACECUE.encoding import SPACE_ENCODER
-from utils.signal_processing import spatialize, snr_sound_mixture_two_ears
+from SPACECUE.stimulus_bank import (STIMULUS_TYPES, render_stimulus_bank, get_trial_components, mix_trial,
+                                    stack_target_and_noise, get_freefield_indices, mix_freefield_block)
+from SPACECUE.trial_sound_cache import (TRIAL_SOUND_CACHE_DIR, bank_fingerprint, trial_sound_key, trial_sound_file,
+                                       is_cache_entry_intact)
+from SPACECUE.trial_sound_writer import TrialSoundWriter
+from SPACECUE.generation_manifest import (config_hash, load_manifest, save_manifest, describe_block,
+                                          is_block_current)
+from utils.signal_processing import snr_two_ears_batched
+from utils.block_container import write_block_container, remove_block_container, BLOCK_AUDIO_FILE
 from utils.utils import get_input_from_dict, generate_balanced_jitter, generate_fixed_levels_jitter
 from SPACECUE.trial_sequence_pygad import (make_pygad_trial_sequence, insert_singleton_present_trials,
                                            get_element_indices, print_final_traits)
@@ -11,20 +19,15 @@ import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 import logging
+import contextlib
 import time
-from copy import deepcopy
 import re
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 #os.chdir("C:/Users/Max/PycharmProjects/psychopy-experiments/SPACECUE")
 
-info = get_input_from_dict({"subject_id": 99, "block": 0})
-
-# load settings
-settings_path = "config.yaml"
-with open(settings_path) as file:
-    settings = yaml.safe_load(file)
-
 
 def extract_number_for_sorting(filename_with_ext):
     """
@@ -258,62 +261,59 @@ def insert_pseudo_randomized_cues(df: pd.DataFrame,
     return df
 
 
-def precompute_sequence(subject_id, block, settings, logging_level="INFO", compute_snr=False, skip_sound_generation=False):
-    subject_id = str(subject_id).zfill(2)
-    # get relevant params from settings
-    samplerate = settings["session"]["samplerate"]
-    freefield = settings["mode"]['freefield']
-    # --- LOGGING SETUP ---
-    # Base path for all sequence-related data, taken from settings
-    subject_sequence_base_path = settings["filepaths"]["sequences"]
+@contextlib.contextmanager
+def _sequence_logging(subject_id, settings, logging_level="INFO"):
+    """
+    Sends the log records of the enclosed code to the subject's sequence log.
 
-    # Construct the path for the logs directory
-    log_dir_path = os.path.join(subject_sequence_base_path, "logs")
+    The file handler is attached to the root logger on entry and detached (and closed) on exit, so every
+    subject of a cohort run logs into its own file and the caller's handlers stay untouched.
+    """
+    # Base path for all sequence-related data, taken from settings
+    log_dir_path = os.path.join(settings["filepaths"]["sequences"], "logs")
+    os.makedirs(log_dir_path, exist_ok=True)
+    log_file_path = os.path.join(log_dir_path, f"sce-{subject_id}_trial_sequence_log.txt")
 
+    root = logging.getLogger()
+    handler = logging.FileHandler(log_file_path, mode="a")  # append, so logs from multiple runs/blocks are kept
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    handler.setLevel(logging_level)
+    previous_level = root.level
+    root.addHandler(handler)
+    root.setLevel(min(root.getEffectiveLevel(), handler.level))
+    logging.info(f"Logging initialized. Log file: {log_file_path}")
     try:
-        # Ensure the logs directory exists; create it if it doesn't
-        os.makedirs(log_dir_path, exist_ok=True)
-    except OSError as e:
-        # Fallback if directory creation fails (e.g., permissions)
-        print(f"CRITICAL: Could not create log directory {log_dir_path}. Error: {e}")
-        # Optionally, raise the error or exit if logging is critical
-        # For now, we'll let basicConfig try, but it will likely fail to create the file.
-
-    # Construct the full path to the log file
-    log_file_path = os.path.join(log_dir_path, f"sce-{subject_id}_trial_sequence_log.txt")
+        yield
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+        root.setLevel(previous_level)
 
-    # Remove any existing handlers from the root logger
-    # This is important if this function could be called multiple times in the same Python session
-    # to prevent duplicate log messages or multiple file handlers.
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
-        handler.close() # Close the handler before removing
 
-    # Configure logging to write to the specified file
-    logging.basicConfig(filename=log_file_path,
-                        level=logging_level,
-                        format='%(asctime)s - %(levelname)s - %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        filemode='a')  # 'a' for append, so logs from multiple runs/blocks are kept
+def get_color_mapping(subject_id_int):
+    """Color mapping counterbalanced for every two subjects (subject IDs are 1-based)."""
+    # Pair group index: (0,0), (1,1), (2,2), ... for subjects (1,2), (3,4), (5,6), ...
+    pair_group_index = (subject_id_int - 1) // 2
+    if pair_group_index % 2 == 0: # Even pair group (0, 2, 4...)
+        return "nonsingleton-blue-singleton-yellow"
+    else: # Odd pair group (1, 3, 5...)
+        return "nonsingleton-yellow-singleton-blue"
 
-    logging.info(f"Logging initialized. Log file: {log_file_path}")
-    # determine start of function
-    start_time = time.time()
-    if compute_snr:
-        snr_container = dict(snr_left=[], snr_right=[], signal_loc=[])
 
-    subject_sequence_base_path = settings["filepaths"]["sequences"]
+def derive_block_seed(base_seed, subject_id, block):
+    """
+    Derives the random seed of one (subject, block) job from the run's base seed.
 
-    # determine how many trials
-    n_trials = settings["session"]["n_trials"]
-    # load conditions file
-    df_conditions = pd.read_csv(f"all_combinations_{settings['session']['n_locations']}"
-                                f"_loudspeakers_{settings['session']['n_digits']}_digits.csv")
-    # retrieve sound level to adjust sounds to
-    soundlvl = settings["session"]["level"]
-    n_blocks = settings["session"]["n_blocks"]
-    prop_distractor_present_trials = settings["session"]["prop_distractor_present_trials"]
+    The seed only depends on its inputs, so a block comes out the same no matter in which
+    order, process or run it is generated.
+    """
+    return int(np.random.SeedSequence([int(base_seed), int(subject_id), int(block)]).generate_state(1)[0])
 
+
+def load_stimulus_bank(settings):
+    """Loads the digit stimuli and renders them into the stimulus bank (see SPACECUE.stimulus_bank)."""
+    samplerate = settings["session"]["samplerate"]
+    soundlvl = settings["session"]["level"]
     # load sounds
     singletons = [slab.Sound.read(f"stimuli/distractors_{settings['session']['distractor_type']}/{x}")
                   for x in sorted(os.listdir(f"stimuli/distractors_{settings['session']['distractor_type']}"))]
@@ -322,314 +322,377 @@ def precompute_sequence(subject_id, block, settings, logging_level="INFO", compu
     others = [slab.Sound.read(f"stimuli/digits_all_250ms/{x}") for x in
               sorted(os.listdir(f"stimuli/digits_all_250ms"))]
 
-    for s_list in [singletons, targets, others]:
-        for sound_item in s_list:
-            sound_item.level = soundlvl
+    # render every (type, digit, location) once; trial sounds are sums of bank entries
+    logging.info(f"Rendering stimulus bank at {soundlvl} dB ... ")
+    return render_stimulus_bank(targets=targets, singletons=singletons, others=others, level=soundlvl,
+                                n_samples=int(samplerate * settings["session"]["stimulus_duration"]),
+                                freefield=settings["mode"]['freefield'])
 
-    if not freefield:
-        singletons = [slab.Binaural(data=x) for x in singletons]
-        targets = [slab.Binaural(data=x) for x in targets]
-        others = [slab.Binaural(data=x) for x in others]
 
-    # Determine subject properties for cueing and color
-    subject_id_int = int(subject_id)
+# free-field trials mixed per scatter-add, like the writer's queue this bounds the memory of a block
+FREEFIELD_CHUNK_TRIALS = 16
 
-    # CueDesignStrategy is always Block now
-    cue_design_strategy_for_subject = "Block"
 
-    # Color mapping counterbalanced for every two subjects
-    # Assumes subject_id_int is 1-based (e.g., 1, 2, 3, ...)
-    # Pair group index: (0,0), (1,1), (2,2), ... for subjects (1,2), (3,4), (5,6), ...
-    pair_group_index = (subject_id_int - 1) // 2
-    if pair_group_index % 2 == 0: # Even pair group (0, 2, 4...)
-        color_mapping_for_subject = "nonsingleton-blue-singleton-yellow"
-    else: # Odd pair group (1, 3, 5...)
-        color_mapping_for_subject = "nonsingleton-yellow-singleton-blue"
-
-    logging.info(f"Subject ID: {subject_id}, Integer: {subject_id_int}")
-    logging.info(f"Cue Design Strategy for Subject: {cue_design_strategy_for_subject}")
-    logging.info(f"Color Mapping Pair Group Index: {pair_group_index}")
-    logging.info(f"Color Mapping for Subject: {color_mapping_for_subject}")
-
-    # Iterate over blocks (starting from the 'block' argument, up to n_blocks)
-    for current_block_num in range(block, n_blocks):
-        print(f"Running block {current_block_num}")
-        logging.info(f"Processing block {current_block_num} for subject {subject_id}")
-
-        dirname = f"sequences/sce-{subject_id}_block_{current_block_num}"
-        try:
-            os.mkdir(dirname)
-        except FileExistsError:
-            logging.warning(FileExistsError(f"Directory {dirname} already exists! Moving on ... "))
-
-        # The sequence is now completely random (no explicit priming trials generation)
-        sequence_labels = ["C"] * n_trials
-        sequence_final = insert_singleton_present_trials(sequence_labels,
-                                                         fig_path=settings["filepaths"]["sequences"] + "/logs" +
-                                                                  f"/sce-{subject_id}_sequence_block-{current_block_num}_hist_sp_trials.png",
-                                                         prop_distractor_present_trials=prop_distractor_present_trials)
-        c_indices = get_element_indices(sequence_final, element="C")
-        if len(c_indices) > 1:
-            distances_c = np.diff(c_indices)
-            sns.histplot(x=distances_c)
-            plt.title("Histogram of distances between C trials")
-            plt.savefig(
-                settings["filepaths"]["sequences"] + "/logs" + f"/sce-{subject_id}_sequence_hist_block{current_block_num}_"
-                                                               f"diff_control_trials.png")
-            plt.close()
-        else:
-            logging.info("Not enough C trials to plot distances.")
+def precompute_block(subject_id, current_block_num, settings, seed, stimulus_bank=None, logging_level="INFO",
+                     compute_snr=True, skip_sound_generation=False, block_container=False, repair=False,
+                     stimulus_bank_fingerprint=None):
+    """
+    Generates the trial sequence CSV and the trial sounds of a single block.
 
-        trial_sequence = pd.DataFrame()
-        prev_target_digit = None
-        prev_singleton_digit = None
-        prev_target_loc = None
-        prev_singleton_loc = None
+    Args:
+        subject_id (str | int): subject ID, zero-padded to two digits.
+        current_block_num (int): the block to generate.
+        settings (dict): experiment settings (config.yaml).
+        seed (int): seed for `random` and `numpy.random`, see derive_block_seed().
+        stimulus_bank (numpy.ndarray): rendered stimuli, see load_stimulus_bank(). Only needed for sounds.
+        logging_level (str): logging level of the sequence log.
+        compute_snr (bool): whether to write the per-trial SNR of the target against the other digits
+            (sce-XX_block_N_snr.npz in the block directory, headphones only).
+        skip_sound_generation (bool): only write the trial sequence CSV.
+        block_container (bool): additionally pack the trial sounds into one memory-mappable file
+            (see utils.block_container).
+        repair (bool): the block failed its manifest check. Its trial sounds are rendered again instead of
+            reused from the cache, and written as copies, so they share no file with other blocks.
+        stimulus_bank_fingerprint (str): bank_fingerprint() of `stimulus_bank`, computed here if None. Pass it
+            when generating several blocks from one bank, so the bank is hashed only once.
 
-        for i, element in enumerate(sequence_final):
-            select_singleton_present = True if "SP" in element else False
-            possible_samples = df_conditions[df_conditions["SingletonPresent"] == select_singleton_present]
-            
-            if possible_samples.empty:
-                logging.error(f"No conditions found for SingletonPresent={select_singleton_present} (element: {element}). This should not happen if conditions file is complete.")
-                original_element = element
-                if select_singleton_present:
-                    element = element.replace("SP", "SA")
-                    select_singleton_present = False
-                else:
-                    element = element.replace("SA", "SP")
-                    select_singleton_present = True
-                possible_samples = df_conditions[df_conditions["SingletonPresent"] == select_singleton_present]
-                if possible_samples.empty:
-                    raise ValueError(f"Critical: No conditions for SP or SA. Element: {original_element}. Check conditions file.")
-                logging.warning(f"Switched element from {original_element} to {element} due to no matching conditions.")
-
-            sample = possible_samples.sample()
-            
-            # Determine Priming type purely for logging/record-keeping
-            if i > 0 and prev_singleton_digit is not None and prev_singleton_loc is not None and \
-               (sample["TargetDigit"].values[0] == prev_singleton_digit and sample["TargetLoc"].values[0] == prev_singleton_loc):
-                sample["Priming"] = -1
-            elif i > 0 and prev_target_digit is not None and prev_target_loc is not None and \
-                 (sample["TargetDigit"].values[0] == prev_target_digit and sample["TargetLoc"].values[0] == prev_target_loc):
-                sample["Priming"] = 1
-            else:
-                sample["Priming"] = 0
+    Returns:
+        tuple: (path of the trial sequence CSV, list of trial sound paths). The list is empty if sounds were skipped.
+    """
+    subject_id = str(subject_id).zfill(2)
+    with _sequence_logging(subject_id, settings, logging_level):
+        return _precompute_block(subject_id, current_block_num, settings, seed, stimulus_bank=stimulus_bank,
+                                 compute_snr=compute_snr, skip_sound_generation=skip_sound_generation,
+                                 block_container=block_container, repair=repair,
+                                 stimulus_bank_fingerprint=stimulus_bank_fingerprint)
 
-            logging.debug(
-                f"Block {current_block_num}, Trial {i}: Selected condition for {element} (Priming: {sample['Priming'].values[0]})")
-            prev_target_digit = sample["TargetDigit"].values[0]
-            prev_target_loc = sample["TargetLoc"].values[0]
-            if select_singleton_present:
-                prev_singleton_digit = sample["SingletonDigit"].values[0]
-                prev_singleton_loc = sample["SingletonLoc"].values[0]
-            else:
-                prev_singleton_digit = None
-                prev_singleton_loc = None
 
-            trial_sequence = pd.concat([trial_sequence, sample], ignore_index=True)
+def _precompute_block(subject_id, current_block_num, settings, seed, stimulus_bank, compute_snr,
+                      skip_sound_generation, block_container, repair, stimulus_bank_fingerprint):
+    samplerate = settings["session"]["samplerate"]
+    freefield = settings["mode"]['freefield']
+    n_trials = settings["session"]["n_trials"]
+    prop_distractor_present_trials = settings["session"]["prop_distractor_present_trials"]
 
-        trial_sequence.reset_index(drop=True, inplace=True)
-        print_final_traits(trial_sequence)
+    # every block draws from its own seed, so blocks can be generated in any order or process
+    random.seed(seed)
+    np.random.seed(seed)
 
-        trial_sequence["cue_stim_delay_jitter"] = generate_fixed_levels_jitter(trial_sequence, levels=settings["session"]["cue_stim_delay_levels"])
-        trial_sequence["cue_stim_delay_jitter"] = round(trial_sequence["cue_stim_delay_jitter"], 3)
+    # load conditions file
+    df_conditions = pd.read_csv(f"all_combinations_{settings['session']['n_locations']}"
+                                f"_loudspeakers_{settings['session']['n_digits']}_digits.csv")
 
-        trial_sequence["ITI-Jitter"] = generate_balanced_jitter(trial_sequence, iti=settings["session"]["iti"],
-                                                                mode="ITI")
-        trial_sequence["ITI-Jitter"] = round(trial_sequence["ITI-Jitter"], 3)
+    # Determine subject properties for cueing and color
+    subject_id_int = int(subject_id)
+    # CueDesignStrategy is always Block now
+    cue_design_strategy_for_subject = "Block"
+    color_mapping_for_subject = get_color_mapping(subject_id_int)
 
-        trial_sequence["CueDesignStrategy"] = cue_design_strategy_for_subject
-        trial_sequence["Color"] = color_mapping_for_subject
+    logging.info(f"Processing block {current_block_num} for subject {subject_id} (seed {seed})")
+    logging.info(f"Cue Design Strategy for Subject: {cue_design_strategy_for_subject}")
+    logging.info(f"Color Mapping for Subject: {color_mapping_for_subject}")
 
-        cue_prop_informative = settings["session"]["cue_prop_informative"]
-        max_consecutive_block_cues = settings["session"]["max_consecutive_informative"]
+    dirname = f"sequences/sce-{subject_id}_block_{current_block_num}"
+    try:
+        os.mkdir(dirname)
+    except FileExistsError:
+        logging.warning(FileExistsError(f"Directory {dirname} already exists! Moving on ... "))
+    # a container of an earlier run would be played instead of the trial sounds written below
+    remove_block_container(dirname)
+
+    # The sequence is now completely random (no explicit priming trials generation)
+    sequence_labels = ["C"] * n_trials
+    sequence_final = insert_singleton_present_trials(sequence_labels,
+                                                     fig_path=settings["filepaths"]["sequences"] + "/logs" +
+                                                              f"/sce-{subject_id}_sequence_block-{current_block_num}_hist_sp_trials.png",
+                                                     prop_distractor_present_trials=prop_distractor_present_trials)
+    c_indices = get_element_indices(sequence_final, element="C")
+    if len(c_indices) > 1:
+        distances_c = np.diff(c_indices)
+        sns.histplot(x=distances_c)
+        plt.title("Histogram of distances between C trials")
+        plt.savefig(
+            settings["filepaths"]["sequences"] + "/logs" + f"/sce-{subject_id}_sequence_hist_block{current_block_num}_"
+                                                           f"diff_control_trials.png")
+        plt.close()
+    else:
+        logging.info("Not enough C trials to plot distances.")
+
+    trial_sequence = pd.DataFrame()
+    prev_target_digit = None
+    prev_singleton_digit = None
+    prev_target_loc = None
+    prev_singleton_loc = None
+
+    for i, element in enumerate(sequence_final):
+        select_singleton_present = True if "SP" in element else False
+        possible_samples = df_conditions[df_conditions["SingletonPresent"] == select_singleton_present]
+        
+        if possible_samples.empty:
+            logging.error(f"No conditions found for SingletonPresent={select_singleton_present} (element: {element}). This should not happen if conditions file is complete.")
+            original_element = element
+            if select_singleton_present:
+                element = element.replace("SP", "SA")
+                select_singleton_present = False
+            else:
+                element = element.replace("SA", "SP")
+                select_singleton_present = True
+            possible_samples = df_conditions[df_conditions["SingletonPresent"] == select_singleton_present]
+            if possible_samples.empty:
+                raise ValueError(f"Critical: No conditions for SP or SA. Element: {original_element}. Check conditions file.")
+            logging.warning(f"Switched element from {original_element} to {element} due to no matching conditions.")
+
+        sample = possible_samples.sample()
+        
+        # Determine Priming type purely for logging/record-keeping
+        if i > 0 and prev_singleton_digit is not None and prev_singleton_loc is not None and \
+           (sample["TargetDigit"].values[0] == prev_singleton_digit and sample["TargetLoc"].values[0] == prev_singleton_loc):
+            sample["Priming"] = -1
+        elif i > 0 and prev_target_digit is not None and prev_target_loc is not None and \
+             (sample["TargetDigit"].values[0] == prev_target_digit and sample["TargetLoc"].values[0] == prev_target_loc):
+            sample["Priming"] = 1
+        else:
+            sample["Priming"] = 0
+
+        logging.debug(
+            f"Block {current_block_num}, Trial {i}: Selected condition for {element} (Priming: {sample['Priming'].values[0]})")
+        prev_target_digit = sample["TargetDigit"].values[0]
+        prev_target_loc = sample["TargetLoc"].values[0]
+        if select_singleton_present:
+            prev_singleton_digit = sample["SingletonDigit"].values[0]
+            prev_singleton_loc = sample["SingletonLoc"].values[0]
+        else:
+            prev_singleton_digit = None
+            prev_singleton_loc = None
+
+        trial_sequence = pd.concat([trial_sequence, sample], ignore_index=True)
+
+    trial_sequence.reset_index(drop=True, inplace=True)
+    print_final_traits(trial_sequence)
+
+    trial_sequence["cue_stim_delay_jitter"] = generate_fixed_levels_jitter(trial_sequence, levels=settings["session"]["cue_stim_delay_levels"])
+    trial_sequence["cue_stim_delay_jitter"] = round(trial_sequence["cue_stim_delay_jitter"], 3)
+
+    trial_sequence["ITI-Jitter"] = generate_balanced_jitter(trial_sequence, iti=settings["session"]["iti"],
+                                                            mode="ITI")
+    trial_sequence["ITI-Jitter"] = round(trial_sequence["ITI-Jitter"], 3)
+
+    trial_sequence["CueDesignStrategy"] = cue_design_strategy_for_subject
+    trial_sequence["Color"] = color_mapping_for_subject
+
+    cue_prop_informative = settings["session"]["cue_prop_informative"]
+    max_consecutive_block_cues = settings["session"]["max_consecutive_informative"]
+
+    trial_sequence = insert_pseudo_randomized_cues(
+        trial_sequence,
+        block_num=current_block_num,
+        prop_informative=cue_prop_informative,
+        max_consecutive_block_cues=max_consecutive_block_cues
+    )
+
+    if not skip_sound_generation:
+        # content address of every trial sound; identical trials share one rendered file
+        render_params = dict(samplerate=samplerate, level=settings["session"]["level"], ramp_duration=0.01,
+                             freefield=freefield,
+                             stimulus_bank=stimulus_bank_fingerprint or bank_fingerprint(stimulus_bank))
+        trial_components = [get_trial_components(row) for _, row in trial_sequence.iterrows()]
+        trial_sequence["SoundFile"] = [trial_sound_file(trial_sound_key(components, render_params))
+                                       for components in trial_components]
+
+    file_name = f"sequences/sce-{subject_id}_block_{current_block_num}.csv"
+    trial_sequence.to_csv(file_name, index=False)
+
+    logging.info(f"Saved trial sequence to {file_name}")
+    if skip_sound_generation:
+        return file_name, []
+    logging.info(f"Precomputing trial sounds for subject {subject_id}, block {current_block_num} ... ")
+
+    os.makedirs(os.path.join("sequences", TRIAL_SOUND_CACHE_DIR), exist_ok=True)
+    if freefield:
+        n_digits = stimulus_bank.shape[0] // len(STIMULUS_TYPES)
+        source_idx, speaker_idx = get_freefield_indices(trial_components, n_digits=n_digits)
+        mixed_chunk, chunk_buffer = None, None
+
+    n_cached = 0
+    pending = set()  # cache files queued in this block but maybe not written yet
+    writer = TrialSoundWriter(n_total=len(trial_sequence), description=f"Subject {subject_id}, block {current_block_num}",
+                              copy_links=repair)
+    for i, row in trial_sequence.iterrows():
+        components = trial_components[i]
+        cached_path = os.path.join("sequences", row["SoundFile"])
+        trial_path = os.path.join(dirname, f"s_{i}.wav")
+        if cached_path in pending or (not repair and is_cache_entry_intact(cached_path)):
+            n_cached += 1
+            writer.submit(cached_path, links=[trial_path])
+        else:
+            logging.debug(f"Precompute trialsound for trial {i}, block {current_block_num} ... ")
+            if not freefield:
+                final_trialsound = slab.Binaural(mix_trial(stimulus_bank, components), samplerate=samplerate)
+            else:
+                # the loudspeaker routing of FREEFIELD_CHUNK_TRIALS trials in one scatter-add. Every chunk gets a
+                # fresh buffer, so memory stays bounded and queued sounds are never overwritten
+                if i // FREEFIELD_CHUNK_TRIALS != mixed_chunk:
+                    mixed_chunk = i // FREEFIELD_CHUNK_TRIALS
+                    rows = slice(mixed_chunk * FREEFIELD_CHUNK_TRIALS, (mixed_chunk + 1) * FREEFIELD_CHUNK_TRIALS)
+                    chunk_buffer = np.zeros((len(source_idx[rows]), stimulus_bank.shape[1],
+                                             settings["session"]["n_locations"]), dtype=np.float32)
+                    mix_freefield_block(chunk_buffer, source_idx[rows], speaker_idx[rows], stimulus_bank)
+                final_trialsound = slab.Sound(chunk_buffer[i % FREEFIELD_CHUNK_TRIALS], samplerate=samplerate)
+
+            pending.add(cached_path)
+            writer.submit(cached_path, sound=final_trialsound.ramp(when='both', duration=0.01), links=[trial_path])
+
+    if compute_snr and not freefield:
+        # all trials at once, while the writer thread is still busy with the sounds
+        targets, noise = stack_target_and_noise(stimulus_bank, trial_components)
+        snr_ears = snr_two_ears_batched(targets, noise)
+        del targets, noise
+        n_missing = int(np.isnan(snr_ears[:, 0]).sum())
+        if n_missing:
+            logging.warning(f"No SNR for {n_missing} trials without distractors.")
+        file_name_snr = os.path.join(dirname, f"sce-{subject_id}_block_{current_block_num}_snr.npz")
+        np.savez(file_name_snr, trial=np.arange(len(trial_sequence)), snr_left=snr_ears[:, 0],
+                 snr_right=snr_ears[:, 1],
+                 signal_loc=np.array([SPACE_ENCODER[loc][0] for loc in trial_sequence["TargetLoc"]]))
+        logging.info(f"Saved SNR of block {current_block_num} to {file_name_snr}")
+
+    writer.close()
+    logging.info(f"Reused {n_cached} of {len(trial_sequence)} trial sounds from {TRIAL_SOUND_CACHE_DIR}.")
+    sound_files = [os.path.join(dirname, f"s_{i}.wav") for i in range(len(trial_sequence))]
+    if block_container:
+        write_block_container(dirname, sound_files)
+        logging.info(f"Packed trial sounds of block {current_block_num} into {BLOCK_AUDIO_FILE}.")
+    logging.info(f"Finished writing sounds for block {current_block_num}.")
+    return file_name, sound_files
+
+
+# stimulus bank of a worker process, handed over once by the pool initializer instead of with every job
+_worker_stimulus_bank = None
+
+
+def _init_worker(stimulus_bank):
+    global _worker_stimulus_bank
+    _worker_stimulus_bank = stimulus_bank
+
+
+def _generate_block(job, stimulus_bank, manifest_params):
+    """Runs one block job and returns its manifest entry."""
+    csv_path, sound_files = precompute_block(**job, stimulus_bank=stimulus_bank,
+                                             stimulus_bank_fingerprint=manifest_params["stimulus_bank"])
+    blockdir = f"sequences/sce-{job['subject_id']}_block_{job['current_block_num']}"
+    return describe_block(csv_path, blockdir, sound_files, seed=job["seed"], **manifest_params)
+
+
+def _run_block_job(job, manifest_params):
+    entry = _generate_block(job, _worker_stimulus_bank, manifest_params)
+    return job["subject_id"], job["current_block_num"], entry
+
+
+def precompute_cohort(subject_ids, settings, block=0, logging_level="INFO", compute_snr=True,
+                      skip_sound_generation=False, seed=None, workers=1, block_container=False, force=False):
+    """
+    Generates trial sequences and sounds for several subjects, optionally spread over a process pool.
 
-        trial_sequence = insert_pseudo_randomized_cues(
-            trial_sequence,
-            block_num=current_block_num,
-            prop_informative=cue_prop_informative,
-            max_consecutive_block_cues=max_consecutive_block_cues
-        )
+    Every (subject, block) pair is an independent job seeded with derive_block_seed(seed, subject, block),
+    so the output does not depend on `workers`. Each subject keeps a generation manifest (see
+    SPACECUE.generation_manifest) with the config hash, seed and file hashes of its blocks. Blocks that are
+    present, current and intact are skipped, so an interrupted run can simply be started again.
 
-        file_name = f"sequences/sce-{subject_id}_block_{current_block_num}.csv"
-        trial_sequence.to_csv(file_name, index=False)
+    Args:
+        subject_ids (list): subject IDs to generate.
+        settings (dict): experiment settings (config.yaml).
+        block (int): first block to generate for every subject.
+        logging_level (str): logging level of the sequence logs.
+        compute_snr (bool): whether to write per-trial SNR files.
+        skip_sound_generation (bool): only write the trial sequence CSVs.
+        seed (int): base seed of the run. If None, each subject reuses the seed in its manifest, and
+            subjects without one get a fresh seed (which is logged).
+        workers (int): number of worker processes. 1 runs every job in this process.
+        block_container (bool): additionally write one memory-mappable audio container per block.
+        force (bool): regenerate every block, even if the manifest says it is current.
 
-        logging.info(f"Saved trial sequence to {file_name}")
-        if skip_sound_generation:
-            continue
-        logging.info(f"Precomputing trial sounds for subject {subject_id}, block {current_block_num} ... ")
+    Returns:
+        dict: base seed of every subject (zero-padded ID -> seed), to reproduce what was generated.
+    """
+    start_time = time.time()
+    fresh_seed = np.random.SeedSequence().entropy
+    n_blocks = settings["session"]["n_blocks"]
+    stimulus_bank = None if skip_sound_generation else load_stimulus_bank(settings)
+    manifest_params = dict(config=config_hash(settings),
+                           stimulus_bank=None if skip_sound_generation else bank_fingerprint(stimulus_bank),
+                           block_container=block_container and not skip_sound_generation,
+                           # SNR files are only written with the sounds of headphone blocks
+                           compute_snr=compute_snr and not skip_sound_generation and not settings["mode"]["freefield"])
+    # a CSV-only run is satisfied by blocks that already have their sounds (or container, or SNR files)
+    expected_params = {key: value for key, value in manifest_params.items()
+                       if key == "config" or (value and not skip_sound_generation)}
+
+    manifests = dict()
+    jobs = []
+    for subject_id in subject_ids:
+        subject_id = str(subject_id).zfill(2)
+        manifest = load_manifest(subject_id)
+        if seed is not None:
+            manifest["seed"] = seed
+        elif manifest["seed"] is None:
+            manifest["seed"] = fresh_seed
+        manifests[subject_id] = manifest
+        for block_num in range(block, n_blocks):
+            job = dict(subject_id=subject_id, current_block_num=block_num, settings=settings,
+                       seed=derive_block_seed(manifest["seed"], subject_id, block_num), logging_level=logging_level,
+                       compute_snr=compute_snr, skip_sound_generation=skip_sound_generation,
+                       block_container=block_container)
+            entry = manifest["blocks"].get(str(block_num))
+            expected = dict(expected_params, seed=job["seed"])
+            if not force and is_block_current(entry,
+                                              csv_path=f"sequences/sce-{subject_id}_block_{block_num}.csv",
+                                              blockdir=f"sequences/sce-{subject_id}_block_{block_num}",
+                                              expected=expected, needs_sounds=not skip_sound_generation):
+                print(f"Subject {subject_id}, block {block_num} is up to date. Skipping ...")
+                continue
+            # unchanged parameters but failed check: its files were damaged, maybe through a shared cache entry
+            job["repair"] = not force and entry is not None and \
+                all(entry.get(key) == value for key, value in expected.items())
+            jobs.append(job)
+
+    def record(subject_id, block_num, entry):
+        manifests[subject_id]["blocks"][str(block_num)] = entry
+        save_manifest(subject_id, manifests[subject_id])  # after every block, so a crash loses at most the running ones
+
+    if workers > 1 and len(jobs) > 1:
+        print(f"Generating {len(jobs)} blocks with {workers} worker processes ...")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(stimulus_bank,)) as executor:
+            futures = [executor.submit(_run_block_job, job, manifest_params) for job in jobs]
+            for future in as_completed(futures):
+                subject_id, block_num, entry = future.result()  # re-raises errors of the worker
+                record(subject_id, block_num, entry)
+                print(f"Finished subject {subject_id}, block {block_num}")
+    else:
+        for job in jobs:
+            record(job["subject_id"], job["current_block_num"], _generate_block(job, stimulus_bank, manifest_params))
 
-        sound_sequence = []
-        for i, row in trial_sequence.iterrows():
-            logging.debug(f"Precompute trialsound for trial {i}, block {current_block_num} ... ")
-            if not freefield:
-                trialsound_base = slab.Binaural.silence(duration=settings["session"]["stimulus_duration"],
-                                                        samplerate=samplerate)
-            elif freefield:
-                num_samples = int(samplerate * settings["session"]["stimulus_duration"])
-                num_possible_locations = settings['session']['n_locations']
-                trialsound_data = np.zeros((num_possible_locations, num_samples))
-
-            targetval = int(row["TargetDigit"])
-            targetsound = deepcopy(targets[targetval - 1])
-            targetsound.level = soundlvl
-            targetloc = row["TargetLoc"]
-            targetsound_rendered_for_snr = None
+    end_time = time.time()
+    for subject_id, manifest in manifests.items():
+        with _sequence_logging(subject_id, settings, logging_level):
+            logging.info(f"DONE generating all blocks for subject (base seed {manifest['seed']}).")
+            logging.info(f"Total script running time: {(end_time - start_time):.2f} seconds")
+    return {subject_id: manifest["seed"] for subject_id, manifest in manifests.items()}
 
-            if not freefield:
-                azimuth, ele = SPACE_ENCODER[targetloc]
-                targetsound_rendered = spatialize(targetsound, azi=azimuth, ele=ele)
-                if targetsound_rendered.n_samples != trialsound_base.n_samples:
-                    targetsound_rendered = targetsound_rendered.resize(trialsound_base.n_samples)
-                trialsound_base.data += targetsound_rendered.data
-                targetsound_rendered_for_snr = targetsound_rendered
-            else:
-                speaker_idx = int(targetloc - 1)
-                if 0 <= speaker_idx < trialsound_data.shape[0]:
-                    sound_data_mono = targetsound.data
-                    if targetsound.n_channels > 1:
-                        sound_data_mono = targetsound.data[:, 0]
-                    if len(sound_data_mono) > num_samples:
-                        sound_data_mono = sound_data_mono[:num_samples]
-                    elif len(sound_data_mono) < num_samples:
-                        sound_data_mono = np.pad(sound_data_mono, (0, num_samples - len(sound_data_mono)))
-                    trialsound_data[speaker_idx, :] = sound_data_mono
-                else:
-                    logging.error(f"TargetLoc {targetloc} is out of bounds for freefield speaker array.")
-
-            noise_components_for_snr = []
-
-            if row["SingletonPresent"] == 1:
-                singletonsound = deepcopy(singletons[int(row["SingletonDigit"]) - 1])
-                singletonsound.level = soundlvl
-                singletonloc = row["SingletonLoc"]
-                if not freefield:
-                    azimuth, ele = SPACE_ENCODER[singletonloc]
-                    singletonsound_rendered = spatialize(singletonsound, azi=azimuth, ele=ele)
-                    if singletonsound_rendered.n_samples != trialsound_base.n_samples:
-                        singletonsound_rendered = singletonsound_rendered.resize(trialsound_base.n_samples)
-                    trialsound_base.data += singletonsound_rendered.data
-                    noise_components_for_snr.append(singletonsound_rendered)
-                else:
-                    speaker_idx = int(singletonloc - 1)
-                    if 0 <= speaker_idx < trialsound_data.shape[0]:
-                        sound_data_mono = singletonsound.data
-                        if singletonsound.n_channels > 1: sound_data_mono = sound_data_mono[:, 0]
-                        if len(sound_data_mono) > num_samples:
-                            sound_data_mono = sound_data_mono[:num_samples]
-                        elif len(sound_data_mono) < num_samples:
-                            sound_data_mono = np.pad(sound_data_mono, (0, num_samples - len(sound_data_mono)))
-                        trialsound_data[speaker_idx, :] += sound_data_mono
-                    else:
-                        logging.error(f"SingletonLoc {singletonloc} out of bounds.")
-
-                digit2sound = deepcopy(others[int(row["Non-Singleton2Digit"]) - 1])
-                digit2sound.level = soundlvl
-                digit2loc = row["Non-Singleton2Loc"]
-                if not freefield:
-                    azimuth, ele = SPACE_ENCODER[digit2loc]
-                    digit2sound_rendered = spatialize(digit2sound, azi=azimuth, ele=ele)
-                    if digit2sound_rendered.n_samples != trialsound_base.n_samples:
-                        digit2sound_rendered = digit2sound_rendered.resize(trialsound_base.n_samples)
-                    trialsound_base.data += digit2sound_rendered.data
-                    noise_components_for_snr.append(digit2sound_rendered)
-                else:
-                    speaker_idx = int(digit2loc - 1)
-                    if 0 <= speaker_idx < trialsound_data.shape[0]:
-                        sound_data_mono = digit2sound.data
-                        if digit2sound.n_channels > 1: sound_data_mono = sound_data_mono[:, 0]
-                        if len(sound_data_mono) > num_samples:
-                            sound_data_mono = sound_data_mono[:num_samples]
-                        elif len(sound_data_mono) < num_samples:
-                            sound_data_mono = np.pad(sound_data_mono, (0, num_samples - len(sound_data_mono)))
-                        trialsound_data[speaker_idx, :] += sound_data_mono
-                    else:
-                        logging.error(f"Non-Singleton2Loc {digit2loc} out of bounds.")
-
-            elif row["SingletonPresent"] == 0:
-                digit1sound = deepcopy(others[int(row["Non-Singleton1Digit"]) - 1])
-                digit1sound.level = soundlvl
-                digit1loc = row["Non-Singleton1Loc"]
-                if not freefield:
-                    azimuth, ele = SPACE_ENCODER[digit1loc]
-                    digit1sound_rendered = spatialize(digit1sound, azi=azimuth, ele=ele)
-                    if digit1sound_rendered.n_samples != trialsound_base.n_samples:
-                        digit1sound_rendered = digit1sound_rendered.resize(trialsound_base.n_samples)
-                    trialsound_base.data += digit1sound_rendered.data
-                    noise_components_for_snr.append(digit1sound_rendered)
-                else:
-                    speaker_idx = int(digit1loc - 1)
-                    if 0 <= speaker_idx < trialsound_data.shape[0]:
-                        sound_data_mono = digit1sound.data
-                        if digit1sound.n_channels > 1: sound_data_mono = sound_data_mono[:, 0]
-                        if len(sound_data_mono) > num_samples:
-                            sound_data_mono = sound_data_mono[:num_samples]
-                        elif len(sound_data_mono) < num_samples:
-                            sound_data_mono = np.pad(sound_data_mono, (0, num_samples - len(sound_data_mono)))
-                        trialsound_data[speaker_idx, :] += sound_data_mono
-                    else:
-                        logging.error(f"Non-Singleton1Loc {digit1loc} out of bounds.")
-
-                digit2sound = deepcopy(others[int(row["Non-Singleton2Digit"]) - 1])
-                digit2sound.level = soundlvl
-                digit2loc = row["Non-Singleton2Loc"]
-                if not freefield:
-                    azimuth, ele = SPACE_ENCODER[digit2loc]
-                    digit2sound_rendered = spatialize(digit2sound, azi=azimuth, ele=ele)
-                    if digit2sound_rendered.n_samples != trialsound_base.n_samples:
-                        digit2sound_rendered = digit2sound_rendered.resize(trialsound_base.n_samples)
-                    trialsound_base.data += digit2sound_rendered.data
-                    noise_components_for_snr.append(digit2sound_rendered)
-                else:
-                    speaker_idx = int(digit2loc - 1)
-                    if 0 <= speaker_idx < trialsound_data.shape[0]:
-                        sound_data_mono = digit2sound.data
-                        if digit2sound.n_channels > 1: sound_data_mono = sound_data_mono[:, 0]
-                        if len(sound_data_mono) > num_samples:
-                            sound_data_mono = sound_data_mono[:num_samples]
-                        elif len(sound_data_mono) < num_samples:
-                            sound_data_mono = np.pad(sound_data_mono, (0, num_samples - len(sound_data_mono)))
-                        trialsound_data[speaker_idx, :] += sound_data_mono
-                    else:
-                        logging.error(f"Non-Singleton2Loc {digit2loc} out of bounds.")
 
-            if not freefield:
-                final_trialsound = slab.Binaural(trialsound_base.data, samplerate=samplerate)
-            else:
-                final_trialsound = slab.Sound(trialsound_data.T, samplerate=samplerate)
-
-            sound_sequence.append(final_trialsound.ramp(when='both', duration=0.01))
-
-            if compute_snr and not freefield:
-                if targetsound_rendered_for_snr and noise_components_for_snr:
-                    combined_noise = deepcopy(noise_components_for_snr[0]) # Start with a copy
-                    for k in range(1, len(noise_components_for_snr)):
-                        combined_noise.data += noise_components_for_snr[k].data
-
-                    snr_left, snr_right = snr_sound_mixture_two_ears(targetsound_rendered_for_snr, combined_noise)
-                    snr_container["snr_left"].append(snr_left[0])
-                    snr_container["snr_right"].append(snr_right[0])
-                    azimuth, _ = SPACE_ENCODER[targetloc]
-                    snr_container["signal_loc"].append(azimuth)
-                else:
-                    logging.warning(f"Skipping SNR for trial {i}, missing sound components.")
-
-        if compute_snr and not freefield:
-            df_snr = pd.DataFrame.from_dict(snr_container)
-            file_name_snr = os.path.join(dirname, f"sce-{subject_id}_block_{current_block_num}_snr.csv")
-            df_snr.to_csv(file_name_snr, index=False)
-            snr_container = dict(snr_left=[], snr_right=[], signal_loc=[]) # Reset for next block
-
-        for idx, sound_obj in enumerate(sound_sequence):
-            sound_filename = os.path.join(dirname, f"s_{idx}.wav")
-            sound_obj.write(filename=sound_filename, normalise=False)
-        logging.info(f"Finished writing sounds for block {current_block_num}.")
+def precompute_sequence(subject_id, block, settings, logging_level="INFO", compute_snr=True,
+                        skip_sound_generation=False, seed=None, workers=1, block_container=False, force=False):
+    return precompute_cohort([subject_id], settings, block=block, logging_level=logging_level,
+                             compute_snr=compute_snr, skip_sound_generation=skip_sound_generation,
+                             seed=seed, workers=workers, block_container=block_container, force=force)
 
-    end_time = time.time()
-    logging.info("DONE generating all blocks for subject.")
-    logging.info(f"Total script running time: {(end_time - start_time):.2f} seconds")
 
+if __name__ == "__main__":
+    info = get_input_from_dict({"subject_id": 99, "block": 0})
 
+    # load settings
+    settings_path = "config.yaml"
+    with open(settings_path) as file:
+        settings = yaml.safe_load(file)
 
-precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
+    precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
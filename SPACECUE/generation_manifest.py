@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+from utils.block_container import has_block_container, BLOCK_AUDIO_FILE, BLOCK_AUDIO_INDEX_FILE
+
+
+# settings sections that change the generated sequences and sounds
+CONFIG_SECTIONS = ("session", "mode", "trial_sequence")
+
+
+def manifest_path(subject_id):
+    return f"sequences/sce-{str(subject_id).zfill(2)}_manifest.json"
+
+
+def config_hash(settings):
+    """Hashes the settings sections that influence generation (see CONFIG_SECTIONS)."""
+    relevant = {section: settings.get(section) for section in CONFIG_SECTIONS}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def load_manifest(subject_id):
+    """Returns the generation manifest of a subject, or an empty one if there is none (or it is unreadable)."""
+    path = manifest_path(subject_id)
+    if os.path.exists(path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read manifest {path} ({e}). Regenerating all blocks.")
+    return dict(seed=None, blocks=dict())
+
+
+def save_manifest(subject_id, manifest):
+    path = manifest_path(subject_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)  # never leave a half-written manifest behind
+
+
+def describe_block(csv_path, blockdir, sound_files, **params):
+    """
+    Creates the manifest entry of a freshly generated block.
+
+    Args:
+        csv_path (str): the block's trial sequence.
+        blockdir (str): the block's sound directory, whose block container (if any) is hashed as well.
+        sound_files (list): the block's trial sounds, empty if sounds were skipped.
+        **params: generation parameters the block depends on (seed, config hash, ...).
+    """
+    container_files = [BLOCK_AUDIO_FILE, BLOCK_AUDIO_INDEX_FILE] if has_block_container(blockdir) else []
+    return dict(params,
+                csv=file_hash(csv_path),
+                sounds={os.path.basename(f): file_hash(f) for f in sound_files},
+                container={name: file_hash(os.path.join(blockdir, name)) for name in container_files})
+
+
+def is_block_current(entry, csv_path, blockdir, expected, needs_sounds):
+    """
+    Checks whether a block on disk still matches its manifest entry.
+
+    A block is stale if any generation parameter in `expected` changed, and corrupt if its CSV, one of its
+    trial sounds or its block container is missing or does not match the recorded hash. A block container
+    the entry does not record is stale as well, because sessions would play it instead of the trial sounds.
+
+    Args:
+        entry (dict): the block's manifest entry, None if it was never generated.
+        csv_path (str): the block's trial sequence.
+        blockdir (str): the block's sound directory.
+        expected (dict): generation parameters the entry must match.
+        needs_sounds (bool): whether the block must come with trial sounds.
+
+    Returns:
+        bool: True if the block can be kept as it is.
+    """
+    if entry is None:
+        return False
+    if any(entry.get(key) != value for key, value in expected.items()):
+        return False
+    if needs_sounds and not entry["sounds"]:
+        return False
+    if not os.path.exists(csv_path) or file_hash(csv_path) != entry["csv"]:
+        return False
+    container = entry.get("container", dict())
+    if has_block_container(blockdir) != bool(container):
+        return False
+    for name, sha1 in dict(entry["sounds"], **container).items():
+        path = os.path.join(blockdir, name)
+        if not os.path.exists(path) or file_hash(path) != sha1:
+            return False
+    return True
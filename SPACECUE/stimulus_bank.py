@@ -0,0 +1,194 @@
+import numpy as np
+import slab
+from SPACECUE.encoding import SPACE_ENCODER
+from utils.signal_processing import spatialize
+
+
+# index of each stimulus type along the first axis of the stimulus bank
+STIMULUS_TYPES = {
+    "target": 0,
+    "singleton": 1,
+    "non-singleton": 2
+}
+
+
+def _fit_to_length(data, n_samples):
+    """Cuts or zero-pads the first axis of `data` to `n_samples`."""
+    if data.shape[0] > n_samples:
+        return data[:n_samples]
+    elif data.shape[0] < n_samples:
+        padding = np.zeros((n_samples - data.shape[0],) + data.shape[1:], dtype=data.dtype)
+        return np.concatenate((data, padding))
+    return data
+
+
+def render_stimulus_bank(targets, singletons, others, level, n_samples, freefield, locations=SPACE_ENCODER):
+    """
+    Renders every (stimulus type, digit, location) combination exactly once.
+
+    Each digit sound is set to `level`, spatialized with the KEMAR HRTF (headphones) and cut or padded
+    to `n_samples`. The result is one contiguous float32 array from which every trial sound can be built
+    by indexing and summing. In the free field, the location only decides which loudspeaker plays the
+    digit, so the bank holds every digit once as pre-trimmed mono signal (see mix_freefield_block()).
+
+    Args:
+        targets (list): slab.Sound target digits, ordered by digit (1, 2, ...).
+        singletons (list): slab.Sound singleton digits, ordered by digit.
+        others (list): slab.Sound non-singleton digits, ordered by digit.
+        level (float): sound level in dB the digits are set to before rendering.
+        n_samples (int): number of samples of a single trial sound.
+        freefield (bool): if True, render the mono free-field bank instead of the binaural one.
+        locations (dict): location code -> (azimuth, elevation), see SPACE_ENCODER.
+
+    Returns:
+        numpy.ndarray: float32 array. Headphones: shape (n_types, n_digits, n_locations, n_samples, 2),
+            indexed by [STIMULUS_TYPES[type], digit - 1, loc - 1]. Free field: shape
+            (n_types * n_digits, n_samples), indexed by freefield_source_index().
+    """
+    sources = {"target": targets, "singleton": singletons, "non-singleton": others}
+    n_digits = max(len(s) for s in sources.values())
+    n_locations = len(locations)
+    if freefield:
+        bank = np.zeros((len(STIMULUS_TYPES) * n_digits, n_samples), dtype=np.float32)
+    else:
+        bank = np.zeros((len(STIMULUS_TYPES), n_digits, n_locations, n_samples, 2), dtype=np.float32)
+
+    for stim_type, sounds in sources.items():
+        for digit_idx, sound in enumerate(sounds):
+            sound = slab.Sound(data=sound.data, samplerate=sound.samplerate)  # never alter the caller's sound
+            sound.level = level
+            if freefield:
+                bank[freefield_source_index(stim_type, digit_idx + 1, n_digits)] = \
+                    _fit_to_length(sound.data[:, 0], n_samples)
+                continue
+            for loc in sorted(locations):
+                azimuth, ele = locations[loc]
+                rendered = spatialize(slab.Binaural(data=sound), azi=azimuth, ele=ele)
+                bank[STIMULUS_TYPES[stim_type], digit_idx, loc - 1] = _fit_to_length(rendered.data, n_samples)
+    return bank
+
+
+def freefield_source_index(stim_type, digit, n_digits):
+    """Row of a (stimulus type, digit) in the mono free-field bank."""
+    return STIMULUS_TYPES[stim_type] * n_digits + digit - 1
+
+
+def get_trial_components(row):
+    """
+    Lists the stimuli that make up a single trial.
+
+    Args:
+        row (pandas.Series): one row of a trial sequence (see all_combinations_*.csv).
+
+    Returns:
+        list: (stimulus type, digit, location) tuples. The target always comes first.
+    """
+    components = [("target", int(row["TargetDigit"]), int(row["TargetLoc"]))]
+    if row["SingletonPresent"] == 1:
+        components.append(("singleton", int(row["SingletonDigit"]), int(row["SingletonLoc"])))
+        components.append(("non-singleton", int(row["Non-Singleton2Digit"]), int(row["Non-Singleton2Loc"])))
+    elif row["SingletonPresent"] == 0:
+        components.append(("non-singleton", int(row["Non-Singleton1Digit"]), int(row["Non-Singleton1Loc"])))
+        components.append(("non-singleton", int(row["Non-Singleton2Digit"]), int(row["Non-Singleton2Loc"])))
+    return components
+
+
+def lookup(bank, stim_type, digit, loc):
+    """Returns the rendered (n_samples, 2) view of one stimulus in the binaural bank."""
+    return bank[STIMULUS_TYPES[stim_type], digit - 1, loc - 1]
+
+
+def mix_trial(bank, components):
+    """
+    Builds one headphone trial sound by summing its stimuli from the binaural bank.
+
+    Args:
+        bank (numpy.ndarray): binaural stimulus bank as returned by render_stimulus_bank().
+        components (list): (stimulus type, digit, location) tuples, see get_trial_components().
+
+    Returns:
+        numpy.ndarray: float32 array of shape (n_samples, 2).
+    """
+    trial_data = np.zeros(bank.shape[-2:], dtype=np.float32)
+    for stim_type, digit, loc in components:
+        trial_data += lookup(bank, stim_type, digit, loc)
+    return trial_data
+
+
+def stack_target_and_noise(bank, trial_components):
+    """
+    Gathers the target and the summed distractors of every trial of a block from the binaural bank.
+
+    Args:
+        bank (numpy.ndarray): binaural stimulus bank as returned by render_stimulus_bank().
+        trial_components (list): per trial, the (stimulus type, digit, location) tuples of get_trial_components().
+
+    Returns:
+        tuple: (targets, noise), float32 arrays of shape (n_trials, n_samples, 2). Trials without
+            distractors have zero noise.
+    """
+    max_components = max((len(c) for c in trial_components), default=0)
+    # (type, digit, location) index of every component, -1 where a trial has fewer components
+    index = np.full((3, len(trial_components), max(max_components, 1)), -1, dtype=int)
+    for trial_nr, components in enumerate(trial_components):
+        for k, (stim_type, digit, loc) in enumerate(components):
+            index[:, trial_nr, k] = STIMULUS_TYPES[stim_type], digit - 1, loc - 1
+    targets = bank[index[0, :, 0], index[1, :, 0], index[2, :, 0]]
+    noise = np.zeros_like(targets)
+    for k in range(1, max_components):
+        present = index[0, :, k] >= 0
+        noise[present] += bank[index[0, present, k], index[1, present, k], index[2, present, k]]
+    return targets, noise
+
+
+def get_freefield_indices(trial_components, n_digits):
+    """
+    Converts the components of a block into the index arrays of mix_freefield_block().
+
+    Args:
+        trial_components (list): per trial, the (stimulus type, digit, location) tuples of get_trial_components().
+        n_digits (int): number of digits per stimulus type in the bank.
+
+    Returns:
+        tuple: (source_idx, speaker_idx), int arrays of shape (n_trials, max_components). Trials with fewer
+            components are padded with -1. A location is played by loudspeaker channel `loc - 1`.
+    """
+    max_components = max((len(c) for c in trial_components), default=0)
+    source_idx = np.full((len(trial_components), max_components), -1, dtype=int)
+    speaker_idx = np.full((len(trial_components), max_components), -1, dtype=int)
+    for trial_nr, components in enumerate(trial_components):
+        for k, (stim_type, digit, loc) in enumerate(components):
+            source_idx[trial_nr, k] = freefield_source_index(stim_type, digit, n_digits)
+            speaker_idx[trial_nr, k] = loc - 1
+    return source_idx, speaker_idx
+
+
+def mix_freefield_block(block_buffer, source_idx, speaker_idx, bank):
+    """
+    Scatter-adds the mono stimuli of all trials of a block onto their loudspeaker channels.
+
+    Works for any number of loudspeakers and components per trial; several stimuli on the same
+    loudspeaker of one trial add up.
+
+    Args:
+        block_buffer (numpy.ndarray): preallocated (n_trials, n_samples, n_speakers) float32 array,
+            the stimuli are added to it in place.
+        source_idx (numpy.ndarray): (n_trials, n_components) rows of `bank`, -1 for no stimulus.
+        speaker_idx (numpy.ndarray): (n_trials, n_components) loudspeaker channels, -1 for no stimulus.
+        bank (numpy.ndarray): mono free-field bank of shape (n_sources, n_samples).
+
+    Returns:
+        numpy.ndarray: `block_buffer`.
+    """
+    source_idx = np.asarray(source_idx)
+    speaker_idx = np.asarray(speaker_idx)
+    if np.any(speaker_idx >= block_buffer.shape[2]):
+        raise ValueError(f"Loudspeaker index {speaker_idx.max()} is out of bounds for "
+                         f"{block_buffer.shape[2]} loudspeaker channels.")
+    valid = (source_idx >= 0) & (speaker_idx >= 0)
+    trial_idx = np.broadcast_to(np.arange(source_idx.shape[0])[:, np.newaxis], source_idx.shape)[valid]
+    sample_idx = np.arange(block_buffer.shape[1])
+    np.add.at(block_buffer,
+              (trial_idx[:, np.newaxis], sample_idx[np.newaxis, :], speaker_idx[valid][:, np.newaxis]),
+              bank[source_idx[valid]])
+    return block_buffer
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+from SPACECUE.generation_manifest import file_hash
+
+
+# content-addressed trial sounds live in this folder inside the sequences directory
+TRIAL_SOUND_CACHE_DIR = "trial_sound_cache"
+
+
+def bank_fingerprint(stimulus_bank):
+    """Hashes the rendered stimulus bank, so that changed stimuli or render settings never hit stale sounds."""
+    return hashlib.sha1(stimulus_bank.tobytes()).hexdigest()
+
+
+def trial_sound_key(components, render_params):
+    """
+    Computes the content address of a single trial sound.
+
+    Args:
+        components (list): (stimulus type, digit, location) tuples of the trial, see get_trial_components().
+        render_params (dict): everything besides the components that changes the rendered sound
+            (samplerate, level, ramp, stimulus bank fingerprint, ...).
+
+    Returns:
+        str: hex digest identifying the trial sound.
+    """
+    content = dict(components=[list(c) for c in components], **render_params)
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def trial_sound_file(key):
+    """Path of a cached trial sound relative to the sequences directory, as stored in the block CSV."""
+    return f"{TRIAL_SOUND_CACHE_DIR}/{key}.wav"
+
+
+def hash_file(path):
+    """Path of the sidecar file that stores the content hash of the cached sound `path`."""
+    return f"{path}.sha1"
+
+
+def seal_cache_entry(path):
+    """
+    Records the content hash of a freshly written cache entry and makes it read-only.
+
+    Block files are hardlinks to the cache entry, so an in-place edit of one block's s_N.wav would
+    silently change every block using the same trial sound. Read-only entries make such edits fail,
+    and the stored hash lets is_cache_entry_intact() catch whatever got past that.
+    """
+    sha1 = file_hash(path)
+    tmp_path = f"{hash_file(path)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(sha1)
+    os.replace(tmp_path, hash_file(path))
+    os.chmod(path, stat.S_IREAD)
+
+
+def is_cache_entry_intact(path):
+    """True if the cached sound `path` exists and still has the content hash recorded by seal_cache_entry()."""
+    if not os.path.exists(path) or not os.path.exists(hash_file(path)):
+        return False
+    with open(hash_file(path)) as file:
+        return file.read().strip() == file_hash(path)
+
+
+def remove_file(path):
+    """Removes `path`, also if it is read-only (which Windows refuses to delete)."""
+    if os.path.exists(path):
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(path)
+
+
+def link_or_copy(src, dst, copy=False):
+    """
+    Makes `dst` refer to the same sound as `src`.
+
+    A hardlink costs no disk space, but shares its content with the cache entry and every other block
+    linking to it, so output files must never be edited in place. Where hardlinks are not possible (e.g.
+    FAT drives or across filesystems), or with `copy=True`, the file is copied instead.
+    """
+    remove_file(dst)
+    if copy:
+        shutil.copyfile(src, dst)
+    else:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+    # a dst that was a hardlink to src shared its permissions, so removing it made src writable
+    os.chmod(src, stat.S_IREAD)
@@ -0,0 +1,95 @@
+import logging
+import os
+import queue
+import threading
+from SPACECUE.trial_sound_cache import link_or_copy, remove_file, seal_cache_entry
+
+
+class TrialSoundWriter:
+    """
+    Writes trial sounds in a background thread while the next trials are rendered.
+
+    Rendered sounds go through a bounded queue, so memory stays constant no matter how long the
+    block is: once `max_pending` sounds wait to be written, submit() blocks until the writer
+    catches up. Jobs are handled in order, which lets later jobs link to files earlier jobs write.
+    Written files are sealed as cache entries (see SPACECUE.trial_sound_cache.seal_cache_entry). An error in
+    the writer thread is raised again by the next submit() or by close().
+
+    Example::
+
+        writer = TrialSoundWriter(n_total=len(trial_sequence), description="Block 0")
+        for i, sound in enumerate(sounds):
+            writer.submit(f"cache/{i}.wav", sound=sound, links=[f"block_0/s_{i}.wav"])
+        writer.close()
+    """
+
+    _poll_interval = 0.1  # seconds between checks for a dead writer while the queue is full
+
+    def __init__(self, n_total=None, max_pending=8, description="TrialSoundWriter", progress_every=20,
+                 copy_links=False):
+        self.n_total = n_total
+        self.copy_links = copy_links  # write real copies instead of hardlinks, e.g. when repairing a block
+        self.description = description
+        self.progress_every = progress_every
+        self.n_done = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="TrialSoundWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename, sound=None, links=()):
+        """
+        Queues one trial sound.
+
+        Args:
+            filename (str): file the sound is written to.
+            sound (slab.Sound): the rendered sound. None if `filename` exists or is written by an earlier job.
+            links (list): paths that should refer to `filename` once it is written.
+        """
+        job = (filename, sound, list(links))
+        while True:
+            self._raise_if_failed()
+            try:
+                self._queue.put(job, timeout=self._poll_interval)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Waits until every queued sound is written and raises the writer's error, if any."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(f"Writing {self.description} failed.") from self._error
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if self._error is not None:
+                continue  # drain the queue so submit() never blocks on a dead writer
+            try:
+                self._write(*job)
+            except Exception as e:
+                logging.error(f"Writing {job[0]} failed: {e}")
+                self._error = e
+
+    def _write(self, filename, sound, links):
+        if sound is not None:
+            # write under a unique name first, so concurrent processes never see half-written files
+            tmp_filename = f"{filename}.{os.getpid()}.tmp.wav"
+            sound.write(filename=tmp_filename, normalise=False)
+            remove_file(filename)  # a corrupt, read-only entry that is being replaced
+            os.replace(tmp_filename, filename)
+            seal_cache_entry(filename)
+        for link in links:
+            link_or_copy(filename, link, copy=self.copy_links)
+        self.n_done += 1
+        if self.n_done % self.progress_every == 0 or self.n_done == self.n_total:
+            progress = f"{self.description}: {self.n_done}/{self.n_total or '?'} trial sounds written."
+            print(progress)
+            logging.info(progress)
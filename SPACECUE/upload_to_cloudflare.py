@@ -1,4 +1,6 @@
 import os
+import re
+import csv
 import boto3
 from concurrent.futures import ThreadPoolExecutor
 
@@ -31,6 +33,15 @@ def upload_file(local_path, s3_key):
     except Exception as e:
         print(f"Failed to upload {local_path}: {e}")
 
+def references_trial_sound_cache(block_dir):
+    """True if the block CSV next to `block_dir` points its trials to the content-addressed sound cache."""
+    csv_path = block_dir.rstrip("/\\") + ".csv"
+    if not os.path.exists(csv_path):
+        return False
+    with open(csv_path, newline="") as csvfile:
+        header = next(csv.reader(csvfile), [])
+    return "SoundFile" in header
+
 def main():
     folders_to_upload = ["sequences", "screening_stimuli", "stimuli/targets_low_30_Hz", "stimuli/digits_all_250ms"]
     files_to_upload = []
@@ -49,6 +60,24 @@ def main():
                 # Skip logs
                 if s3_key.startswith("sequences/logs/"):
                     continue
+
+                # The memory-mapped block containers are only read by the lab PCs
+                if s3_key.endswith("/block_audio.npy") or s3_key.endswith("/block_audio_index.json"):
+                    continue
+
+                # SNR files are stimulus QA, the experiment never loads them
+                if s3_key.endswith("_snr.npz"):
+                    continue
+
+                # content hashes of the sound cache entries are only checked by the generator
+                if s3_key.endswith(".wav.sha1"):
+                    continue
+
+                # Trials that reference the sound cache are fetched from there, so their per-trial copies
+                # are not needed online. s_0.wav stays, the online headphone check plays it.
+                if re.fullmatch(r"sequences/sce-\d+_block_\d+/s_\d+\.wav", s3_key) and \
+                        not s3_key.endswith("/s_0.wav") and references_trial_sound_cache(root):
+                    continue
                     
                 files_to_upload.append((local_path, s3_key))
                 
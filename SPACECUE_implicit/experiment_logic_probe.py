@@ -7,6 +7,13 @@ os.environ["SD_ENABLE_ASIO"] = "1"
 import prompts as prompts
 import pandas as pd
 from utils.sound import SoundDeviceSound as Sound
+from utils.sound_bank import load_sound_bank
+from utils.block_prefetcher import BlockPrefetcher
+from utils.trigger_scheduler import TriggerScheduler, MockParallelPort
+from utils.frame_profiler import FrameProfiler
+from utils.static_layer import StaticLayer
+from utils.trial_store import TrialStore
+from utils.response_box_index import ResponseBoxIndex
 from psychopy import parallel, core, event
 from encoding import EEG_TRIGGER_MAP, PRIMING
 import random
@@ -25,9 +32,10 @@ class SpacecueImplicitTrial(Trial):
         # HACKY AND NOT RECOMMENDED --> special case to implement ITI jitter
         # add ITI jitter to the trial
         # self.phase_names.append("iti")
-        self.phase_durations[-1] = self.session.sequence["ITI-Jitter"].iloc[trial_nr]
+        self.phase_durations[-1] = self.parameters["ITI-Jitter"]
         self.trigger_name = None  # this holds the trial-specific trigger name encoding
         self.probe_sequence = None  # Placeholder for probe task sequence
+        self.probe_sound = None  # all letters of the probe task in one buffer
 
     def run(self):
         print(f"TRIAL {self.trial_nr}: Running with task_type = {self.parameters.get('task_type')}") # Uncomment for debugging
@@ -40,29 +48,38 @@ class SpacecueImplicitTrial(Trial):
         # print(f"Target Digit {self.session.sequence.iloc[self.trial_nr]['TargetDigit']} over Speaker {self.session.sequence.iloc[self.trial_nr]['TargetLoc']}")
         # print(f"Distractor Digit {self.session.sequence.iloc[self.trial_nr]['SingletonDigit']} over Speaker {self.session.sequence.iloc[self.trial_nr]['SingletonLoc']}")
         self.stim.play(latency="low", blocksize=0)  # not sure whether this does anything ...
-        self.wait(delay_ms=80)  # wait for 80 ms because of constant internal delay
-        self.session.send_trigger(trigger_name=self.trigger_name)
+        # fires once the calibrated output latency of the device (default 80 ms) has passed, without waiting here
+        self.session.send_trigger(trigger_name=self.trigger_name, delay=self.stim.latency)
 
     def draw(self):
+        profiler = self.session.frame_profiler
+        profiler.begin_frame(self.session.this_block, self.trial_nr, self.phase)
         # do stuff independent of phases
         if self.session.response_device == "mouse":
             self.session.display_response_box()
+            profiler.mark("visuals")
             self.track_mouse_pos()
+            profiler.mark("mouse")
         elif self.session.response_device == "keypad":
-            self.session.default_fix.draw()
+            self.session.fixation_layer.draw()
+            profiler.mark("visuals")
         # play stimulus in phase 0
         if self.phase == 0:
             if self.session.response_device == "mouse":
                 self.session.virtual_response_box[0].lineColor = "black"
                 self.session.mouse.setVisible(True)
                 self.session.mouse.setPos((0, 0))
+                profiler.mark("mouse")
             if not self.stim.is_playing():
                 self.send_trig_and_sound()
+            profiler.mark("sound")
         # get response in phase 1
         if self.phase == 1:
             if any(self.session.mouse.getPressed()):
-                pass
+                if "Click_pos_x" not in self.parameters:  # the first click of the trial
+                    self.log_click()
                 #self.session.mouse.setVisible(False)
+            profiler.mark("response")
         # print too slow warning if response is collected in phase 2
         if self.phase == 2:
             self.stim.stop()  #  reset the sound
@@ -70,6 +87,14 @@ class SpacecueImplicitTrial(Trial):
                 if self.session.virtual_response_box:
                     self.session.virtual_response_box[0].lineColor = "red"
                     self.session.mouse.setVisible(False)
+            profiler.mark("response")
+        profiler.end_frame()
+
+    def log_click(self):
+        """Logs the click position and the digit of the response box under it (None if it missed all digits)."""
+        pos = self.session.mouse.getPos()
+        hit = self.session.response_index.lookup(pos) if self.session.response_index else None
+        self.parameters.update(Click_pos_x=pos[0], Click_pos_y=pos[1], ClickedDigit=None if hit is None else hit[0])
 
     def run_probe(self):
         """Executes the probe task: Play letters, get recall."""
@@ -97,15 +122,10 @@ class SpacecueImplicitTrial(Trial):
         self.session.input_text.draw()
         self.session.win.flip()
 
-        # Play the sequence generated in create_trials
-        # Sequence structure: [{'sound': mixed_sound_obj, 'chars': [...]}, ...]
-        for step in self.probe_sequence:
-            print(f"Playing probe step: {step.get('chars')}")
-            step['sound'].play(latency="low", blocksize=0)
-
-            # Wait for sound to finish + gap (approx 500ms sound + 200ms gap)
-            # Using core.wait is acceptable here as we aren't animating visuals
-            #core.wait(0.4)
+        # Play the sequence rendered in create_trials
+        # Sequence structure: [{'onset': seconds_into_probe_sound, 'chars': [...]}, ...]
+        print(f"Playing probe steps: {[step.get('chars') for step in self.probe_sequence]}")
+        self.probe_sound.play(latency="low", blocksize=0)
 
         # --- Phase 1: Response (Visual Keyboard) ---
         #self.log_phase_info(phase=1)
@@ -171,14 +191,10 @@ class SpacecueImplicitSession(Session):
         self.this_block = None
         self.subject_id = int(self.output_str.split("-")[1])
         self.subj_id_is_even = True if self.subject_id % 2 == 0 else False
-        self.targets = [Sound(filename=os.path.join("stimuli\\targets_low_30_Hz", x),
-                              device=self.settings["soundconfig"]["device"],
-                              mul=self.settings["soundconfig"]["mul"]) for x in
-                        os.listdir(f"stimuli\\targets_low_30_Hz")]
-        self.controls = [Sound(filename=os.path.join("stimuli\\digits_all_250ms", x),
-                               device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"]) for x in
-                         os.listdir(f"stimuli\\digits_all_250ms")]
+        self.targets = load_sound_bank("stimuli\\targets_low_30_Hz", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+            device=self.settings["soundconfig"]["device"])
+        self.controls = load_sound_bank("stimuli\\digits_all_250ms", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+            device=self.settings["soundconfig"]["device"])
 
         # Load letters for probe task
         # Assuming stimuli/letters exists and contains wav files like "A.wav", "B.wav"
@@ -218,7 +234,43 @@ class SpacecueImplicitSession(Session):
 
         if self.settings["mode"]["record_eeg"]:
             self.port = parallel.ParallelPort(0xCFF8)  # set address of port
+        port = self.port if self.settings["mode"]["record_eeg"] else MockParallelPort(clock=core.getTime)
+        self.trigger_scheduler = TriggerScheduler(port, clock=core.getTime)
+        self.frame_profiler = FrameProfiler(steps=("visuals", "mouse", "sound", "response"),
+                                            frame_duration=self.win.monitorFramePeriod,
+                                            enabled=self.settings["mode"].get("profile_frames", False))
         self.randomize_locations = self.settings["numpad"].get("randomize_locations", False)
+        # digits that are drawn and their hit-test index, both rebuilt by configure_response_box()
+        self.active_response_box = list(getattr(self, "virtual_response_box", None) or [])
+        self.response_index = None
+        if self.active_response_box:
+            self.response_index = ResponseBoxIndex(self.active_response_box[1:],
+                                                   hit_radius=self.settings["numpad"].get("hit_radius"))
+        static_layers = self.settings["mode"].get("static_layers", False)
+        self.fixation_layer = StaticLayer(self.win, [self.default_fix], enabled=static_layers)
+        self.response_box_layer = StaticLayer(self.win, self.active_response_box, enabled=static_layers)
+        self.prefetcher = BlockPrefetcher(mul=self.settings["soundconfig"]["mul"])
+
+    def get_blockdir(self, block):
+        return os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+
+    def prefetch_block(self, block, n_trials=None):
+        """Starts loading the trial sounds of `block` in the background, if the block exists."""
+        if block in self.blocks:
+            self.prefetcher.prefetch(self.get_blockdir(block), n_trials or self.n_trials)
+
+    def frame_file(self, block):
+        return os.path.join(self.output_dir, f"{self.output_str}_block_{block}_frames.npz")
+
+    def close(self):
+        self.prefetcher.close()
+        self.trigger_scheduler.close()
+        pd.DataFrame(self.trigger_scheduler.records).to_csv(
+            os.path.join(self.output_dir, f"{self.output_str}_triggers.csv"), index=False)
+        # frames of a block that did not run to its end, e.g. the test block
+        self.frame_profiler.flush(self.frame_file(self.this_block))
+        self.frame_profiler.write_summary(os.path.join(self.output_dir, f"{self.output_str}_frame_summary.csv"))
+        super().close()
 
     def create_visual_keyboard(self):
         """Creates a visual keyboard for the probe task."""
@@ -242,8 +294,7 @@ class SpacecueImplicitSession(Session):
         self.input_text = psychopy.visual.TextStim(self.win, text="", pos=(0, 6), height=1.5, color='yellow')
 
     def display_response_box(self):
-        for stimulus in self.virtual_response_box:
-            stimulus.draw()
+        self.response_box_layer.draw()
 
     def configure_response_box(self, active_digits):
         """Configures the response box to show only active digits."""
@@ -256,7 +307,7 @@ class SpacecueImplicitSession(Session):
                 if not display_presented_only or stim.text in active_digits:
                     active_stimuli.append(stim)
                 else:
-                    stim.pos = (10000, 10000)  # Move off-screen
+                    stim.pos = (10000, 10000)  # Move off-screen, in case anything else hit-tests the whole box
 
             # Recalculate positions for active stimuli
             if active_stimuli and self.settings["numpad"].get("layout") == "circle":
@@ -280,8 +331,53 @@ class SpacecueImplicitSession(Session):
                     y_pos = radius * np.sin(angle_rad)
                     stim.pos = (x_pos, y_pos)
 
+            # only the guide and the active digits are drawn and can be clicked
+            self.active_response_box = self.virtual_response_box[:1] + active_stimuli
+            self.response_box_layer.stimuli = self.active_response_box
+            self.response_index = ResponseBoxIndex(active_stimuli, hit_radius=self.settings["numpad"].get("hit_radius"))
+
+    def render_probe_sequence(self, streams, n_steps):
+        """
+        Mixes the letters of all probe time steps into one gapless buffer.
+
+        Every step plays one letter per location at once and lasts as long as its longest letter, the next
+        step starts right after it. Letters are written straight into their slice of the buffer, so a probe
+        trial allocates a single array instead of one mixture and one padded copy per letter and step.
+
+        Args:
+            streams (dict): location -> list of letters, one per time step.
+            n_steps (int): number of time steps.
+
+        Returns:
+            tuple: the buffer (n_samples, n_channels) and the onset of every step in seconds.
+        """
+        freefield = self.settings["mode"]["freefield"]
+        steps = []
+        for step_idx in range(n_steps):
+            step = []
+            for loc, letters in streams.items():
+                if not letters:
+                    continue
+                char = letters[step_idx]
+                step.append((loc, self.letter_sounds[char].data if freefield else self.letter_sounds[char][loc].data))
+            steps.append(step)
+        lengths = [max((data.shape[0] for _, data in step), default=0) for step in steps]
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+        n_channels = 3 if freefield else 2
+        buffer = np.zeros((offsets[-1], n_channels), dtype=np.float32)
+        for start, step in zip(offsets, steps):
+            for loc, data in step:
+                if freefield:
+                    # Map loc 1->ch0, 2->ch1, 3->ch2 (mono source or taking 1st channel)
+                    buffer[start:start + data.shape[0], loc - 1] += data if data.ndim == 1 else data[:, 0]
+                else:
+                    # Headphones: add stereo signal
+                    buffer[start:start + data.shape[0]] += data
+        onsets = [float(offset / self.settings["session"]["samplerate"]) for offset in offsets[:-1]]
+        return buffer, onsets
+
     def set_block(self, block):
-        self.blockdir = os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+        self.blockdir = self.get_blockdir(block)
         self.display_text(text=f"Initialisiere Block {block+1} von insgesamt {max(self.blocks)+1}... ",
                           duration=3.0)
         self.this_block = block
@@ -289,6 +385,8 @@ class SpacecueImplicitSession(Session):
     def load_sequence(self):
         print("Loading sequence")
         self.sequence = pd.read_csv(self.blockdir + ".csv")
+        # typed arrays the trials read their parameters from, instead of one pandas row each
+        self.trial_store = TrialStore(self.sequence)
 
     def create_trials(self, n_trials, durations, timing="seconds"):
         print("Creating trials")
@@ -340,12 +438,12 @@ class SpacecueImplicitSession(Session):
         # ---------------------------------------------
 
         self.trials = []
+        # pre-gained trial sounds, ready at once if the block was prefetched
+        block_audio = self.prefetcher.get(self.blockdir, n_trials)
         for trial_nr in range(n_trials):
             # Add task_type to parameters so it gets logged
-            params = dict(self.sequence.iloc[trial_nr],
-                          block=self.this_block,
-                          subject_id=self.subject_id,
-                          task_type=task_types[trial_nr])
+            params = self.trial_store[trial_nr]
+            params.update(block=self.this_block, subject_id=self.subject_id, task_type=task_types[trial_nr])
 
             trial = SpacecueImplicitTrial(session=self,
                                           trial_nr=trial_nr,
@@ -355,9 +453,9 @@ class SpacecueImplicitSession(Session):
                                           verbose=True,
                                           timing=timing,
                                           draw_each_frame=True)
-            sound_path = os.path.join(trial.session.blockdir, f"s_{trial.trial_nr}.wav")  # s_0, s_1, ... .wav
-            trial.stim = Sound(filename=sound_path, device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"])
+            data, samplerate = block_audio[trial_nr]
+            trial.stim = Sound(data=data, sr=samplerate, device=self.settings["soundconfig"]["device"],
+                               mul=0)  # the prefetcher already applied the gain
             trial.trigger_name = f'Target-{int(trial.parameters["TargetLoc"])}-Singleton-{int(trial.parameters["SingletonLoc"])}-{PRIMING[trial.parameters["Priming"]]}'
 
             # If probe task, generate the sequence of letters
@@ -388,56 +486,18 @@ class SpacecueImplicitSession(Session):
                         for step_idx, char in enumerate(streams[loc]):
                             trial.parameters[f"Probe_Loc{loc}_Step{step_idx + 1}"] = char
 
-                # Create time steps (mixing sounds for simultaneous playback)
-                for step_idx in range(n_steps):
-                    sounds_to_mix = []
-                    max_samples = 0
-
-                    # Gather data for this step
-                    for loc in locations:
-                        if not streams[loc]: continue
-                        char = streams[loc][step_idx]
-
-                        if self.settings["mode"]["freefield"]:
-                            s_obj = self.letter_sounds[char]
-                            data = s_obj.data
-                            # Ensure 2D (samples, channels)
-                            if data.ndim == 1:
-                                data = data[:, np.newaxis]
-                        else:
-                            s_obj = self.letter_sounds[char][loc]
-                            data = s_obj.data
-
-                        if data.shape[0] > max_samples:
-                            max_samples = data.shape[0]
-                        sounds_to_mix.append((loc, data))
-
-                    # Create mixture array
-                    n_channels = 3 if self.settings["mode"]["freefield"] else 2
-                    mixture = np.zeros((max_samples, n_channels), dtype=np.float32)
-
-                    # Mix sounds
-                    for loc, data in sounds_to_mix:
-                        padded = np.zeros((max_samples, data.shape[1]), dtype=np.float32)
-                        padded[:data.shape[0], :] = data
-
-                        if self.settings["mode"]["freefield"]:
-                            # Map loc 1->ch0, 2->ch1, 3->ch2 (assuming mono source or taking 1st channel)
-                            mixture[:, loc - 1] += padded[:, 0]
-                        else:
-                            # Headphones: add stereo signal
-                            mixture += padded
-
-                    # Create mixed Sound object
-                    mixed_sound = Sound(data=mixture,
-                                        sr=self.settings["session"]["samplerate"],
-                                        device=self.settings["soundconfig"]["device"],
-                                        mul=self.settings["soundconfig"]["mul"])
-
+                # Render all time steps into one buffer, played with a single call in run_probe
+                probe_data, onsets = self.render_probe_sequence(streams, n_steps)
+                trial.probe_sound = Sound(data=probe_data,
+                                          sr=self.settings["session"]["samplerate"],
+                                          device=self.settings["soundconfig"]["device"],
+                                          mul=0)  # the letters already carry the playback gain
+                for step_idx, onset in enumerate(onsets):
                     seq.append({
-                        'sound': mixed_sound,
+                        'onset': onset,
                         'chars': [streams[loc][step_idx] for loc in locations if streams[loc]]
                     })
+                    trial.parameters[f"Probe_Step{step_idx + 1}_Onset"] = onset
 
                 trial.probe_sequence = seq
 
@@ -446,6 +506,8 @@ class SpacecueImplicitSession(Session):
     def run(self, starting_block):
         print("Running experiment")
         # self.send_trigger("experiment_onset")
+        # the first block loads while the instructions are shown
+        self.prefetch_block(1 if self.test else starting_block, n_trials=15 if self.test else None)
         # welcome the participant
         self.display_text(text=prompts.prompt1, keys="space", height=0.75)
         self.display_text(text=prompts.prompt2, keys="space", height=0.75)
@@ -495,6 +557,7 @@ class SpacecueImplicitSession(Session):
                                               self.settings["session"]["response_duration"],
                                               None),  # this is hacky and usually not recommended (for ITI Jitter)
                                    timing=self.settings["session"]["timing"])
+                self.prefetch_block(block + 1)
                 if block == starting_block:
                     self.start_experiment()
                 else:
@@ -512,6 +575,7 @@ class SpacecueImplicitSession(Session):
                 self.send_trigger("block_offset")
                 print(f"Stopping block {block}")
                 self.save_data()
+                self.frame_profiler.flush(self.frame_file(block))
 
                 accuracies = []
                 for t in self.trials:
@@ -530,19 +594,10 @@ class SpacecueImplicitSession(Session):
         # self.send_trigger("experiment_offset")
 
     # Function to send trigger value by specifying event name
-    def send_trigger(self, trigger_name):
-        #print(trigger_name)
-        #print(EEG_TRIGGER_MAP[trigger_name])
-        if self.settings["mode"]["record_eeg"]:
-            # get corresponding trigger value:
-            trigger_value = EEG_TRIGGER_MAP[trigger_name]
-            # send trigger to EEG:
-            self.port.setData(trigger_value)
-            core.wait(0.002)
-            # turn off EEG trigger
-            self.port.setData(0)
-        else:
-            pass
+    def send_trigger(self, trigger_name, delay=0.0):
+        # only queued here, the dispatcher thread writes the port `delay` seconds from now and resets it after the pulse
+        self.trigger_scheduler.schedule(EEG_TRIGGER_MAP[trigger_name], when=self.trigger_scheduler.clock() + delay,
+                                        name=trigger_name, block=self.this_block)
 
     def bbtkv2_test_run(self, n_trials):
         # set block
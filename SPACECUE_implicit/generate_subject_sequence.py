@@ -13,14 +13,6 @@ import logging
 import time
 import random
 
-info = get_input_from_dict({"subject_id": 99, "block": 0})
-
-# load settings
-settings_path = "config.yaml"
-with open(settings_path) as file:
-    settings = yaml.safe_load(file)
-
-
 def precompute_sequence(subject_id, block, settings, logging_level="INFO", compute_snr=False):
     # --- FIX: Ensure subject_id is an integer ---
     try:
@@ -390,4 +382,12 @@ def precompute_sequence(subject_id, block, settings, logging_level="INFO", compu
     logging.info(f"Total script running time: {stop - start:.2f} minutes")
 
 
-precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
\ No newline at end of file
+if __name__ == "__main__":
+    info = get_input_from_dict({"subject_id": 99, "block": 0})
+
+    # load settings
+    settings_path = "config.yaml"
+    with open(settings_path) as file:
+        settings = yaml.safe_load(file)
+
+    precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
@@ -7,6 +7,13 @@ os.environ["SD_ENABLE_ASIO"] = "1"
 import prompts as prompts
 import pandas as pd
 from utils.sound import SoundDeviceSound as Sound
+from utils.sound_bank import load_sound_bank
+from utils.block_prefetcher import BlockPrefetcher
+from utils.audio_engine import AudioEngine
+from utils.trigger_scheduler import TriggerScheduler, MockParallelPort
+from utils.frame_profiler import FrameProfiler
+from utils.static_layer import StaticLayer
+from utils.trial_store import TrialStore
 from psychopy import parallel, core, event
 from encoding import EEG_TRIGGER_MAP, PRIMING
 import random
@@ -21,34 +28,50 @@ class SpaceprimeTrial(Trial):
         # HACKY AND NOT RECOMMENDED --> special case to implement ITI jitter
         # add ITI jitter to the trial
         # self.phase_names.append("iti")
-        self.phase_durations[-1] = self.session.sequence["ITI-Jitter"].iloc[trial_nr]
+        self.phase_durations[-1] = self.parameters["ITI-Jitter"]
         self.trigger_name = None  # this holds the trial-specific trigger name encoding
 
     def send_trig_and_sound(self):
-        self.stim.play(latency="low", blocksize=0)  # not sure whether this does anything ...
-        self.wait(delay_ms=80)  # wait for 80 ms because of constant internal delay
-        self.session.send_trigger(trigger_name=self.trigger_name)
+        engine = self.session.audio_engine
+        if engine is not None:
+            # the scheduler thread fires the trigger when the sound's first sample reaches the DAC
+            voice = self.stim.play(when=engine.time() + engine.lead_time)
+            self.session.trigger_scheduler.schedule(EEG_TRIGGER_MAP[self.trigger_name], voice=voice,
+                                                    name=self.trigger_name, block=self.session.this_block,
+                                                    trial_nr=self.trial_nr)
+        else:
+            self.stim.play(latency="low", blocksize=0)  # not sure whether this does anything ...
+            # fires once the calibrated output latency of the device (default 80 ms) has passed, without waiting here
+            self.session.send_trigger(trigger_name=self.trigger_name, delay=self.stim.latency)
 
     def draw(self):
+        profiler = self.session.frame_profiler
+        profiler.begin_frame(self.session.this_block, self.trial_nr, self.phase)
         # do stuff independent of phases
         if self.session.response_device == "mouse":
             self.session.display_response_box()
+            profiler.mark("visuals")
             self.track_mouse_pos()
+            profiler.mark("mouse")
         elif self.session.response_device == "keypad":
-            self.session.default_fix.draw()
+            self.session.fixation_layer.draw()
+            profiler.mark("visuals")
         # play stimulus in phase 0
         if self.phase == 0:
             if self.session.response_device == "mouse":
                 self.session.virtual_response_box[0].lineColor = "black"
                 self.session.mouse.setVisible(True)
                 self.session.mouse.setPos((0, 0))
+                profiler.mark("mouse")
             if not self.stim.is_playing():
                 self.send_trig_and_sound()
+            profiler.mark("sound")
         # get response in phase 1
         if self.phase == 1:
             if any(self.session.mouse.getPressed()):
                 pass
                 #self.session.mouse.setVisible(False)
+            profiler.mark("response")
         # print too slow warning if response is collected in phase 2
         if self.phase == 2:
             self.stim.stop()  #  reset the sound
@@ -56,6 +79,8 @@ class SpaceprimeTrial(Trial):
                 if self.session.virtual_response_box:
                     self.session.virtual_response_box[0].lineColor = "red"
                     self.session.mouse.setVisible(False)
+            profiler.mark("response")
+        profiler.end_frame()
 
 
 class SpaceprimeSession(Session):
@@ -73,61 +98,107 @@ class SpaceprimeSession(Session):
         self.this_block = None
         self.subject_id = int(self.output_str.split("-")[1])
         self.subj_id_is_even = True if self.subject_id % 2 == 0 else False
+        # one output stream for the whole session instead of one per sound
+        self.audio_engine = None
+        if self.settings["soundconfig"].get("engine"):
+            n_channels = self.settings["session"]["n_locations"] if self.settings["mode"]["freefield"] else 2
+            self.audio_engine = AudioEngine(samplerate=self.settings["session"]["samplerate"],
+                                            channels=self.settings["soundconfig"].get("channels", n_channels),
+                                            device=self.settings["soundconfig"]["device"],
+                                            backend=self.settings["soundconfig"]["engine"],
+                                            filename=os.path.join(self.output_dir, f"{self.output_str}_audio.wav"))
         if self.subj_id_is_even:
-            self.targets = [Sound(filename=os.path.join("stimuli\\targets_low_30_Hz", x),
-                                  device=self.settings["soundconfig"]["device"],
-                                  mul=self.settings["soundconfig"]["mul"]) for x in
-                            os.listdir(f"stimuli\\targets_low_30_Hz")]
-            self.controls = [Sound(filename=os.path.join("stimuli\\digits_all_250ms", x),
-                                   device=self.settings["soundconfig"]["device"],
-                                   mul=self.settings["soundconfig"]["mul"]) for x in
-                             os.listdir(f"stimuli\\digits_all_250ms")]
+            self.targets = load_sound_bank("stimuli\\targets_low_30_Hz", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+                device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
+            self.controls = load_sound_bank("stimuli\\digits_all_250ms", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+                device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
         elif not self.subj_id_is_even:
-            self.targets = [Sound(filename=os.path.join("stimuli\\targets_high_30_Hz", x),
-                                  device=self.settings["soundconfig"]["device"],
-                                  mul=self.settings["soundconfig"]["mul"]) for x in
-                            os.listdir(f"stimuli\\targets_high_30_Hz")]
-            self.controls = [Sound(filename=os.path.join("stimuli\\distractors_high", x),
-                                   device=self.settings["soundconfig"]["device"],
-                                   mul=self.settings["soundconfig"]["mul"]) for x in
-                             os.listdir(f"stimuli\\distractors_high")]
+            self.targets = load_sound_bank("stimuli\\targets_high_30_Hz", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+                device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
+            self.controls = load_sound_bank("stimuli\\distractors_high", mul=self.settings["soundconfig"]["mul"]).as_sounds(
+                device=self.settings["soundconfig"]["device"], engine=self.audio_engine)
         if self.settings["mode"]["record_eeg"]:
             self.port = parallel.ParallelPort(0xCFF8)  # set address of port
+        # sound triggers are timed on the stream clock of the engine, so block and trial triggers share it
+        clock = core.getTime if self.audio_engine is None else self.audio_engine.time
+        port = self.port if self.settings["mode"]["record_eeg"] else MockParallelPort(clock=clock)
+        self.trigger_scheduler = TriggerScheduler(port, clock=clock)
+        self.frame_profiler = FrameProfiler(steps=("visuals", "mouse", "sound", "response"),
+                                            frame_duration=self.win.monitorFramePeriod,
+                                            enabled=self.settings["mode"].get("profile_frames", False))
+        static_layers = self.settings["mode"].get("static_layers", False)
+        self.fixation_layer = StaticLayer(self.win, [self.default_fix], enabled=static_layers)
+        self.response_box_layer = StaticLayer(self.win, getattr(self, "virtual_response_box", None) or [],
+                                              enabled=static_layers)
+        self.prefetcher = BlockPrefetcher(mul=0 if self.audio_engine else self.settings["soundconfig"]["mul"])
 
     def display_response_box(self):
-        for stimulus in self.virtual_response_box:
-            stimulus.draw()
+        self.response_box_layer.draw()
+
+    def n_loudspeakers(self):
+        """Loudspeakers the demo and the accuracy test pick from: 3, or fewer if the engine has fewer channels."""
+        return 3 if self.audio_engine is None else min(3, self.audio_engine.channels)
+
+    def get_blockdir(self, block):
+        return os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+
+    def prefetch_block(self, block, n_trials=None):
+        """Starts loading the trial sounds of `block` in the background, if the block exists."""
+        if block in self.blocks:
+            self.prefetcher.prefetch(self.get_blockdir(block), n_trials or self.n_trials)
+
+    def frame_file(self, block):
+        return os.path.join(self.output_dir, f"{self.output_str}_block_{block}_frames.npz")
+
+    def close(self):
+        self.prefetcher.close()
+        self.trigger_scheduler.close()
+        pd.DataFrame(self.trigger_scheduler.records).to_csv(
+            os.path.join(self.output_dir, f"{self.output_str}_triggers.csv"), index=False)
+        if self.audio_engine is not None:
+            self.audio_engine.close()
+        # frames of a block that did not run to its end, e.g. the test block
+        self.frame_profiler.flush(self.frame_file(self.this_block))
+        self.frame_profiler.write_summary(os.path.join(self.output_dir, f"{self.output_str}_frame_summary.csv"))
+        super().close()
 
     def set_block(self, block):
-        self.blockdir = os.path.join(self.settings["filepaths"]["sequences"], f"{self.output_str}_block_{block}")
+        self.blockdir = self.get_blockdir(block)
         self.display_text(text=f"Initialisiere Block {block+1} von insgesamt {max(self.blocks)+1}... ",
                           duration=3.0)
         self.this_block = block
 
     def load_sequence(self):
         self.sequence = pd.read_csv(self.blockdir + ".csv")
+        # typed arrays the trials read their parameters from, instead of one pandas row each
+        self.trial_store = TrialStore(self.sequence)
 
     def create_trials(self, n_trials, durations, timing="seconds"):
         self.trials = []
+        # pre-gained trial sounds, ready at once if the block was prefetched
+        block_audio = self.prefetcher.get(self.blockdir, n_trials)
         for trial_nr in range(n_trials):
+            params = self.trial_store[trial_nr]
+            params.update(block=self.this_block, subject_id=self.subject_id)
             trial = SpaceprimeTrial(session=self,
                                     trial_nr=trial_nr,
                                     phase_durations=durations,
                                     phase_names=["stim", "response", "iti"],
-                                    parameters=dict(self.sequence.iloc[trial_nr],
-                                                    block=self.this_block,
-                                                    subject_id=self.subject_id),
+                                    parameters=params,
                                     verbose=True,
                                     timing=timing,
                                     draw_each_frame=True)
-            sound_path = os.path.join(trial.session.blockdir, f"s_{trial.trial_nr}.wav")  # s_0, s_1, ... .wav
-            trial.stim = Sound(filename=sound_path, device=self.settings["soundconfig"]["device"],
-                               mul=self.settings["soundconfig"]["mul"])
+            data, samplerate = block_audio[trial_nr]
+            # without the engine the prefetcher already applied the gain, with it the engine applies it
+            trial.stim = Sound(data=data, sr=samplerate, device=self.settings["soundconfig"]["device"],
+                               mul=self.settings["soundconfig"]["mul"] - self.prefetcher.mul, engine=self.audio_engine)
             trial.trigger_name = f'Target-{int(trial.parameters["TargetLoc"])}-Singleton-{int(trial.parameters["SingletonLoc"])}-{PRIMING[trial.parameters["Priming"]]}'
             self.trials.append(trial)
 
     def run(self, starting_block):
         self.send_trigger("experiment_onset")
+        # the first block loads while the instructions are shown
+        self.prefetch_block(1 if self.test else starting_block, n_trials=15 if self.test else None)
         # welcome the participant
         self.display_text(text=prompts.prompt1, keys="space", height=0.75)
         self.display_text(text=prompts.prompt2, keys="space", height=0.75)
@@ -166,6 +237,7 @@ class SpaceprimeSession(Session):
                                               self.settings["session"]["response_duration"],
                                               None),  # this is hacky and usually not recommended (for ITI Jitter)
                                    timing=self.settings["session"]["timing"])
+                self.prefetch_block(block + 1)
                 if block == starting_block:
                     self.start_experiment()
                 else:
@@ -176,6 +248,7 @@ class SpaceprimeSession(Session):
                     trial.run()
                 self.send_trigger("block_offset")
                 self.save_data()
+                self.frame_profiler.flush(self.frame_file(block))
                 if not block == max(self.blocks):
                     self.display_text(text=prompts.pause, duration=60, height=0.75)
                     self.display_text(text=prompts.pause_finished, keys="space", height=0.75)
@@ -183,19 +256,10 @@ class SpaceprimeSession(Session):
         self.send_trigger("experiment_offset")
 
     # Function to send trigger value by specifying event name
-    def send_trigger(self, trigger_name):
-        print(trigger_name)
-        print(EEG_TRIGGER_MAP[trigger_name])
-        if self.settings["mode"]["record_eeg"]:
-            # get corresponding trigger value:
-            trigger_value = EEG_TRIGGER_MAP[trigger_name]
-            # send trigger to EEG:
-            self.port.setData(trigger_value)
-            core.wait(0.002)
-            # turn off EEG trigger
-            self.port.setData(0)
-        else:
-            pass
+    def send_trigger(self, trigger_name, delay=0.0):
+        # only queued here, the dispatcher thread writes the port `delay` seconds from now and resets it after the pulse
+        self.trigger_scheduler.schedule(EEG_TRIGGER_MAP[trigger_name], when=self.trigger_scheduler.clock() + delay,
+                                        name=trigger_name, block=self.this_block)
 
     def bbtkv2_test_run(self, n_trials):
         # set block
@@ -241,7 +305,7 @@ class SpaceprimeSession(Session):
             random.shuffle(stimuli_sequence)
             correct_count = 0
             for stimulus in stimuli_sequence:
-                stimulus.play(latency="low", blocksize=0, mapping=[np.random.randint(1, 4)])
+                stimulus.play(latency="low", blocksize=0, mapping=[np.random.randint(1, self.n_loudspeakers() + 1)])
                 #self.display_text(text="L oder M?")
                 l = psychopy.visual.TextStim(win=self.win, text="L", bold=True, color=[-1, 1, -1], pos=[2, 0]).draw()
                 m = psychopy.visual.TextStim(win=self.win, text="M", bold=True, color=[1, -1, -1], pos=[-2, 0]).draw()
@@ -269,6 +333,14 @@ class SpaceprimeSession(Session):
 
     def run_demo(self):
         self.display_text(text=prompts.demo, keys="space", height=0.75)
+        if self.audio_engine is not None:
+            # all digits are queued at once, each routed to a random loudspeaker when it is submitted
+            loudspeakers = np.random.randint(0, self.n_loudspeakers(), size=len(self.targets))
+            voices = self.audio_engine.play_sequence([digit.data for digit in self.targets], channels=loudspeakers,
+                                                     soa=1.5, gain=self.targets[0].gain)
+            voices[-1].wait()
+            core.wait(1.5 - self.targets[-1].duration)
+            return
         for digit in self.targets:
             digit.play(latency="low", blocksize=0, mapping=[np.random.randint(1, 4)])
             core.wait(1.5)
@@ -14,14 +14,6 @@ import logging
 import time
 
 
-info = get_input_from_dict({"subject_id": 99, "block": 0})
-
-# load settings
-settings_path = "config.yaml"
-with open(settings_path) as file:
-    settings = yaml.safe_load(file)
-
-
 def precompute_sequence(subject_id, block, settings, logging_level="INFO", compute_snr=False):
     # get relevant params from settings
     samplerate = settings["session"]["samplerate"]
@@ -202,7 +194,7 @@ def precompute_sequence(subject_id, block, settings, logging_level="INFO", compu
             prev_target_loc = sample["TargetLoc"].values[0]
             prev_singleton_loc = sample["SingletonLoc"].values[0]
 
-            trial_sequence = trial_sequence._append(sample)
+            trial_sequence = pd.concat([trial_sequence, sample])
             logging.debug(
                 f"Appended sample to trial sequence. Length of current trial sequence: {trial_sequence.__len__()}")
 
@@ -347,4 +339,12 @@ def precompute_sequence(subject_id, block, settings, logging_level="INFO", compu
     logging.info(f"Total script running time: {stop - start:.2f} minutes")
 
 
-precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
+if __name__ == "__main__":
+    info = get_input_from_dict({"subject_id": 99, "block": 0})
+
+    # load settings
+    settings_path = "config.yaml"
+    with open(settings_path) as file:
+        settings = yaml.safe_load(file)
+
+    precompute_sequence(subject_id=info["subject_id"], block=info["block"], settings=settings)
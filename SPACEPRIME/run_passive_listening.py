@@ -7,7 +7,10 @@ import os.path as op
 import yaml
 import collections
 from psychopy import prefs as psychopy_prefs
-from utils.sound import SoundDeviceSound as Sound
+from utils.sound_bank import load_sound_bank
+from utils.audio_engine import AudioEngine
+from utils.trigger_scheduler import TriggerScheduler
+import pandas as pd
 from itertools import product
 
 
@@ -87,7 +90,8 @@ params = {
     "iti": 0.6,
     "stim_duration": 0.25,
     "locations": [1, 2, 3],
-    "sound_types": ["target", "distractor", "control"]
+    "sound_types": ["target", "distractor", "control"],
+    "timeline": False  # True queues all stimuli on one audio stream at precomputed onsets, False plays/waits per stimulus
 }
 # Create a window
 win = visual.Window(
@@ -107,25 +111,19 @@ elif int(subj_info["ID"]) % 2 != 0:
 # define stimuli types based on subject ID
 if sub_id_is_even:
     # now, create to-be-used sound objects from slab data matrices
-    targets = [Sound(filename=os.path.join(f"stimuli\\targets_low_30_Hz", x),
-                     device=settings["soundconfig"]["device"],
-                     mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\targets_low_30_Hz")]
-    distractors = [Sound(filename=os.path.join(f"stimuli\\distractors_high", x),
-                         device=settings["soundconfig"]["device"],
-                         mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\distractors_high")]
-    controls = [Sound(filename=os.path.join(f"stimuli\\digits_all_250ms", x),
-                      device=settings["soundconfig"]["device"],
-                      mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\digits_all_250ms")]
+    targets = load_sound_bank("stimuli\\targets_low_30_Hz", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
+    distractors = load_sound_bank("stimuli\\distractors_high", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
+    controls = load_sound_bank("stimuli\\digits_all_250ms", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
 elif not sub_id_is_even:
-    targets = [Sound(filename=os.path.join(f"stimuli\\targets_high_30_Hz", x),
-                     device=settings["soundconfig"]["device"],
-                     mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\targets_high_30_Hz")]
-    distractors = [Sound(filename=os.path.join(f"stimuli\\digits_all_250ms", x),
-                         device=settings["soundconfig"]["device"],
-                         mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\digits_all_250ms")]
-    controls = [Sound(filename=os.path.join(f"stimuli\\distractors_high", x),
-                      device=settings["soundconfig"]["device"],
-                      mul=settings["soundconfig"]["mul"]) for x in os.listdir(f"stimuli\\distractors_high")]
+    targets = load_sound_bank("stimuli\\targets_high_30_Hz", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
+    distractors = load_sound_bank("stimuli\\digits_all_250ms", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
+    controls = load_sound_bank("stimuli\\distractors_high", mul=settings["soundconfig"]["mul"]).as_sounds(
+        device=settings["soundconfig"]["device"])
 
 fixation_cross = visual.TextStim(
     win=win,
@@ -135,6 +133,20 @@ fixation_cross = visual.TextStim(
 )
 
 
+def plan_onsets(n_stimuli, stim_duration, iti, iti_jitter=0.2):
+    """
+    Precomputes the onset of every stimulus, relative to the first one.
+
+    Consecutive onsets are `stim_duration` plus a uniform ITI in [iti - iti_jitter, iti + iti_jitter] apart,
+    like the ISI of the play/wait loop, but without the time spent in play() and core.wait() adding up.
+
+    Returns:
+      numpy.ndarray: onsets in seconds.
+    """
+    isis = stim_duration + np.random.uniform(iti - iti_jitter, iti + iti_jitter, size=n_stimuli - 1)
+    return np.concatenate(([0.0], np.cumsum(isis)))
+
+
 def create_pseudorandom_sequence(locations, sound_types, n_reps, n_digits):
   """
   Creates a pseudorandomized trial sequence with no immediate repetition
@@ -222,29 +234,69 @@ for wait_time in reversed(range(1, 4)):
 # display fixation cross
 fixation_cross.draw()
 win.flip()
-# iterate over trialsequence
-for trial in trialsequence:
-    # make mouse invisible
+if params["timeline"]:
+    # plan the whole block, then hand it to one open stream: onsets are exact to the sample and the
+    # triggers follow the DAC time of every stimulus, so nothing accumulates over the sequence
     win.setMouseVisible(False)
-    if trial[1] == "distractor":
-        stim = distractors[int(trial[2])-1]
-    elif trial[1] == "target":
-        stim = targets[int(trial[2])-1]
-    elif trial[1] == "control":
-        stim = controls[int(trial[2])-1]
-    trigger_name = f"{trial[1]}-location-{trial[0]}-number-{trial[2]}"
-    stim.play(latency="low", mapping=int(trial[0]), blocksize=0)
-    #stim.play(latency="low", mapping=3, blocksize=0)
-    core.wait(0.08)  # fucking 80 ms wait LOL
-    send_trigger(trigger_name=trigger_name, port=port)
-    #send_trigger(trigger_name="test_trigger", port=port)
-    core.wait(params["stim_duration"])
-    #core.wait(0.08)
-    if 'q' in event.getKeys():
+    onsets = plan_onsets(len(trialsequence), params["stim_duration"], params["iti"])
+    engine = AudioEngine(samplerate=targets[0].sr, channels=max(params["locations"]),
+                         device=settings["soundconfig"]["device"])
+    scheduler = TriggerScheduler(port, clock=engine.time)
+    start_time = engine.time() + engine.lead_time + 0.5  # time to queue all stimuli before the first is due
+    voices = []
+    quit_requested = False
+    for stim_nr, (trial, onset) in enumerate(zip(trialsequence, onsets)):
+        if trial[1] == "distractor":
+            stim = distractors[int(trial[2])-1]
+        elif trial[1] == "target":
+            stim = targets[int(trial[2])-1]
+        elif trial[1] == "control":
+            stim = controls[int(trial[2])-1]
+        trigger_name = f"{trial[1]}-location-{trial[0]}-number-{trial[2]}"
+        voice = engine.play(stim.data, channels=[int(trial[0]) - 1], when=start_time + onset, gain=stim.gain)
+        scheduler.schedule(PASSIVE_LISTENING_MAP[trigger_name], voice=voice, name=trigger_name, stimulus=stim_nr)
+        voices.append(voice)
+    while not voices[-1].is_finished():
+        if 'q' in event.getKeys():
+            engine.stop_all()
+            quit_requested = True
+            break
+        core.wait(0.1)
+    engine.close()
+    scheduler.close()
+    # export planned and actual onset of every stimulus, on the clock of the audio stream
+    timing = pd.DataFrame(trialsequence, columns=["location", "sound_type", "digit"])
+    timing["planned_onset"] = start_time + onsets
+    timing["actual_onset"] = [voice.onset_time for voice in voices]
+    timing["trigger_time"] = [record["actual"] for record in scheduler.records]
+    timing.to_csv(f'sequences\sub-{int(subj_info["ID"])}_passive_listening_timing.csv', index=False)
+    if quit_requested:
         # Stop the experiment
         core.quit()
-    # Inter-trial interval
-    core.wait(np.random.uniform(params["iti"]-0.2, params["iti"]+0.2))
+else:
+    # iterate over trialsequence
+    for trial in trialsequence:
+        # make mouse invisible
+        win.setMouseVisible(False)
+        if trial[1] == "distractor":
+            stim = distractors[int(trial[2])-1]
+        elif trial[1] == "target":
+            stim = targets[int(trial[2])-1]
+        elif trial[1] == "control":
+            stim = controls[int(trial[2])-1]
+        trigger_name = f"{trial[1]}-location-{trial[0]}-number-{trial[2]}"
+        stim.play(latency="low", mapping=int(trial[0]), blocksize=0)
+        #stim.play(latency="low", mapping=3, blocksize=0)
+        core.wait(stim.latency)  # calibrated output latency of the device, see utils/latency_calibration.py
+        send_trigger(trigger_name=trigger_name, port=port)
+        #send_trigger(trigger_name="test_trigger", port=port)
+        core.wait(params["stim_duration"])
+        #core.wait(0.08)
+        if 'q' in event.getKeys():
+            # Stop the experiment
+            core.quit()
+        # Inter-trial interval
+        core.wait(np.random.uniform(params["iti"]-0.2, params["iti"]+0.2))
 
 # Close the window
 win.close()
\ No newline at end of file
@@ -0,0 +1 @@
+# makes the repository root importable for the tests, like running the scripts from it (python -m utils....)
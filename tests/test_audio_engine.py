@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from utils.audio_engine import AudioEngine
+
+SAMPLERATE = 1000
+
+
+@pytest.fixture
+def engine():
+    engine = AudioEngine(samplerate=SAMPLERATE, channels=3, backend="null", blocksize=64, latency=0.0,
+                         realtime=False)
+    yield engine
+    engine.close()
+
+
+def test_voices_are_mixed_with_their_gain_on_their_channels(engine):
+    first = np.ones(10, dtype=np.float32)
+    second = np.full((10, 2), 0.25, dtype=np.float32)
+    engine.play(first, channels=[0], gain=0.5)
+    engine.play(second, channels=[0, 2])
+    out = engine.render(64)
+    np.testing.assert_allclose(out[:10, 0], 0.75)
+    np.testing.assert_allclose(out[:10, 1], 0.0)
+    np.testing.assert_allclose(out[:10, 2], 0.25)
+    assert not out[10:].any()
+    # the gain is applied while mixing, the submitted samples stay untouched
+    np.testing.assert_array_equal(first, 1.0)
+
+
+def test_scheduled_voice_starts_at_its_sample(engine):
+    voice = engine.play(np.ones(5, dtype=np.float32), when=0.1)  # sample 100, in the second buffer
+    assert not engine.render(64).any()
+    out = engine.render(64)
+    assert voice.onset_time == pytest.approx(0.1)
+    assert np.flatnonzero(out[:, 0]).tolist() == [36, 37, 38, 39, 40]
+    assert voice.is_finished()
+
+
+def test_voice_spanning_buffers_plays_through(engine):
+    data = np.arange(1, 101, dtype=np.float32)
+    voice = engine.play(data, channels=[1])
+    out = np.concatenate([engine.render(64), engine.render(64)])
+    np.testing.assert_array_equal(out[:100, 1], data)
+    assert voice.is_finished()
+
+
+def test_play_sequence_keeps_the_soa(engine):
+    sounds = [np.ones(3, dtype=np.float32) * (i + 1) for i in range(3)]
+    voices = engine.play_sequence(sounds, channels=[2, 1, 0], soa=0.05, when=0.02)
+    out = np.concatenate([engine.render(64) for _ in range(3)])
+    assert [voice.onset_time for voice in voices] == pytest.approx([0.02, 0.07, 0.12])
+    for i, channel in enumerate([2, 1, 0]):
+        onset = 20 + i * 50
+        np.testing.assert_array_equal(out[onset:onset + 3, channel], i + 1)
+
+
+def test_late_voice_starts_at_once_and_is_counted(engine):
+    engine.render(64)
+    voice = engine.play(np.ones(4, dtype=np.float32), when=0.01)
+    out = engine.render(64)
+    assert engine.n_late == 1
+    assert voice.onset_time == pytest.approx(64 / SAMPLERATE)
+    assert np.flatnonzero(out[:, 0]).tolist() == [0, 1, 2, 3]
+
+
+def test_stopped_voice_is_not_mixed(engine):
+    voice = engine.play(np.ones(10, dtype=np.float32), when=0.1)
+    voice.stop()
+    assert voice.is_finished()
+    assert not np.concatenate([engine.render(64), engine.render(64)]).any()
+
+
+def test_routing_to_a_missing_channel_is_rejected(engine):
+    with pytest.raises(ValueError):
+        engine.play(np.ones(4, dtype=np.float32), channels=[3])
@@ -0,0 +1,15 @@
+import pytest
+from utils.benchmark_generation import run_benchmarks, PACKAGES
+
+try:
+    import slab  # noqa: F401, the generation scripts need it (and with it sounddevice and PortAudio)
+except Exception as e:
+    pytest.skip(f"slab is not usable here: {e}", allow_module_level=True)
+
+
+@pytest.mark.parametrize("package", PACKAGES)
+def test_smoke_run(package):
+    results = run_benchmarks(packages=[package], smoke=True)
+    result = results["packages"][package]
+    assert "error" not in result, result
+    assert result["trials"] > 0 and result["trials_per_second"] > 0
@@ -0,0 +1,50 @@
+import numpy as np
+import soundfile
+import pytest
+from utils.block_container import (BlockContainer, write_block_container, remove_block_container,
+                                   has_block_container)
+from SPACECUE.generation_manifest import describe_block, is_block_current
+
+
+@pytest.fixture
+def block(tmp_path):
+    blockdir = tmp_path / "sce-01_block_0"
+    blockdir.mkdir()
+    sounds = [np.random.default_rng(i).uniform(-0.5, 0.5, (100 + 10 * i, 2)).astype(np.float32) for i in range(3)]
+    sound_files = []
+    for i, sound in enumerate(sounds):
+        sound_files.append(str(blockdir / f"s_{i}.wav"))
+        soundfile.write(sound_files[-1], sound, 44100, subtype="FLOAT")
+    csv_path = tmp_path / "sce-01_block_0.csv"
+    csv_path.write_text("TargetLoc\n1\n2\n3\n")
+    return str(csv_path), str(blockdir), sound_files, sounds
+
+
+def test_container_round_trip(block):
+    _, blockdir, sound_files, sounds = block
+    write_block_container(blockdir, sound_files)
+    assert has_block_container(blockdir)
+    container = BlockContainer(blockdir)
+    assert len(container) == len(sounds) and container.samplerate == 44100
+    for trial_nr, sound in enumerate(sounds):
+        np.testing.assert_array_equal(container[trial_nr], sound)
+    del container
+    remove_block_container(blockdir)
+    assert not has_block_container(blockdir)
+
+
+def test_block_with_recorded_container_is_current(block):
+    csv_path, blockdir, sound_files, _ = block
+    write_block_container(blockdir, sound_files)
+    entry = describe_block(csv_path, blockdir, sound_files, seed=1)
+    assert is_block_current(entry, csv_path, blockdir, expected=dict(seed=1), needs_sounds=True)
+    remove_block_container(blockdir)
+    assert not is_block_current(entry, csv_path, blockdir, expected=dict(seed=1), needs_sounds=True)
+
+
+def test_container_left_from_an_earlier_run_is_stale(block):
+    csv_path, blockdir, sound_files, _ = block
+    entry = describe_block(csv_path, blockdir, sound_files, seed=1)
+    assert is_block_current(entry, csv_path, blockdir, expected=dict(seed=1), needs_sounds=True)
+    write_block_container(blockdir, sound_files)
+    assert not is_block_current(entry, csv_path, blockdir, expected=dict(seed=1), needs_sounds=True)
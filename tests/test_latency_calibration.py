@@ -0,0 +1,20 @@
+import pytest
+from utils.latency_calibration import (SimulatedLoopback, calibrate_latency, save_latency_profile, load_latency,
+                                       DEFAULT_LATENCY)
+
+
+def test_simulated_latency_is_recovered():
+    result = calibrate_latency(SimulatedLoopback(latency=0.08, jitter=0.001, seed=0))
+    assert result["latency"] == pytest.approx(0.08, abs=0.001)
+    assert result["jitter"] < 0.002
+    assert len(result["lags"]) == result["n_repetitions"]
+
+
+def test_profile_round_trip(tmp_path):
+    filename = str(tmp_path / "profiles" / "latency_profiles.json")
+    assert load_latency("Speakers (ASIO)", filename=filename) == DEFAULT_LATENCY
+    save_latency_profile("Speakers (ASIO)", dict(latency=0.0123, jitter=0.0001), filename=filename)
+    save_latency_profile("Headphones (MME)", dict(latency=0.0456, jitter=0.0002), filename=filename)
+    assert load_latency("Speakers (ASIO)", filename=filename) == 0.0123
+    assert load_latency("Headphones (MME)", filename=filename) == 0.0456
+    assert load_latency("Unknown device", default=0.1, filename=filename) == 0.1
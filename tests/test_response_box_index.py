@@ -0,0 +1,51 @@
+import numpy as np
+from utils.response_box_index import ResponseBoxIndex
+
+
+class FakeDigit:
+    """A TextStim stand-in whose contains() is its text box, like psychopy's."""
+
+    def __init__(self, text, pos, height=1.0, width=0.6):
+        self.text = text
+        self.pos = np.array(pos)
+        self.height = height
+        self.width = width
+
+    def contains(self, pos):
+        return abs(pos[0] - self.pos[0]) <= self.width / 2 and abs(pos[1] - self.pos[1]) <= self.height / 2
+
+
+def numpad(spacing=1.0):
+    return [FakeDigit(str(digit), ((digit - 1) % 3 * spacing - spacing, 1 - (digit - 1) // 3 * spacing))
+            for digit in range(1, 10)]
+
+
+def brute_force(stimuli, pos):
+    hits = [stim for stim in stimuli if stim.contains(pos)]
+    if not hits:
+        return None
+    nearest = min(hits, key=lambda stim: (pos[0] - stim.pos[0]) ** 2 + (pos[1] - stim.pos[1]) ** 2)
+    return nearest.text
+
+
+def test_default_matches_contains():
+    rng = np.random.default_rng(0)
+    for spacing in (0.5, 1.0, 2.0):  # overlapping, touching and separate text boxes
+        stimuli = numpad(spacing)
+        index = ResponseBoxIndex(stimuli)
+        for pos in rng.uniform(-2.5 * spacing, 2.5 * spacing, size=(5000, 2)):
+            hit = index.lookup(pos)
+            assert (None if hit is None else hit[0]) == brute_force(stimuli, pos)
+
+
+def test_hit_radius_is_a_circle():
+    index = ResponseBoxIndex([FakeDigit("5", (0, 0))], hit_radius=0.5)
+    assert index.lookup((0.3, 0.3))[0] == "5"
+    assert index.lookup((0.4, 0.4)) is None
+    assert index.lookup((0.0, -0.5)) == ("5", 0.0, 0.0)
+
+
+def test_nearest_digit_wins_and_empty_box():
+    stimuli = [FakeDigit("1", (0, 0), width=2), FakeDigit("2", (0.5, 0), width=2)]
+    assert ResponseBoxIndex(stimuli).lookup((0.4, 0))[0] == "2"
+    assert ResponseBoxIndex([]).lookup((0, 0)) is None
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+from utils.audio_engine import AudioEngine
+
+try:
+    import sounddevice  # noqa: F401, SoundDeviceSound needs it (and with it PortAudio)
+except Exception as e:
+    pytest.skip(f"sounddevice is not usable here: {e}", allow_module_level=True)
+from utils.sound import SoundDeviceSound
+
+
+def test_engine_sound_keeps_playing_state_after_it_ended():
+    engine = AudioEngine(samplerate=1000, channels=2, backend="null", blocksize=64, realtime=False)
+    sound = SoundDeviceSound(data=np.ones(10, dtype=np.float32), sr=1000, mul=0, engine=engine)
+    sound.play()
+    engine.render(64)
+    # sessions start a trial's sound once, while is_playing() is False
+    assert sound.is_finished()
+    assert sound.is_playing()
+    sound.stop()
+    assert not sound.is_playing()
+    engine.close()
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.trial_store import TrialStore
+
+
+@pytest.fixture
+def sequence():
+    return pd.DataFrame({"TargetLoc": [1, 3, 2],
+                         "Priming": [0, -1, 1],
+                         "ITI-Jitter": [0.5, 0.75, 1.0],
+                         "TargetDigit": [2, 5, 9]})
+
+
+def test_rows_round_trip_with_python_types(sequence):
+    store = TrialStore(sequence)
+    assert len(store) == len(sequence)
+    for trial_nr, row in enumerate(sequence.to_dict(orient="records")):
+        parameters = store[trial_nr]
+        assert dict(parameters) == row
+        assert all(not isinstance(value, np.generic) for value in parameters.values())
+
+
+def test_attributes_read_columns_with_dashes(sequence):
+    parameters = TrialStore(sequence)[1]
+    assert parameters.TargetLoc == 3
+    assert parameters.ITI_Jitter == 0.75
+    with pytest.raises(AttributeError):
+        parameters.SingletonLoc
+
+
+def test_set_values_are_logged_after_the_columns(sequence):
+    store = TrialStore(sequence)
+    parameters = store[0]
+    parameters.update(block=2, TargetLoc=3)
+    assert parameters["TargetLoc"] == 3
+    assert list(parameters) == ["TargetLoc", "Priming", "ITI-Jitter", "TargetDigit", "block"]
+    assert len(parameters) == 5
+    assert parameters.copy() == {"TargetLoc": 3, "Priming": 0, "ITI-Jitter": 0.5, "TargetDigit": 2, "block": 2}
+    # set values stay on the trial, the store keeps the sequence
+    assert store[0]["TargetLoc"] == 1
+
+
+def test_columns_cannot_be_deleted(sequence):
+    parameters = TrialStore(sequence)[0]
+    parameters["response"] = 4
+    del parameters["response"]
+    assert "response" not in parameters
+    with pytest.raises(KeyError):
+        del parameters["TargetLoc"]
@@ -0,0 +1,79 @@
+import threading
+import time
+import pytest
+from utils.trigger_scheduler import TriggerScheduler, MockParallelPort
+
+
+class FakeVoice:
+    def __init__(self):
+        self.onset_time = None
+        self._finished = threading.Event()
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+
+@pytest.fixture
+def port():
+    return MockParallelPort()
+
+
+def make_scheduler(port, **kwargs):
+    return TriggerScheduler(port, clock=port.clock, priority=None, **kwargs)
+
+
+def test_triggers_are_sent_in_time_order(port):
+    scheduler = make_scheduler(port)
+    start = port.clock() + 0.05
+    records = [scheduler.schedule(value, when=start + offset) for value, offset in ((3, 0.04), (1, 0.0), (2, 0.02))]
+    scheduler.close()
+    assert [value for _, value in port.writes if value] == [1, 2, 3]
+    for record in records:
+        assert record["status"] == "sent"
+        assert record["actual"] >= record["intended"]
+
+
+def test_duplicate_during_pulse_is_merged(port):
+    scheduler = make_scheduler(port, pulse_duration=0.02)
+    start = port.clock() + 0.05
+    first = scheduler.schedule(5, when=start)
+    duplicate = scheduler.schedule(5, when=start + 0.005)
+    scheduler.close()
+    assert first["status"] == "sent"
+    assert duplicate["status"] == "merged"
+    assert [value for _, value in port.writes] == [5, 0]
+
+
+def test_conflicting_trigger_is_postponed_until_the_port_is_free(port):
+    scheduler = make_scheduler(port, pulse_duration=0.01)
+    start = port.clock() + 0.05
+    first = scheduler.schedule(1, when=start)
+    second = scheduler.schedule(2, when=start + 0.002)
+    scheduler.close()
+    assert second["status"] == "sent"
+    # the first pulse is reset after pulse_duration, and the port stays 0 for another pulse_duration
+    assert second["actual"] - first["actual"] >= 2 * 0.01
+    assert [value for _, value in port.writes] == [1, 0, 2, 0]
+
+
+def test_voice_trigger_fires_at_onset_time(port):
+    scheduler = make_scheduler(port)
+    voice = FakeVoice()
+    record = scheduler.schedule(7, voice=voice)
+    time.sleep(0.02)
+    assert record["status"] == "pending"
+    voice.onset_time = port.clock() + 0.03  # reported one output latency ahead, like the audio callback
+    scheduler.close()
+    assert record["status"] == "sent"
+    assert record["intended"] == voice.onset_time
+    assert record["actual"] >= voice.onset_time
+
+
+def test_voice_that_never_starts_is_missed(port):
+    scheduler = make_scheduler(port)
+    voice = FakeVoice()
+    record = scheduler.schedule(7, voice=voice)
+    voice._finished.set()
+    scheduler.close()
+    assert record["status"] == "missed"
+    assert port.writes == []
@@ -0,0 +1,281 @@
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+import types
+import numpy as np
+
+
+class Voice:
+    """
+    One sound submitted to an AudioEngine.
+
+    The audio callback owns the playback position; other threads only read the state or request a stop.
+    """
+
+    def __init__(self, data, channels, start_time=None, gain=1.0):
+        self.data = data
+        self.channels = channels
+        self.gain = gain  # linear, applied while mixing; may be changed while the voice plays
+        self.start_time = start_time  # requested stream time of the first sample, None for as soon as possible
+        self.onset_time = None  # stream time at which the first sample reached the DAC, set by the callback
+        self.position = 0
+        self._stop_requested = False
+        self._finished = threading.Event()
+
+    def is_playing(self):
+        """`True` once the first sample was mixed and until the sound ends or is stopped."""
+        return self.onset_time is not None and not self._finished.is_set()
+
+    def is_finished(self):
+        return self._finished.is_set()
+
+    def stop(self):
+        """Stops the voice at the next audio buffer. A voice that has not started yet is finished at once."""
+        self._stop_requested = True
+        if self.onset_time is None:
+            self._finished.set()
+
+    def wait(self, timeout=None):
+        """Blocks until the voice has finished. Returns False on timeout."""
+        return self._finished.wait(timeout)
+
+
+class _SimulatedStream:
+    """
+    Drives the engine's callback without audio hardware, in real time from a thread.
+
+    Buffer k is rendered at stream time k * blocksize / samplerate and reaches the (virtual) DAC
+    `latency` seconds later, just like PortAudio reports it.
+    """
+
+    def __init__(self, samplerate, channels, blocksize, latency, callback, sink=None):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.latency = latency
+        self.callback = callback
+        self.sink = sink
+        self.frames_rendered = 0
+        self._t0 = None
+        self._running = threading.Event()
+        self._thread = None
+
+    @property
+    def time(self):
+        return 0.0 if self._t0 is None else time.perf_counter() - self._t0
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="AudioEngine", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running.is_set():
+            self.render(self.blocksize)
+            next_buffer = self.frames_rendered / self.samplerate
+            delay = next_buffer - self.time
+            if delay > 0:
+                time.sleep(delay)
+
+    def render(self, frames):
+        """Renders the next `frames` frames and returns them."""
+        outdata = np.zeros((frames, self.channels), dtype=np.float32)
+        current_time = self.frames_rendered / self.samplerate
+        time_info = types.SimpleNamespace(currentTime=current_time, outputBufferDacTime=current_time + self.latency)
+        self.callback(outdata, frames, time_info, None)
+        self.frames_rendered += frames
+        if self.sink is not None:
+            self.sink.write(outdata)
+        return outdata
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        self.stop()
+        if self.sink is not None:
+            self.sink.close()
+
+
+class AudioEngine:
+    """
+    Long-lived output stream shared by a whole session.
+
+    Opening the stream once removes the stream setup `sounddevice.play()` pays for every sound. Sounds are
+    handed to the audio callback through a deque (appends and pops are atomic, so neither side ever waits
+    for a lock) and are mixed there, which allows starting a sound at an exact stream time.
+
+    Backends:
+        "stream": a sounddevice.OutputStream on `device`.
+        "null": no audio hardware. The callback runs from a thread in real time, or, with `realtime=False`,
+            only when render() is called.
+        "file": like "null", but everything that is played is also written to the WAV file `filename`.
+
+    Example::
+
+        engine = AudioEngine(samplerate=44100, channels=2, device=3)
+        voice = engine.play(data, when=engine.time() + 0.05)
+        voice.wait()
+        engine.close()
+    """
+
+    def __init__(self, samplerate, channels, device=None, backend="stream", blocksize=0, latency="low",
+                 filename=None, realtime=True):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.backend = backend
+        self._incoming = collections.deque()
+        self._active = []  # only touched by the audio callback
+        self._scheduled = []  # heap of (start_time, n, voice) not due yet, only touched by the audio callback
+        self._n_scheduled = itertools.count()  # tie-breaker, keeps voices with equal start times in order
+        self.n_late = 0  # voices whose requested start time had already passed
+        if backend == "stream":
+            import sounddevice
+            self._stream = sounddevice.OutputStream(samplerate=samplerate, channels=channels, dtype="float32",
+                                                    device=device, blocksize=blocksize, latency=latency,
+                                                    callback=self._callback)
+            self.latency = self._stream.latency
+        elif backend in ("null", "file"):
+            sink = None
+            if backend == "file":
+                import soundfile
+                sink = soundfile.SoundFile(filename, mode="w", samplerate=samplerate, channels=channels,
+                                           subtype="FLOAT")
+            self.latency = latency if isinstance(latency, (int, float)) else 0.0
+            self._stream = _SimulatedStream(samplerate, channels, blocksize=blocksize or 256, latency=self.latency,
+                                            callback=self._callback, sink=sink)
+        else:
+            raise ValueError(f"Unknown audio engine backend {backend}. Choose stream, null or file.")
+        # earliest safe `when` relative to time(): the output latency plus a margin for the next callback
+        self.lead_time = self.latency + 0.01
+        self.realtime = realtime or backend == "stream"
+        if self.realtime:
+            self._stream.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def time(self):
+        """Current stream time in seconds, the clock of `when` and Voice.onset_time."""
+        return self._stream.time
+
+    def play(self, data, channels=None, when=None, gain=1.0):
+        """
+        Queues a sound for playback.
+
+        Args:
+            data (numpy.ndarray): samples, shape (n_samples,) or (n_samples, n_columns).
+            channels (list): output channel (0-based) of every column of `data`. Default: the first columns.
+            when (float): stream time (see time()) at which the first sample should reach the DAC.
+                None starts the sound with the next audio buffer.
+            gain (float): linear gain, applied while mixing so `data` is never copied or changed.
+
+        Returns:
+            Voice: handle to query or stop the sound.
+        """
+        data = np.asarray(data, dtype=np.float32)  # no copy for float32 data
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        if channels is None:
+            channels = list(range(data.shape[1]))
+        if len(channels) != data.shape[1] or max(channels) >= self.channels:
+            raise ValueError(f"Cannot route {data.shape[1]} columns to channels {channels} "
+                             f"of a {self.channels}-channel engine.")
+        voice = Voice(data, list(channels), start_time=when, gain=gain)
+        self._incoming.append(voice)
+        return voice
+
+    def play_sequence(self, sounds, channels, soa, when=None, gain=1.0):
+        """
+        Queues several sounds back to back, each routed to its own output channel.
+
+        All voices are submitted at once, so the whole sequence plays from the open stream with
+        sample-accurate onsets and without any per-sound routing or stream setup.
+
+        Args:
+            sounds (list): mono sounds, e.g. views into a utils.sound_bank.SoundBank.
+            channels (list): output channel (0-based) of every sound.
+            soa (float): seconds between the onsets of consecutive sounds.
+            when (float): stream time of the first onset. Default: time() + lead_time.
+            gain (float): linear gain of all sounds.
+
+        Returns:
+            list: one Voice per sound.
+        """
+        if when is None:
+            when = self.time() + self.lead_time
+        return [self.play(sound, channels=[channel], when=when + i * soa, gain=gain)
+                for i, (sound, channel) in enumerate(zip(sounds, channels))]
+
+    def stop_all(self):
+        for voice in list(self._active) + list(self._incoming) + [voice for _, _, voice in list(self._scheduled)]:
+            voice.stop()
+
+    def render(self, frames):
+        """Renders `frames` frames of a non-realtime "null" or "file" engine and returns them."""
+        if self.realtime:
+            raise RuntimeError("render() is only available for engines created with realtime=False.")
+        return self._stream.render(frames)
+
+    def close(self):
+        self.stop_all()
+        self._stream.stop()
+        self._stream.close()
+        # the callback no longer runs, so release everyone waiting for a voice that never got to finish
+        for voice in self._active + list(self._incoming) + [voice for _, _, voice in self._scheduled]:
+            voice._finished.set()
+        if self.n_late:
+            logging.warning(f"AudioEngine: {self.n_late} sounds started later than requested.")
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status:
+            logging.warning(f"AudioEngine: {status}")
+        outdata.fill(0)
+        buffer_time = time_info.outputBufferDacTime
+        while True:
+            try:
+                voice = self._incoming.popleft()
+            except IndexError:
+                break
+            if voice.start_time is None:
+                self._active.append(voice)
+            else:
+                heapq.heappush(self._scheduled, (voice.start_time, next(self._n_scheduled), voice))
+        # only voices starting in this buffer are mixed, so a long queued timeline costs nothing per callback
+        buffer_end = buffer_time + frames / self.samplerate
+        while self._scheduled and self._scheduled[0][0] < buffer_end:
+            self._active.append(heapq.heappop(self._scheduled)[2])
+        still_active = []
+        for voice in self._active:
+            if voice._stop_requested:
+                voice._finished.set()
+                continue
+            offset = 0
+            if voice.onset_time is None:
+                if voice.start_time is not None:
+                    offset = int(round((voice.start_time - buffer_time) * self.samplerate))
+                    if offset >= frames:  # rounds into the next buffer
+                        still_active.append(voice)
+                        continue
+                    if offset < 0:
+                        self.n_late += 1
+                        offset = 0
+                voice.onset_time = buffer_time + offset / self.samplerate
+            n = min(frames - offset, len(voice.data) - voice.position)
+            chunk = voice.data[voice.position:voice.position + n]
+            outdata[offset:offset + n, voice.channels] += chunk if voice.gain == 1.0 else chunk * np.float32(voice.gain)
+            voice.position += n
+            if voice.position >= len(voice.data):
+                voice._finished.set()
+            else:
+                still_active.append(voice)
+        self._active = still_active
@@ -0,0 +1,363 @@
+"""
+Headless benchmark of the trial sequence and stimulus generation of the experiment packages.
+
+Every package runs in its own process inside a temporary working directory with synthetic digit
+stimuli, so no PsychoPy window, GUI dialog or lab stimuli are needed and peak memory is measured
+per package. Results are written as JSON with a fixed layout, so two commits can be compared:
+
+    python -m utils.benchmark_generation --output before.json
+    python -m utils.benchmark_generation --output after.json
+    python -m utils.benchmark_generation --compare before.json after.json
+
+A quick run with a few trials checks that every package still runs end to end:
+
+    python -m utils.benchmark_generation --smoke --verbose
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import yaml
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGES = ("SPACECUE", "SPACEPRIME", "SPACECUE_implicit")
+# version of the result layout, bump it when metrics change meaning
+SCHEMA_VERSION = 1
+# fitness the GA counts as solved, same as the default of make_pygad_trial_sequence()
+GA_FITNESS_THRESHOLD = 0.9999
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        if hasattr(memory, "peak_wset"):  # Windows
+            return memory.peak_wset / 2 ** 20
+    except ImportError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS, KB on Linux
+
+
+class StageTimer:
+    """Collects the wall time of named stages. Repeated stages add up."""
+
+    def __init__(self):
+        self.stages = dict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def record_ga_runs(runs):
+    """Records generations and best fitness of every pygad.GA run inside the block into `runs`."""
+    import pygad
+    original_ga = pygad.GA
+
+    class RecordingGA(original_ga):
+        def run(self):
+            super().run()
+            fitness = [float(f) for f in self.best_solutions_fitness]
+            runs.append(dict(generations=int(self.generations_completed),
+                             generations_to_threshold=next((i for i, f in enumerate(fitness)
+                                                            if f >= GA_FITNESS_THRESHOLD), None),
+                             best_fitness=max(fitness, default=None)))
+
+    pygad.GA = RecordingGA
+    try:
+        yield runs
+    finally:
+        pygad.GA = original_ga
+
+
+def write_synthetic_stimuli(settings):
+    """
+    Writes one synthetic digit per stimulus folder the generation scripts read (relative to the working directory).
+
+    Digits are pure tones whose frequency encodes the digit, at the experiment's duration and samplerate.
+    """
+    import slab
+    samplerate = settings["session"]["samplerate"]
+    duration = settings["session"]["stimulus_duration"]
+    folders = [f"distractors_{settings['session']['distractor_type']}", "digits_all_250ms"]
+    # the scripts spell these folders with both "Hz" and "hz", which only matters on case-sensitive file systems
+    for pitch in ("low", "high"):
+        folders += [f"targets_{pitch}_30_Hz", f"targets_{pitch}_30_hz"]
+    for folder in folders:
+        os.makedirs(os.path.join("stimuli", folder), exist_ok=True)
+        for digit in range(1, settings["session"]["n_digits"] + 1):
+            sound = slab.Sound.tone(frequency=200 * digit, duration=duration, samplerate=samplerate)
+            sound.ramp(duration=0.01).write(os.path.join("stimuli", folder, f"{digit}.wav"))
+
+
+def prepare_workdir(package, workdir, n_trials=None, n_blocks=None, n_generations=None):
+    """
+    Copies the package's config and conditions into `workdir`, points all outputs there and returns the settings.
+
+    The adjusted settings are also written to `workdir`/config.yaml, for the scripts that read it themselves.
+    """
+    with open(os.path.join(REPO_ROOT, package, "config.yaml")) as file:
+        settings = yaml.safe_load(file)
+    settings["filepaths"]["sequences"] = "sequences"
+    if n_trials:
+        settings["session"]["n_trials"] = n_trials
+    if n_blocks:
+        settings["session"]["n_blocks"] = n_blocks
+    if n_generations:
+        settings["trial_sequence"]["num_generations"] = n_generations
+    conditions = (f"all_combinations_{settings['session']['n_locations']}"
+                  f"_loudspeakers_{settings['session']['n_digits']}_digits.csv")
+    shutil.copy(os.path.join(REPO_ROOT, package, conditions), os.path.join(workdir, conditions))
+    with open(os.path.join(workdir, "config.yaml"), "w") as file:
+        yaml.safe_dump(settings, file)
+    os.makedirs(os.path.join(workdir, "sequences", "logs"), exist_ok=True)
+    return settings
+
+
+def _ga_kwargs(settings):
+    return {key: settings["trial_sequence"][key] for key in
+            ("rule_violation_factor", "num_generations", "num_parents_mating", "sol_per_pop", "keep_parents",
+             "mutation_percent_genes")}
+
+
+def benchmark_spacecue(settings, timer, seed):
+    from SPACECUE.generate_subject_sequence import (precompute_block, load_stimulus_bank, derive_block_seed,
+                                                    insert_pseudo_randomized_cues)
+    from SPACECUE.trial_sequence_pygad import make_pygad_trial_sequence, insert_singleton_present_trials
+    import pandas as pd
+
+    n_trials = settings["session"]["n_trials"]
+    with timer.stage("make_pygad_trial_sequence"):
+        _, sequence_labels, _ = make_pygad_trial_sequence(num_trials=n_trials, **_ga_kwargs(settings),
+                                                          **{key: settings["trial_sequence"][key] for key in
+                                                             ("conditions", "prop_c", "prop_np", "prop_pp")})
+    with timer.stage("insert_singleton_present_trials"):
+        insert_singleton_present_trials(
+            sequence_labels, prop_distractor_present_trials=settings["session"]["prop_distractor_present_trials"])
+    with timer.stage("load_stimulus_bank"):
+        stimulus_bank = load_stimulus_bank(settings)
+    n_blocks = settings["session"]["n_blocks"]
+    for block in range(n_blocks):
+        with timer.stage("precompute_block"):
+            # no block container: it only repacks the written files
+            precompute_block(subject_id=99, current_block_num=block, settings=settings,
+                             seed=derive_block_seed(seed, 99, block), stimulus_bank=stimulus_bank)
+    trial_sequence = pd.read_csv("sequences/sce-99_block_0.csv").drop(columns="CueInstruction")
+    with timer.stage("insert_pseudo_randomized_cues"):
+        insert_pseudo_randomized_cues(trial_sequence, block_num=0,
+                                      prop_informative=settings["session"]["cue_prop_informative"],
+                                      max_consecutive_block_cues=settings["session"]["max_consecutive_informative"])
+    return n_trials * n_blocks
+
+
+def benchmark_spaceprime(settings, timer, seed):
+    sys.path.insert(0, os.path.join(REPO_ROOT, "SPACEPRIME"))  # the package imports its modules without prefix
+    from generate_subject_sequence import precompute_sequence
+    from trial_sequence_pygad import make_pygad_trial_sequence, insert_singleton_present_trials
+
+    n_trials = settings["session"]["n_trials"]
+    with timer.stage("make_pygad_trial_sequence"):
+        _, sequence_labels, _ = make_pygad_trial_sequence(num_trials=n_trials, **_ga_kwargs(settings),
+                                                          **{key: settings["trial_sequence"][key] for key in
+                                                             ("conditions", "prop_c", "prop_np", "prop_pp")})
+    with timer.stage("insert_singleton_present_trials"):
+        insert_singleton_present_trials(sequence_labels)
+    with timer.stage("precompute_sequence"):
+        precompute_sequence(subject_id=99, block=0, settings=settings)
+    return n_trials * settings["session"]["n_blocks"]
+
+
+def benchmark_spacecue_implicit(settings, timer, seed):
+    sys.path.insert(0, os.path.join(REPO_ROOT, "SPACECUE_implicit"))
+    from generate_subject_sequence import precompute_sequence
+    from trial_sequence_pygad import make_pygad_trial_sequence
+
+    n_trials = settings["session"]["n_trials"]
+    with timer.stage("make_pygad_trial_sequence"):
+        make_pygad_trial_sequence(num_trials=n_trials, prop_sp=settings["trial_sequence"]["prop_sp"],
+                                  **_ga_kwargs(settings))
+    with timer.stage("precompute_sequence"):
+        precompute_sequence(subject_id=99, block=0, settings=settings)
+    return n_trials * settings["session"]["n_blocks"]
+
+
+BENCHMARKS = {
+    "SPACECUE": benchmark_spacecue,
+    "SPACEPRIME": benchmark_spaceprime,
+    "SPACECUE_implicit": benchmark_spacecue_implicit
+}
+# stage whose time the trials/second refer to
+GENERATION_STAGES = {
+    "SPACECUE": "precompute_block",
+    "SPACEPRIME": "precompute_sequence",
+    "SPACECUE_implicit": "precompute_sequence"
+}
+# a few trials and generations per package, enough to check that every package runs end to end. SPACEPRIME needs
+# enough singleton present trials for three different distances between them (insert_singleton_present_trials), and
+# enough generations to never put a NP trial right after a PP trial, for which precompute_sequence finds no sample
+SMOKE_PARAMS = {
+    "SPACECUE": dict(n_trials=6, n_blocks=1, n_generations=2),
+    "SPACEPRIME": dict(n_trials=36, n_blocks=1, n_generations=20),
+    "SPACECUE_implicit": dict(n_trials=6, n_blocks=1, n_generations=2)
+}
+
+
+def run_package(package, seed=1, n_trials=None, n_blocks=None, n_generations=None):
+    """
+    Benchmarks one package in this process. Changes the working directory to a temporary one for the run.
+
+    Returns:
+        dict: per-stage wall time, trials/second of the sound generation, peak RSS and GA statistics.
+    """
+    import matplotlib
+    matplotlib.use("Agg")  # the generation scripts save plots, never show them
+    sys.path.insert(0, REPO_ROOT)
+    random.seed(seed)
+    np.random.seed(seed)
+    timer = StageTimer()
+    ga_runs = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"benchmark_{package}_") as workdir:
+        os.chdir(workdir)
+        try:
+            settings = prepare_workdir(package, workdir, n_trials=n_trials, n_blocks=n_blocks,
+                                       n_generations=n_generations)
+            with timer.stage("synthetic_stimuli"):
+                write_synthetic_stimuli(settings)
+            with record_ga_runs(ga_runs):
+                n_trials_generated = BENCHMARKS[package](settings, timer, seed)
+        finally:
+            logging.shutdown()
+            os.chdir(cwd)
+    generation_time = timer.stages[GENERATION_STAGES[package]]
+    return dict(stages={name: round(seconds, 4) for name, seconds in timer.stages.items()},
+                trials=n_trials_generated,
+                trials_per_second=round(n_trials_generated / generation_time, 3),
+                peak_rss_mb=round(peak_rss_mb(), 1),
+                ga=ga_runs[0] if ga_runs else None)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(packages=PACKAGES, seed=1, n_trials=None, n_blocks=1, n_generations=None, smoke=False,
+                   verbose=False):
+    """
+    Runs every package in a fresh process and collects the results in the comparable JSON layout.
+
+    With `smoke`, every package runs with its SMOKE_PARAMS instead of `n_trials`, `n_blocks` and `n_generations`.
+    """
+    params = dict(seed=seed, n_trials=n_trials, n_blocks=n_blocks, n_generations=n_generations)
+    if smoke:
+        params = dict(seed=seed, smoke=True)
+    results = dict(schema=SCHEMA_VERSION, commit=_git_commit(), python=platform.python_version(),
+                   platform=platform.platform(), params=params, packages=dict())
+    for package in packages:
+        print(f"Benchmarking {package} ...")
+        if smoke:
+            n_trials, n_blocks, n_generations = (SMOKE_PARAMS[package][key] for key in
+                                                 ("n_trials", "n_blocks", "n_generations"))
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as file:
+            result_file = file.name
+        command = [sys.executable, "-m", "utils.benchmark_generation", "--worker", package,
+                   "--result-file", result_file, "--seed", str(seed)]
+        for flag, value in (("--trials", n_trials), ("--blocks", n_blocks), ("--generations", n_generations)):
+            if value:
+                command += [flag, str(value)]
+        try:
+            subprocess.run(command, cwd=REPO_ROOT, check=True,
+                           stdout=None if verbose else subprocess.DEVNULL)
+            with open(result_file) as file:
+                results["packages"][package] = json.load(file)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Benchmark of {package} failed: {e}")
+            results["packages"][package] = dict(error=str(e))
+        finally:
+            os.remove(result_file)
+    return results
+
+
+def _flatten(result, prefix=""):
+    flat = dict()
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix=f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(before, after):
+    """Prints every metric of two benchmark results side by side with its relative change."""
+    if before.get("params") != after.get("params"):
+        print(f"WARNING: the runs used different parameters ({before.get('params')} vs {after.get('params')}).")
+    print(f"{'metric':<60}{'before':>12}{'after':>12}{'change':>10}")
+    old, new = _flatten(before["packages"]), _flatten(after["packages"])
+    for metric in sorted(set(old) | set(new)):
+        a, b = old.get(metric), new.get(metric)
+        change = f"{(b - a) / a:+.1%}" if a and b is not None else ""
+        print(f"{metric:<60}{a if a is not None else '-':>12}{b if b is not None else '-':>12}{change:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the stimulus and trial sequence generation.")
+    parser.add_argument("--packages", nargs="+", default=list(PACKAGES), choices=PACKAGES)
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: print them)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trials", type=int, default=None, help="Trials per block (default: config.yaml)")
+    parser.add_argument("--blocks", type=int, default=1, help="Blocks to generate (default: 1)")
+    parser.add_argument("--generations", type=int, default=None,
+                        help="Maximum GA generations (default: config.yaml)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the generation scripts")
+    parser.add_argument("--smoke", action="store_true",
+                        help="Only check that every package runs, with a few trials and generations each "
+                             "(overrides the sizes)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    parser.add_argument("--worker", choices=PACKAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before_file, open(args.compare[1]) as after_file:
+            compare(json.load(before_file), json.load(after_file))
+    elif args.worker:
+        result = run_package(args.worker, seed=args.seed, n_trials=args.trials, n_blocks=args.blocks,
+                             n_generations=args.generations)
+        with open(args.result_file, "w") as file:
+            json.dump(result, file)
+    else:
+        results = run_benchmarks(packages=args.packages, seed=args.seed, n_trials=args.trials,
+                                 n_blocks=args.blocks, n_generations=args.generations, smoke=args.smoke,
+                                 verbose=args.verbose)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            print(f"Saved benchmark results to {args.output}")
+        else:
+            print(json.dumps(results, indent=2, sort_keys=True))
+        failed = [package for package, result in results["packages"].items() if "error" in result]
+        if failed:
+            sys.exit(f"Benchmark failed for {', '.join(failed)}.")
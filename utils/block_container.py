@@ -0,0 +1,80 @@
+import json
+import os
+import numpy as np
+import soundfile
+
+
+# all trial sounds of a block, concatenated into one float32 array of shape (n_samples_total, n_channels)
+BLOCK_AUDIO_FILE = "block_audio.npy"
+# samplerate and the (offset, length) of every trial inside BLOCK_AUDIO_FILE
+BLOCK_AUDIO_INDEX_FILE = "block_audio_index.json"
+
+
+def write_block_container(blockdir, sound_files):
+    """
+    Packs the trial sounds of a block into a single float32 container.
+
+    The sounds are read as float32 exactly like SoundDeviceSound reads them, so playing a trial from the
+    container is identical to playing its WAV file. The per-trial WAV files are left untouched.
+
+    Args:
+        blockdir (str): block directory the container is written to.
+        sound_files (list): paths of the trial sounds, ordered by trial number.
+    """
+    infos = [soundfile.info(f) for f in sound_files]
+    samplerates = set(info.samplerate for info in infos)
+    channels = set(info.channels for info in infos)
+    if len(samplerates) != 1 or len(channels) != 1:
+        raise ValueError(f"Trial sounds in {blockdir} differ in samplerate or channel count, cannot pack them.")
+    samplerate, n_channels = samplerates.pop(), channels.pop()
+    lengths = [info.frames for info in infos]
+    offsets = [int(x) for x in np.concatenate(([0], np.cumsum(lengths)[:-1]))]
+
+    container = np.lib.format.open_memmap(os.path.join(blockdir, BLOCK_AUDIO_FILE), mode="w+", dtype=np.float32,
+                                          shape=(sum(lengths), n_channels))
+    for sound_file, offset, length in zip(sound_files, offsets, lengths):
+        container[offset:offset + length] = soundfile.read(sound_file, dtype="float32", always_2d=True)[0]
+    container.flush()
+    del container  # close the memory map before the index marks the container as complete
+
+    with open(os.path.join(blockdir, BLOCK_AUDIO_INDEX_FILE), "w") as file:
+        json.dump(dict(samplerate=samplerate, offsets=offsets, lengths=lengths), file)
+
+
+def remove_block_container(blockdir):
+    """Deletes the block container of `blockdir`, if there is one, so the block is read from its WAV files again."""
+    # the index first: without it, a container left half-deleted no longer counts as complete
+    for name in (BLOCK_AUDIO_INDEX_FILE, BLOCK_AUDIO_FILE):
+        path = os.path.join(blockdir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def has_block_container(blockdir):
+    """True if `blockdir` holds a complete block container."""
+    return os.path.exists(os.path.join(blockdir, BLOCK_AUDIO_FILE)) and \
+        os.path.exists(os.path.join(blockdir, BLOCK_AUDIO_INDEX_FILE))
+
+
+class BlockContainer:
+    """
+    Memory-mapped trial sounds of one block, see write_block_container().
+
+    Opening a block costs one file open plus one mmap. Trial sounds are read-only views into the map.
+    """
+
+    def __init__(self, blockdir):
+        with open(os.path.join(blockdir, BLOCK_AUDIO_INDEX_FILE)) as file:
+            index = json.load(file)
+        self.samplerate = index["samplerate"]
+        self.offsets = index["offsets"]
+        self.lengths = index["lengths"]
+        self.data = np.load(os.path.join(blockdir, BLOCK_AUDIO_FILE), mmap_mode="r")
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, trial_nr):
+        """Zero-copy view of one trial sound with shape (n_samples, n_channels)."""
+        offset = self.offsets[trial_nr]
+        return self.data[offset:offset + self.lengths[trial_nr]]
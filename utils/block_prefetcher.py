@@ -0,0 +1,89 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile
+from utils.block_container import BlockContainer, has_block_container
+
+
+def load_block_audio(blockdir, n_trials, mul=0):
+    """
+    Reads the trial sounds s_0.wav ... of a block (or its block container) and applies the playback gain.
+
+    Args:
+        blockdir (str): the block's sound directory.
+        n_trials (int): number of trial sounds to load.
+        mul (float): gain in dB, applied exactly like SoundDeviceSound(mul=...) does. With 0, block
+            container sounds stay zero-copy views into the memory map.
+
+    Returns:
+        list: (data, samplerate) per trial. `data` is float32 and already gained, so it must be
+            played with mul=0.
+    """
+    gain = np.float32(10 ** (mul / 20))
+    if has_block_container(blockdir):
+        container = BlockContainer(blockdir)
+        return [(container[trial_nr] * gain if mul else container[trial_nr], container.samplerate)
+                for trial_nr in range(n_trials)]
+    block_audio = []
+    for trial_nr in range(n_trials):
+        data, samplerate = soundfile.read(os.path.join(blockdir, f"s_{trial_nr}.wav"), dtype="float32")
+        if mul:
+            data *= gain  # in place, the file's buffer is ours
+        block_audio.append((data, samplerate))
+    return block_audio
+
+
+class BlockPrefetcher:
+    """
+    Loads and pre-gains the trial sounds of upcoming blocks in a background thread.
+
+    Sessions load the next block while the current block or the pause screen runs, so create_trials does not
+    read a whole block from disk between two blocks. With an AudioEngine, use mul=0 and let the engine apply
+    the gain while mixing: block container sounds then stay zero-copy views into the memory map.
+
+    Call prefetch() for block N+1 while block N runs (or while the pause screen is shown), and get()
+    in create_trials. get() returns at once if the block is ready, waits if it is still loading and
+    loads it right away if it was never prefetched.
+
+    Example::
+
+        prefetcher = BlockPrefetcher(mul=settings["soundconfig"]["mul"])
+        prefetcher.prefetch("sequences/sce-01_block_1", n_trials=120)
+        ...
+        for trial, (data, sr) in zip(trials, prefetcher.get("sequences/sce-01_block_1", n_trials=120)):
+            trial.stim = Sound(data=data, sr=sr, mul=0)
+    """
+
+    def __init__(self, mul=0):
+        self.mul = mul
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BlockPrefetcher")
+        self._pending = dict()  # blockdir -> (n_trials, future)
+
+    def prefetch(self, blockdir, n_trials):
+        """Starts loading a block in the background. Does nothing if it is already loading or loaded."""
+        if blockdir in self._pending and self._pending[blockdir][0] >= n_trials:
+            return
+        if not os.path.isdir(blockdir):
+            logging.warning(f"BlockPrefetcher: {blockdir} does not exist, nothing to prefetch.")
+            return
+        self._pending[blockdir] = (n_trials, self._executor.submit(load_block_audio, blockdir, n_trials, self.mul))
+
+    def get(self, blockdir, n_trials):
+        """
+        Returns the first `n_trials` trial sounds of a block and forgets the block.
+
+        Returns:
+            list: (data, samplerate) per trial, see load_block_audio().
+        """
+        prefetched_trials, future = self._pending.pop(blockdir, (0, None))
+        if future is not None and prefetched_trials >= n_trials:
+            try:
+                return future.result()[:n_trials]
+            except Exception as e:  # the block is loaded again below, which raises the error in this thread
+                logging.error(f"BlockPrefetcher: loading {blockdir} in the background failed: {e}")
+        return load_block_audio(blockdir, n_trials, self.mul)
+
+    def close(self):
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
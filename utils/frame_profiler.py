@@ -0,0 +1,144 @@
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+
+
+class FrameProfiler:
+    """
+    Opt-in frame timing of Trial.draw, kept in a preallocated ring buffer.
+
+    exptools2 calls draw() once per frame right after the window flip, so the time between two
+    begin_frame() calls is the flip-to-flip interval. Within a frame, mark() attributes the time since
+    the previous mark to a named sub-step (e.g. mouse polling, hit tests, starting the sound). A frame
+    whose interval exceeds 1.5 frame durations counts as dropped. Recording a frame only writes a few
+    numbers into numpy arrays; intervals, drops and summaries are computed in flush(). Sessions enable it
+    with mode.profile_frames, flush it into one file per block and summarize all blocks in close().
+
+    Example::
+
+        profiler = FrameProfiler(steps=("visuals", "mouse"), frame_duration=win.monitorFramePeriod)
+        # in Trial.draw()
+        profiler.begin_frame(block, trial_nr, phase)
+        ...
+        profiler.mark("mouse")
+        profiler.end_frame()
+        # after every block and at the end of the session
+        profiler.flush("sub-01_block_0_frames.npz")
+        profiler.write_summary("sub-01_frame_summary.csv")
+
+    Args:
+        steps (tuple): names of the sub-steps passed to mark().
+        frame_duration (float): nominal duration of one frame in seconds.
+        capacity (int): frames kept between two flushes, older frames are overwritten.
+        enabled (bool): with False, every method returns at once and nothing is written.
+        clock (callable): time in seconds.
+    """
+
+    def __init__(self, steps, frame_duration=1 / 60, capacity=2 ** 18, enabled=True, clock=time.perf_counter):
+        self.steps = tuple(steps)
+        self.frame_duration = frame_duration
+        self.capacity = capacity
+        self.enabled = enabled
+        self.clock = clock
+        self._step_index = {step: i for i, step in enumerate(self.steps)}
+        self._summaries = []
+        self._n_frames = 0  # frames recorded since the profiler was created
+        self._n_flushed = 0
+        if not enabled:
+            return
+        self._block = np.zeros(capacity, dtype=np.int32)
+        self._trial = np.zeros(capacity, dtype=np.int32)
+        self._phase = np.zeros(capacity, dtype=np.int16)
+        self._start = np.zeros(capacity, dtype=np.float64)
+        self._draw = np.zeros(capacity, dtype=np.float32)
+        self._step_times = np.zeros((capacity, len(self.steps)), dtype=np.float32)
+        self._current = [0.0] * len(self.steps)
+        self._last_mark = 0.0
+
+    def begin_frame(self, block, trial_nr, phase):
+        if not self.enabled:
+            return
+        now = self.clock()
+        i = self._n_frames % self.capacity
+        self._block[i] = -1 if block is None else block
+        self._trial[i] = trial_nr
+        self._phase[i] = phase
+        self._start[i] = now
+        self._current = [0.0] * len(self.steps)
+        self._last_mark = now
+
+    def mark(self, step):
+        """Adds the time since the previous mark (or begin_frame) to `step`."""
+        if not self.enabled:
+            return
+        now = self.clock()
+        self._current[self._step_index[step]] += now - self._last_mark
+        self._last_mark = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        i = self._n_frames % self.capacity
+        self._draw[i] = self.clock() - self._start[i]
+        self._step_times[i] = self._current
+        self._n_frames += 1
+
+    def flush(self, filename):
+        """
+        Writes the frames recorded since the last flush to a compressed .npz file and adds them to the summary.
+        Does nothing if no frame was recorded.
+        """
+        if not self.enabled or self._n_frames == self._n_flushed:
+            return
+        n_new = self._n_frames - self._n_flushed
+        if n_new > self.capacity:
+            logging.warning(f"FrameProfiler: {n_new - self.capacity} frames were overwritten before the flush, "
+                            f"increase the capacity.")
+            n_new = self.capacity
+        order = np.arange(self._n_frames - n_new, self._n_frames) % self.capacity
+        frames = dict(block=self._block[order], trial=self._trial[order], phase=self._phase[order],
+                      start=self._start[order], draw=self._draw[order], steps=self._step_times[order])
+        # the first frame of a trial follows whatever ran between the trials, it has no interval
+        same_trial = (np.diff(frames["trial"]) == 0) & (np.diff(frames["block"]) == 0)
+        frames["interval"] = np.concatenate(([np.nan], np.where(same_trial, np.diff(frames["start"]), np.nan)))
+        frames["dropped"] = frames["interval"] > 1.5 * self.frame_duration
+        self._n_flushed = self._n_frames
+        np.savez_compressed(filename, step_names=np.array(self.steps), frame_duration=self.frame_duration, **frames)
+        self._summaries.append(self._summarize(frames))
+
+    def _summarize(self, frames):
+        df = pd.DataFrame({"block": frames["block"], "trial": frames["trial"], "phase": frames["phase"],
+                           "interval_ms": frames["interval"] * 1000, "dropped": frames["dropped"],
+                           "draw_ms": frames["draw"] * 1000.0})
+        for i, step in enumerate(self.steps):
+            df[f"{step}_ms"] = frames["steps"][:, i] * 1000.0
+        step_columns = [f"{step}_ms" for step in self.steps]
+        grouped = df.groupby(["block", "trial", "phase"])
+        summary = grouped[["draw_ms"] + step_columns].mean()
+        summary.insert(0, "n_frames", grouped.size())
+        summary.insert(1, "dropped", grouped["dropped"].sum())
+        summary.insert(2, "interval_mean_ms", grouped["interval_ms"].mean())
+        summary.insert(3, "interval_max_ms", grouped["interval_ms"].max())
+        summary.insert(5, "draw_max_ms", grouped["draw_ms"].max())
+        return summary.reset_index()
+
+    def summary(self):
+        """Table of frame count, dropped frames, intervals and mean draw time per step, per block, trial and phase."""
+        if not self._summaries:
+            return pd.DataFrame()
+        return pd.concat(self._summaries, ignore_index=True)
+
+    def write_summary(self, filename):
+        """Writes summary() as CSV and logs dropped frames and draw cost per phase."""
+        if not self.enabled:
+            return
+        summary = self.summary()
+        if summary.empty:
+            return
+        summary.to_csv(filename, index=False)
+        per_phase = summary.groupby("phase").agg(n_frames=("n_frames", "sum"), dropped=("dropped", "sum"),
+                                                 draw_max_ms=("draw_max_ms", "max"))
+        logging.info(f"FrameProfiler: frames per phase, summary written to {os.path.basename(filename)}\n"
+                     f"{per_phase.to_string()}")
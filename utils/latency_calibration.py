@@ -0,0 +1,230 @@
+"""
+Measures the delay between SoundDeviceSound.play() and the sound onset with a loopback cable.
+
+Click trains are played on the output, recorded on an input and located by cross-correlation. The mean
+latency is stored per device and becomes SoundDeviceSound.latency, which the trials wait before sending
+the EEG trigger. The estimator can be tried without a sound card on a simulated loopback:
+
+    python -m utils.latency_calibration --device 3 --input-device 3 --input-channel 1
+    python -m utils.latency_calibration --simulate 0.08 --jitter 0.002
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+import numpy as np
+from scipy.signal import correlate
+
+# per-device latency profiles written by calibrate_latency(), shared by all experiments on this machine. They
+# describe the machine, not the code, so they live in the user's config directory instead of the repository
+PROFILE_FILE = os.path.join(os.environ.get("APPDATA") or os.environ.get("XDG_CONFIG_HOME") or
+                            os.path.join(os.path.expanduser("~"), ".config"),
+                            "psychopy-experiments", "latency_profiles.json")
+# hand-measured delay between sounddevice.play() and the sound onset, used for devices without a profile
+DEFAULT_LATENCY = 0.08
+
+
+def click_train(samplerate, n_clicks=5, interval=0.1, click_duration=0.001, seed=0):
+    """
+    Rectangular clicks at slightly irregular intervals, so the cross-correlation has a single peak.
+
+    Returns:
+        numpy.ndarray: float32 mono signal, followed by `interval` seconds of silence.
+    """
+    rng = np.random.default_rng(seed)
+    onsets = np.concatenate(([0.0], np.cumsum(interval * rng.uniform(0.7, 1.3, size=n_clicks - 1))))
+    onsets = (onsets * samplerate).astype(int)
+    click_samples = max(1, int(click_duration * samplerate))
+    clicks = np.zeros(onsets[-1] + click_samples + int(interval * samplerate), dtype=np.float32)
+    for onset in onsets:
+        clicks[onset:onset + click_samples] = 0.9
+    return clicks
+
+
+def estimate_lag(reference, recording, samplerate):
+    """
+    Delay of `reference` within `recording` in seconds, from the peak of their cross-correlation.
+    Both must start at the same moment, the moment play() was called.
+    """
+    xcorr = correlate(recording, reference, mode="full", method="fft")
+    lags = np.arange(-len(reference) + 1, len(recording))
+    valid = lags >= 0  # the sound cannot arrive before it was played
+    return lags[valid][np.argmax(xcorr[valid])] / samplerate
+
+
+class SimulatedLoopback:
+    """
+    Loopback without audio hardware: returns the played signal delayed by `latency` plus normally
+    distributed jitter, with a little noise, to test the estimator offline.
+
+    Args:
+        latency (float): mean onset latency in seconds.
+        jitter (float): standard deviation of the latency between calls, in seconds.
+        noise (float): standard deviation of the recording noise.
+        seed (int): seed of the random generator.
+    """
+
+    def __init__(self, latency=DEFAULT_LATENCY, jitter=0.001, noise=0.01, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.device = "simulated loopback"
+
+    def record(self, data, samplerate, duration):
+        """Plays `data` and returns `duration` seconds of recording, starting at the moment of the play call."""
+        delay = int(round(max(0.0, self.rng.normal(self.latency, self.jitter)) * samplerate))
+        recording = self.rng.normal(0, self.noise, size=int(duration * samplerate)).astype(np.float32)
+        n = max(0, min(len(data), len(recording) - delay))
+        recording[delay:delay + n] += data[:n]
+        return recording
+
+
+class SoundDeviceLoopback:
+    """
+    Loopback through the sound card: the output channel is cabled to an input of `input_device`.
+
+    The sound is played exactly like in the trials, with SoundDeviceSound.play(), while an input stream
+    records. Samples are placed on the stream clock by their ADC time, so the recording can be cut to
+    start at the moment play() was called and the measured lag is the onset latency the trials see.
+
+    Args:
+        device: output device of the experiment, as in soundconfig.device.
+        input_device: device that records the loopback.
+        input_channel (int): 1-based input channel of the loopback cable.
+        mapping (int): 1-based output channel the clicks are played on.
+    """
+
+    def __init__(self, device, input_device=None, input_channel=1, mapping=1):
+        import sounddevice
+        self.sd = sounddevice
+        self.device = device
+        self.input_device = device if input_device is None else input_device
+        self.input_channel = input_channel
+        self.mapping = mapping
+
+    def record(self, data, samplerate, duration):
+        """Plays `data` and returns `duration` seconds of recording, starting at the moment of the play call."""
+        from utils.sound import SoundDeviceSound
+        sound = SoundDeviceSound(data=data, sr=samplerate, device=self.device, mul=0)
+        buffers = []  # (adc time of the first sample, samples)
+        lock = threading.Lock()
+
+        def callback(indata, frames, time_info, status):
+            with lock:
+                buffers.append((time_info.inputBufferAdcTime, indata[:, self.input_channel - 1].copy()))
+
+        with self.sd.InputStream(samplerate=samplerate, device=self.input_device, channels=self.input_channel,
+                                 dtype="float32", latency="low", callback=callback) as stream:
+            time.sleep(0.2)  # let the input stream settle
+            play_time = stream.time
+            sound.play(latency="low", blocksize=0, mapping=self.mapping)
+            time.sleep(duration + 0.2)
+        sound.stop()
+        with lock:
+            first_adc_time = buffers[0][0]
+            samples = np.concatenate([buffer for _, buffer in buffers])
+        start = int(round((play_time - first_adc_time) * samplerate))
+        return samples[start:start + int(duration * samplerate)]
+
+
+def calibrate_latency(loopback, samplerate=44100, n_repetitions=20, n_clicks=5, interval=0.1, max_latency=0.5):
+    """
+    Plays click trains through `loopback` and estimates the onset latency by cross-correlation.
+
+    Args:
+        loopback: SoundDeviceLoopback or SimulatedLoopback.
+        samplerate (int): samplerate of the clicks.
+        n_repetitions (int): number of click trains, each started with its own play() call.
+        n_clicks (int): clicks per train.
+        interval (float): mean seconds between clicks.
+        max_latency (float): longest latency that can be measured.
+
+    Returns:
+        dict: mean latency, jitter (standard deviation), min and max in seconds, and the single estimates.
+    """
+    clicks = click_train(samplerate, n_clicks=n_clicks, interval=interval)
+    duration = len(clicks) / samplerate + max_latency
+    lags = np.array([estimate_lag(clicks, loopback.record(clicks, samplerate, duration), samplerate)
+                     for _ in range(n_repetitions)])
+    return dict(latency=float(lags.mean()), jitter=float(lags.std()), min=float(lags.min()), max=float(lags.max()),
+                n_repetitions=n_repetitions, samplerate=samplerate, lags=lags.tolist())
+
+
+def device_key(device, sd=None):
+    """Name and host API of a sounddevice device, which survive re-plugging better than its index."""
+    try:
+        if sd is None:
+            import sounddevice as sd
+        info = sd.query_devices(device, "output")
+        return f"{info['name']} ({sd.query_hostapis(info['hostapi'])['name']})"
+    except Exception:
+        return str(device)
+
+
+def save_latency_profile(key, result, filename=PROFILE_FILE):
+    profiles = dict()
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            profiles = json.load(f)
+    profiles[key] = dict(result, calibrated=datetime.datetime.now().isoformat(timespec="seconds"))
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(profiles, f, indent=2)
+    _profile_cache.clear()
+    _device_latencies.clear()
+
+
+_profile_cache = dict()
+
+
+def load_latency(key, default=DEFAULT_LATENCY, filename=PROFILE_FILE):
+    """Calibrated onset latency of the device `key` in seconds, or `default` if it was never calibrated."""
+    if filename not in _profile_cache:
+        profiles = dict()
+        if os.path.isfile(filename):
+            with open(filename) as f:
+                profiles = json.load(f)
+        _profile_cache[filename] = profiles
+    profile = _profile_cache[filename].get(key)
+    return default if profile is None else profile["latency"]
+
+
+_device_latencies = dict()
+
+
+def device_latency(device, sd=None):
+    """load_latency() of an output device, looked up once per device and process."""
+    if device not in _device_latencies:
+        _device_latencies[device] = load_latency(device_key(device, sd))
+    return _device_latencies[device]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the onset latency of an output device with a loopback "
+                                                 "cable and store it for SoundDeviceSound.latency.")
+    parser.add_argument("--device", type=int, help="output device, as in soundconfig.device")
+    parser.add_argument("--input-device", type=int, help="input device of the loopback (default: --device)")
+    parser.add_argument("--input-channel", type=int, default=1, help="1-based input channel of the loopback")
+    parser.add_argument("--mapping", type=int, default=1, help="1-based output channel of the loopback")
+    parser.add_argument("--samplerate", type=int, default=44100)
+    parser.add_argument("--repetitions", type=int, default=20)
+    parser.add_argument("--simulate", type=float, metavar="LATENCY",
+                        help="use a simulated loopback with this latency in seconds instead of a sound card")
+    parser.add_argument("--jitter", type=float, default=0.001, help="jitter of the simulated loopback in seconds")
+    args = parser.parse_args()
+
+    if args.simulate is not None:
+        loopback = SimulatedLoopback(latency=args.simulate, jitter=args.jitter)
+    else:
+        loopback = SoundDeviceLoopback(args.device, input_device=args.input_device,
+                                       input_channel=args.input_channel, mapping=args.mapping)
+    result = calibrate_latency(loopback, samplerate=args.samplerate, n_repetitions=args.repetitions)
+    print(f"Latency: {result['latency'] * 1000:.2f} ms, jitter: {result['jitter'] * 1000:.2f} ms "
+          f"(min {result['min'] * 1000:.2f} ms, max {result['max'] * 1000:.2f} ms)")
+    if args.simulate is None:
+        key = device_key(args.device, loopback.sd)
+        save_latency_profile(key, result)
+        print(f"Saved latency profile of {key} to {PROFILE_FILE}.")
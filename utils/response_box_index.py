@@ -0,0 +1,60 @@
+import math
+
+
+class ResponseBoxIndex:
+    """
+    Grid lookup from a mouse position to the digit of the virtual response box under it.
+
+    The plane is cut into square cells of twice the search radius, and every digit is registered in the
+    (at most four) cells within that radius of its position, so a lookup only tests the few digits of one
+    cell, however many digits the box has. Build a new index whenever the digits move, e.g. in
+    configure_response_box().
+
+    By default, a digit is hit where its own contains() says so, i.e. inside the text box of the TextStim,
+    so clicks are scored exactly as when every digit was tested in turn. The search radius is then the
+    text height, which covers the text box of a single digit. With `hit_radius`, every digit instead gets
+    a circular hit area of that radius around its position.
+
+    Args:
+        stimuli (list): the digit stimuli (with .text, .pos and .contains()) that can be clicked.
+        hit_radius (float): radius of circular hit areas in the window's units. Default: None, the text boxes.
+    """
+
+    def __init__(self, stimuli, hit_radius=None):
+        self.hit_radius = hit_radius
+        self.stimuli = list(stimuli)
+        if hit_radius is None:
+            search_radius = max((getattr(stim, "height", None) or 1.0 for stim in self.stimuli), default=1.0)
+        else:
+            search_radius = hit_radius
+        self._cell_size = 2 * search_radius
+        self.items = [(stim.text, float(stim.pos[0]), float(stim.pos[1])) for stim in self.stimuli]
+        self._grid = dict()
+        for i, (_, x, y) in enumerate(self.items):
+            for cell_x in range(self._cell(x - search_radius), self._cell(x + search_radius) + 1):
+                for cell_y in range(self._cell(y - search_radius), self._cell(y + search_radius) + 1):
+                    self._grid.setdefault((cell_x, cell_y), []).append(i)
+
+    def _cell(self, coordinate):
+        return math.floor(coordinate / self._cell_size)
+
+    def lookup(self, pos):
+        """
+        Returns:
+            tuple: (digit text, x, y) of the digit whose hit area contains `pos`, the nearest one if hit
+                areas overlap, or None.
+        """
+        x, y = pos
+        hit, hit_distance = None, math.inf
+        for i in self._grid.get((self._cell(x), self._cell(y)), ()):
+            _, item_x, item_y = self.items[i]
+            distance = (x - item_x) ** 2 + (y - item_y) ** 2
+            if distance >= hit_distance:
+                continue
+            if self.hit_radius is None:
+                inside = self.stimuli[i].contains(pos)
+            else:
+                inside = distance <= self.hit_radius ** 2
+            if inside:
+                hit, hit_distance = self.items[i], distance
+        return hit
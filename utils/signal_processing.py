@@ -130,6 +130,76 @@ def modulate_amplitude(sound, modulation_freq):
     return slab.Sound(data=y_modulated, samplerate=sr)
 
 
+# KEMAR HRTF, loaded on first use and shared by every experiment package in this process
+_hrtf = None
+_hrtf_source_index = dict()  # (azimuth, elevation) -> source index in _hrtf
+_hrtf_filter_cache = dict()  # (source index, samplerate, n_samples) -> (n_fft, rfft of the binaural filter)
+
+
+def get_hrtf():
+    """
+    Returns the KEMAR HRTF, loading it and indexing its sources on the first call.
+
+    Returns:
+        slab.HRTF: the cached KEMAR HRTF.
+    """
+    global _hrtf
+    if _hrtf is None:
+        _hrtf = slab.HRTF.kemar()
+        for idx, (azi, ele) in enumerate(_hrtf.sources.vertical_polar[:, :2]):
+            _hrtf_source_index.setdefault((float(azi), float(ele)), idx)
+    return _hrtf
+
+
+def get_hrtf_source_index(azi, ele):
+    """
+    Looks up the KEMAR filter index of a source location.
+
+    Args:
+        azi (int): The azimuth angle in degrees, in the (-180, 180] convention used by SPACE_ENCODER.
+        ele (int): The elevation angle in degrees.
+
+    Returns:
+        int: index of the binaural filter in the KEMAR HRTF.
+
+    Raises:
+        ValueError: If the specified azimuth and elevation combination is not
+            found in the KEMAR HRTF.
+    """
+    if azi > 0:
+        azi = azi + 180
+    if azi < 0:
+        azi = abs(azi)
+    get_hrtf()
+    idx = _hrtf_source_index.get((float(azi), float(ele)))
+    if idx is None:
+        raise ValueError(f'No azimuth {azi}°, elevation {ele}° found in HRTF.')
+    return idx
+
+
+def get_hrtf_filter(idx, samplerate, n_samples):
+    """
+    Returns the frequency-domain binaural filter for convolving `n_samples` long sounds.
+
+    The FFT of the filter is computed once per (idx, samplerate, n_samples) and reused afterwards.
+
+    Args:
+        idx (int): index of the binaural filter in the KEMAR HRTF.
+        samplerate (int): samplerate of the sounds to be filtered. Must equal the HRTF samplerate.
+        n_samples (int): length of the sounds to be filtered.
+
+    Returns:
+        tuple: (n_fft, numpy.ndarray of shape (n_fft // 2 + 1, 2)).
+    """
+    key = (idx, samplerate, n_samples)
+    if key not in _hrtf_filter_cache:
+        filt = get_hrtf()[idx]
+        n_taps = filt.data.shape[0]
+        n_fft = 1 << int(np.ceil(np.log2(n_samples + n_taps - 1)))  # next power of two for the full convolution
+        _hrtf_filter_cache[key] = (n_fft, np.fft.rfft(filt.data, n=n_fft, axis=0))
+    return _hrtf_filter_cache[key]
+
+
 def spatialize(sound, azi, ele):
     """
     Convolves a sound with a head-related transfer function (HRTF) to create
@@ -137,7 +207,9 @@ def spatialize(sound, azi, ele):
 
     This function takes a slab.Sound object, an azimuth angle, and an elevation
     angle, and returns a new slab.Binaural object with the sound convolved with
-    the corresponding KEMAR HRTF.
+    the corresponding KEMAR HRTF. The HRTF, the location lookup and the
+    frequency-domain filters are cached at module level, so repeated calls only
+    cost one FFT of the sound.
 
     Args:
         sound (slab.Sound): The sound object to be spatialized.
@@ -152,15 +224,15 @@ def spatialize(sound, azi, ele):
         ValueError: If the specified azimuth and elevation combination is not
             found in the KEMAR HRTF.
     """
-    if azi > 0:
-        azi = azi + 180
-    if azi < 0:
-        azi = abs(azi)
-    hrtf = slab.HRTF.kemar()  # Load the KEMAR HRTF
-    idx = np.where((hrtf.sources.vertical_polar[:, 0] == azi) & (hrtf.sources.vertical_polar[:, 1] == ele))[0]
-    if not idx.size:  # idx is empty
-        raise ValueError(f'No azimuth {azi}°, elevation {ele}° found in HRTF.')
-    return hrtf.apply(idx[0], sound)  # Apply the HRTF to the sound
+    idx = get_hrtf_source_index(azi, ele)
+    hrtf = get_hrtf()
+    if sound.samplerate != hrtf.samplerate or sound.n_channels > 2:
+        return hrtf.apply(idx, sound)  # let slab resample or complain
+    n_fft, filt_rfft = get_hrtf_filter(idx, sound.samplerate, sound.n_samples)
+    n_out = sound.n_samples + hrtf[idx].data.shape[0] - 1  # length of the full convolution
+    sound_rfft = np.fft.rfft(sound.data, n=n_fft, axis=0)  # mono is broadcast to both ears
+    out = np.fft.irfft(sound_rfft * filt_rfft, n=n_fft, axis=0)[:n_out]
+    return slab.Binaural(out, samplerate=sound.samplerate)
 
 
 def rms(signal):
@@ -184,6 +256,25 @@ def snr_sound_mixture_two_ears(signal, noise):
     return snr_left, snr_right
 
 
+def snr_two_ears_batched(signal, noise):
+    """
+    Computes the left and right ear SNR of many sound mixtures at once.
+
+    Same RMS ratio as snr_sound_mixture_two_ears(), but on stacked arrays instead of one slab.Binaural per trial.
+
+    Args:
+        signal (numpy.ndarray): target sounds, shape (n_trials, n_samples, 2).
+        noise (numpy.ndarray): summed distractor sounds, same shape as `signal`.
+
+    Returns:
+        numpy.ndarray: shape (n_trials, 2), the SNR of the left and right ear. NaN for trials without noise.
+    """
+    rms_signal = np.sqrt(np.mean(np.square(signal, dtype=np.float64), axis=1))
+    rms_noise = np.sqrt(np.mean(np.square(noise, dtype=np.float64), axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(rms_noise > 0, rms_signal / rms_noise, np.nan)
+
+
 if __name__ == '__main__':
     # load up sound
     input_file = "C:\\PycharmProjects\\psychopy-experiments\\stimuli\\digits_all_250ms\\1.wav"
@@ -1,5 +1,7 @@
 import sys
 import os
+import numpy as np
+from utils.latency_calibration import device_latency
 os.environ['SD_ENABLE_ASIO'] = '1'
 
 
@@ -8,15 +10,22 @@ class SoundDeviceSound(object):
 	class for playing low-latency sound on all platforms
 	'''
 
-	def __init__(self, filename='', device=None, mul=1, data=None, sr=None):
+	def __init__(self, filename='', device=None, mul=1, data=None, sr=None, engine=None):
 		'''
 		filename: a sound file supported by libsndfile
 		device: portaudio device used for playback
 		check for devices by running python -m sounddevice
 		or sounddevice.query_devices()
-		mul: volume multiplier
+		mul: volume multiplier (gain in dB), see _scale()
+		engine: utils.audio_engine.AudioEngine shared by the session. If given, play() mixes
+		the sound into its open stream instead of opening a new one with sounddevice.play()
+		latency: seconds from play() to the sound onset on this device, from the profile written by
+		utils/latency_calibration.py (0.08 for devices that were never calibrated)
 		'''
 		self.filename = filename
+		self.engine = engine
+		self.voice = None
+		self.gain = 1.0
 		if filename == '' and data is None:
 			print
 			'no filename specified'
@@ -40,48 +49,88 @@ class SoundDeviceSound(object):
 		except ImportError:
 			print('sounddevice module missing, but it is necessary for sound playback')
 			sys.exit()
+		self.latency = device_latency(device, self.sd)
+		self._owns_data = False  # data passed in (e.g. SoundBank views shared between trials) is never changed
 		if isinstance(filename, str) and data is None:
 			self.data, self.sr = sf.read(filename, dtype='float32')
+			self._owns_data = True
 		elif data is not None:
 			self.data = data
 		if sr is not None:
 			self.sr = sr
-		self.data = self.data * (10 ** (mul / 20))
+		self._scale(mul)
 
 		self.duration = self.data.shape[0] / self.sr
 		self._isPlaying = False
 		self._isFinished = False
 
 	def is_playing(self):
-		"""`True` if the audio playback is ongoing."""
+		"""`True` from play() until stop() or wait(), also after the sound ended. See is_finished()."""
 		return self._isPlaying
 
 	def is_finished(self):
 		"""`True` if the audio playback has completed."""
+		if self.voice is not None:
+			return self.voice.is_finished()
 		return self._isFinished
 
 	def get_duration(self):
 		return self.duration
 
-	def play(self, **kwargs):
+	def play(self, when=None, **kwargs):
+		'''
+		when: stream time (engine.time()) of the first sample, only used with an engine
+		kwargs: passed to sounddevice.play(). With an engine, only mapping (1-based output channels) is used
+		'''
 		self._isPlaying = True
 		self._isFinished = False
+		if self.engine is not None:
+			mapping = kwargs.get('mapping')
+			channels = None if mapping is None else [int(m) - 1 for m in np.atleast_1d(mapping)]
+			self.voice = self.engine.play(self.data, channels=channels, when=when, gain=self.gain)
+			return self.voice
 		self.sd.play(data=self.data, samplerate=self.sr, device=self.device, **kwargs)
 
 	def stop(self):
 		self._isPlaying = False
 		self._isFinished = True
-		self.sd.stop()
+		if self.voice is not None:
+			self.voice.stop()
+		else:
+			self.sd.stop()
 
 	def wait(self):
 		self._isPlaying = False
-		self.sd.wait()
+		if self.voice is not None:
+			self.voice.wait()
+		else:
+			self.sd.wait()
 
 	def change_volume(self, mul=1):
 		if mul > 120:
 			print(self.too_high_vol_txt)
 		else:
-			self.data = self.data * (10 ** (mul / 20))
+			self._scale(mul)
+
+	def _scale(self, mul):
+		'''
+		applies a gain of mul dB
+		with an engine, the gain is applied per voice while mixing and also reaches a playing voice,
+		so the samples are never copied. otherwise the data is scaled once: in place if this sound
+		read it from its file, into a copy if it was passed in or cannot be written (e.g. memory maps)
+		'''
+		if not mul:
+			return
+		gain = 10 ** (mul / 20)
+		if self.engine is not None:
+			self.gain *= gain
+			if self.voice is not None:
+				self.voice.gain = self.gain
+		elif self._owns_data and self.data.dtype == np.float32 and self.data.flags.writeable:
+			self.data *= np.float32(gain)
+		else:
+			self.data = np.multiply(self.data, gain, dtype=np.float32)
+			self._owns_data = True
 
 
 if __name__ == "__main__":
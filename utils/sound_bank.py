@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import soundfile
+
+
+class SoundBank:
+    """
+    All sounds of one stimulus directory in a single float32 array.
+
+    Every file is read once, and the playback gain is applied once, in place. Sounds are views into
+    the array, indexed by position (sorted file names, so "1.wav" is 0) or by file name.
+
+    Args:
+        directory (str): directory with the sound files.
+        mul (float): gain in dB, same meaning as in SoundDeviceSound.
+    """
+
+    def __init__(self, directory, mul=0):
+        self.directory = directory
+        self.mul = mul
+        self.names = sorted(os.listdir(directory))
+        sounds = [soundfile.read(os.path.join(directory, name), dtype="float32", always_2d=True) for name in self.names]
+        samplerates = set(samplerate for _, samplerate in sounds)
+        channels = set(data.shape[1] for data, _ in sounds)
+        if len(samplerates) != 1 or len(channels) != 1:
+            raise ValueError(f"Sounds in {directory} differ in samplerate or channel count.")
+        self.samplerate = samplerates.pop()
+        lengths = [len(data) for data, _ in sounds]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        self.index = {name: slice(int(start), int(stop)) for name, start, stop in zip(self.names, offsets[:-1], offsets[1:])}
+        self.data = np.concatenate([data for data, _ in sounds])
+        self.data *= np.float32(10 ** (mul / 20))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, key):
+        """View of one sound, by position or by file name. Mono sounds are returned 1-D, like soundfile does."""
+        name = self.names[key] if isinstance(key, int) else key
+        data = self.data[self.index[name]]
+        return data[:, 0] if data.shape[1] == 1 else data
+
+    def as_sounds(self, device=None, engine=None):
+        """
+        Wraps every sound of the bank in a SoundDeviceSound without copying its samples.
+
+        Returns:
+            list: SoundDeviceSound per file, in the order of `names`.
+        """
+        from utils.sound import SoundDeviceSound
+        return [SoundDeviceSound(data=self[i], sr=self.samplerate, device=device, mul=0, engine=engine)
+                for i in range(len(self))]
+
+
+# banks of this process, so every session, test and script shares one copy per directory and gain
+_banks = dict()
+
+
+def load_sound_bank(directory, mul=0):
+    """Returns the SoundBank of `directory` at gain `mul`, loading it only the first time."""
+    key = (os.path.abspath(directory), mul)
+    if key not in _banks:
+        _banks[key] = SoundBank(directory, mul=mul)
+    return _banks[key]
@@ -0,0 +1,87 @@
+import collections
+import numpy as np
+
+# stimulus attributes that change what a layer looks like
+_STATE_ATTRIBUTES = ("pos", "ori", "size", "height", "opacity", "fillColor", "lineColor", "color", "text")
+
+
+def _freeze(value):
+    if isinstance(value, np.ndarray):
+        return tuple(value.ravel().tolist())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _stimulus_state(stimulus):
+    state = [id(stimulus)]
+    for attribute in _STATE_ATTRIBUTES:
+        try:
+            state.append(_freeze(getattr(stimulus, attribute)))
+        except Exception:  # not every stimulus has every attribute, and some getters fail before the first draw
+            state.append(None)
+    return tuple(state)
+
+
+class StaticLayer:
+    """
+    Stimuli that only change at phase or trial boundaries, drawn as one cached image.
+
+    Sessions put the fixation cross, the cue and the virtual response box in layers, which they enable with
+    mode.static_layers, so every frame draws one image per layer instead of every stimulus.
+
+    The first draw() composites the stimuli into a psychopy.visual.BufferImageStim; every following frame
+    only draws that one textured quad. Before drawing, the positions, colours and texts of the stimuli are
+    compared with those of the cached image and the image is rebuilt if anything changed, so code may move or
+    recolour the stimuli as before. The images of the last `cache_size` states are kept: a layer that toggles
+    between a few looks (e.g. the box outline in black and in red) is captured once per look.
+
+    Capturing reads the back buffer, which BufferImageStim clears, so a layer must be drawn first in a
+    frame, before any other stimulus. The image covers the whole window and hides everything drawn before.
+
+    Example::
+
+        layer = StaticLayer(win, [session.default_fix] + session.arrows)
+        # in Trial.draw()
+        layer.draw()
+
+    Args:
+        win (psychopy.visual.Window): window of the stimuli.
+        stimuli (list): stimuli in drawing order. May be replaced later via the attribute.
+        enabled (bool): with False, draw() draws the stimuli one by one, as without the layer.
+        cache_size (int): number of cached images.
+    """
+
+    def __init__(self, win, stimuli, enabled=True, cache_size=8):
+        self.win = win
+        self.stimuli = list(stimuli)
+        self.enabled = enabled
+        self.cache_size = cache_size
+        self._images = collections.OrderedDict()  # state -> BufferImageStim, least recently used first
+        self.n_builds = 0
+
+    def draw(self):
+        if not self.enabled:
+            for stimulus in self.stimuli:
+                stimulus.draw()
+            return
+        state = tuple(_stimulus_state(stimulus) for stimulus in self.stimuli)
+        image = self._images.get(state)
+        if image is None:
+            image = self._build(state)
+        else:
+            self._images.move_to_end(state)
+        image.draw()
+
+    def invalidate(self):
+        """Drops all cached images, e.g. after changing an attribute the state comparison does not cover."""
+        self._images.clear()
+
+    def _build(self, state):
+        import psychopy.visual
+        image = psychopy.visual.BufferImageStim(self.win, stim=self.stimuli)
+        self.n_builds += 1
+        self._images[state] = image
+        if len(self._images) > self.cache_size:
+            self._images.popitem(last=False)
+        return image
@@ -0,0 +1,85 @@
+from collections.abc import MutableMapping
+import numpy as np
+
+
+class TrialStore:
+    """
+    Trial sequence of one block as a NumPy structured array with one typed field per column.
+
+    It is built once in load_sequence(), so creating and running trials never touches pandas. Indexing
+    gives the TrialParameters view of one trial.
+
+    Args:
+        sequence (pandas.DataFrame): the block's trial sequence, one row per trial.
+    """
+
+    def __init__(self, sequence):
+        self.names = tuple(sequence.columns)
+        self.records = sequence.to_records(index=False)
+        self.columns = {name: self.records[name] for name in self.names}  # field views, not copies
+        # columns like "ITI-Jitter" are read as attributes with underscores, e.g. parameters.ITI_Jitter
+        self.attributes = {name.replace("-", "_").replace(" ", "_"): name for name in self.names}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, trial_nr):
+        return TrialParameters(self, trial_nr)
+
+
+class TrialParameters(MutableMapping):
+    """
+    Parameters of one trial: its row of a TrialStore plus the values set on it later (block, responses, ...).
+
+    Reads go straight to the store's arrays, as items (parameters["TargetLoc"]) or attributes
+    (parameters.TargetLoc). It behaves like the dict exptools2 expects as Trial.parameters: the full
+    parameter set is only assembled when the trial is logged and iterates over its items.
+    """
+
+    __slots__ = ("_store", "_trial_nr", "_extra")
+
+    def __init__(self, store, trial_nr):
+        self._store = store
+        self._trial_nr = trial_nr
+        self._extra = dict()
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        try:
+            value = self._store.columns[key][self._trial_nr]
+        except KeyError:
+            raise KeyError(key) from None
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[self._store.attributes.get(name, name)]
+        except KeyError:
+            raise AttributeError(f"Trial {self._trial_nr} has no parameter {name}.") from None
+
+    def __setitem__(self, key, value):
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._store.columns:
+            raise KeyError(f"{key} is a column of the trial sequence and cannot be deleted.")
+        del self._extra[key]
+
+    def __contains__(self, key):
+        return key in self._extra or key in self._store.columns
+
+    def __iter__(self):
+        yield from self._store.names
+        yield from (key for key in self._extra if key not in self._store.columns)
+
+    def __len__(self):
+        return len(self._store.names) + sum(key not in self._store.columns for key in self._extra)
+
+    def copy(self):
+        return dict(self)
+
+    def __repr__(self):
+        return f"TrialParameters({dict(self)})"
@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import logging
+import queue
+import sys
+import threading
+import time
+
+
+class MockParallelPort:
+    """
+    Stands in for psychopy.parallel.ParallelPort without hardware. Every setData() is recorded with its time.
+
+    The sessions use it when record_eeg is off, so the trigger log still shows when every trigger would
+    have been sent.
+
+    Args:
+        clock (callable): returns the current time in seconds, e.g. AudioEngine.time.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.writes = []  # (time, value)
+
+    def setData(self, value):
+        self.writes.append((self.clock(), value))
+
+
+def _raise_thread_priority(priority):
+    """
+    Asks the OS to run the calling thread above normal priority. Best effort, failures are only logged.
+
+    On Linux, the thread gets the real-time policy SCHED_FIFO with `priority` (1-99). On Windows, it gets
+    THREAD_PRIORITY_HIGHEST, which stays below the time-critical class of the audio driver.
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            thread_priority_highest = 2
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), thread_priority_highest)
+        else:
+            import os
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+    except (AttributeError, OSError) as e:
+        logging.info(f"TriggerScheduler: could not raise thread priority ({e}).")
+
+
+class TriggerScheduler:
+    """
+    Writes EEG triggers to a parallel port from a dedicated thread, at a given time of a clock.
+
+    schedule() only queues the trigger and returns at once, so sending a trigger never blocks the frame
+    loop. The thread keeps all due triggers in a heap and sleeps until `spin_time` before the next one.
+    Only that last stretch is busy-waited, yielding the GIL on every check, so the port write lands
+    within a fraction of a millisecond of its intended time without taking the frame loop's CPU time.
+    Triggers for a sound are timed by the DAC time the audio callback reports for its first sample
+    (Voice.onset_time). The callback reports it one output latency before the sample plays, so checking
+    for it every `poll_interval` still leaves time to fire on time. The port is reset to 0 by the same
+    thread after `pulse_duration`, without holding up any other trigger.
+
+    Pulses never overlap: a trigger that is due while the port is high, or within `pulse_duration`
+    after the reset, is postponed until the port is free again. A trigger with the same value as the
+    pulse that is still high is merged into it, because the amplifier could not tell them apart anyway.
+    Every trigger is kept in `records` with its intended and actual time and its status ("sent",
+    "merged", "missed" or "pending").
+
+    Args:
+        port: object with setData(value), e.g. psychopy.parallel.ParallelPort or MockParallelPort.
+        clock (callable): time in seconds on the same clock as the scheduled times, e.g. AudioEngine.time.
+        pulse_duration (float): seconds before the port is reset to 0.
+        spin_time (float): seconds before a trigger in which the thread busy-waits instead of sleeping.
+        poll_interval (float): seconds between checks whether the sound of a waiting trigger has started.
+            Keep it well below the output latency of the audio engine.
+        priority (int): SCHED_FIFO priority of the thread on Linux (1-99); any value raises the priority
+            on Windows. None keeps the normal priority. Keep it moderate, so the thread never starves the
+            render thread.
+    """
+
+    def __init__(self, port, clock=time.perf_counter, pulse_duration=0.002, spin_time=0.002, poll_interval=0.005,
+                 priority=10):
+        self.port = port
+        self.clock = clock
+        self.pulse_duration = pulse_duration
+        self.spin_time = spin_time
+        self.poll_interval = poll_interval
+        self.priority = priority
+        self.records = []
+        self._queue = queue.Queue()
+        # state of the dispatcher thread, only touched by it
+        self._due = []  # heap of (intended time, n, record)
+        self._n_due = itertools.count()
+        self._waiting = []  # (record, voice) of sounds that have not started yet
+        self._reset_time = None  # when the port goes back to 0, None while it is 0
+        self._last_value = None  # value and reset time of the last pulse, to merge duplicates into it
+        self._last_reset_time = -float("inf")
+        self._free_time = -float("inf")  # earliest time of the next pulse
+        self._thread = threading.Thread(target=self._run, name="TriggerScheduler", daemon=True)
+        self._thread.start()
+
+    def schedule(self, value, when=None, voice=None, name=None, **info):
+        """
+        Queues one trigger and returns immediately.
+
+        Args:
+            value (int): trigger value written to the port.
+            when (float): clock time of the trigger. Ignored if `voice` is given. If neither is given,
+                the trigger is sent as soon as possible.
+            voice (utils.audio_engine.Voice): fire when this sound's first sample reaches the DAC.
+            name (str): trigger name for the log.
+            **info: extra columns of the trigger record (trial number, block, ...).
+
+        Returns:
+            dict: the trigger record. "intended", "actual" and "status" are filled in by the thread.
+        """
+        if when is None and voice is None:
+            when = self.clock()
+        record = dict(info, name=name, value=value, intended=when, actual=None, status="pending")
+        self.records.append(record)
+        self._queue.put((record, voice))
+        return record
+
+    def close(self):
+        """Sends all queued triggers, then stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        if self.priority is not None:
+            _raise_thread_priority(self.priority)
+        closing = False
+        while True:
+            deadline = self._next_deadline()
+            if closing and deadline is None and not self._waiting:
+                return
+            # sleep on the queue, so new triggers are taken up at once, until shortly before the deadline
+            wake_time = None if deadline is None else deadline - self.spin_time
+            if self._waiting:
+                poll_time = self.clock() + self.poll_interval
+                wake_time = poll_time if wake_time is None else min(wake_time, poll_time)
+            timeout = None if wake_time is None else wake_time - self.clock()
+            if timeout is None or timeout > 0:
+                try:
+                    job = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._dispatch()  # checks whether the sounds of waiting triggers have started
+                    continue
+                if job is None:
+                    closing = True
+                else:
+                    self._add(*job)
+                continue
+            if deadline is not None:
+                while self.clock() < deadline:
+                    time.sleep(0)  # lets the frame loop have the GIL while spinning
+            self._dispatch()
+
+    def _add(self, record, voice):
+        if voice is None:
+            heapq.heappush(self._due, (record["intended"], next(self._n_due), record))
+        else:
+            self._waiting.append((record, voice))
+
+    def _next_deadline(self):
+        """Clock time of the next port write, None if no trigger is due and the port is 0."""
+        deadlines = []
+        if self._reset_time is not None:
+            deadlines.append(self._reset_time)
+        if self._due:
+            intended, _, record = self._due[0]
+            deadlines.append(intended if self._merges(record) else max(intended, self._free_time))
+        return min(deadlines) if deadlines else None
+
+    def _merges(self, record):
+        """`True` if the trigger is due while a pulse with the same value is on the port."""
+        return record["value"] == self._last_value and record["intended"] < self._last_reset_time
+
+    def _dispatch(self):
+        now = self.clock()
+        if self._reset_time is not None and now >= self._reset_time:
+            self.port.setData(0)
+            self._reset_time = None
+        still_waiting = []
+        for record, voice in self._waiting:
+            if voice.onset_time is not None:
+                record["intended"] = voice.onset_time
+                heapq.heappush(self._due, (record["intended"], next(self._n_due), record))
+            elif voice.is_finished():  # stopped before it started, there is nothing to mark
+                record["status"] = "missed"
+                logging.warning(f"TriggerScheduler: sound of trigger {record['name']} never started.")
+            else:
+                still_waiting.append((record, voice))
+        self._waiting = still_waiting
+        while self._due and self._due[0][0] <= now:
+            record = self._due[0][2]
+            if self._merges(record):
+                heapq.heappop(self._due)
+                record["status"] = "merged"
+                logging.info(f"Trigger {record['name']} ({record['value']}) merged into the pulse on the port.")
+                continue
+            if now < self._free_time:  # postponed until the previous pulse is over
+                break
+            heapq.heappop(self._due)
+            self._fire(record)
+            now = self.clock()
+
+    def _fire(self, record):
+        self.port.setData(record["value"])
+        record["actual"] = self.clock()
+        record["status"] = "sent"
+        self._reset_time = record["actual"] + self.pulse_duration
+        self._last_value = record["value"]
+        self._last_reset_time = self._reset_time
+        self._free_time = self._reset_time + self.pulse_duration
+        logging.info(f"Trigger {record['name']} ({record['value']}): intended {record['intended']:.6f}, "
+                     f"actual {record['actual']:.6f} ({(record['actual'] - record['intended']) * 1000:+.3f} ms)")